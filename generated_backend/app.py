@@ -1,11 +1,26 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from redis import Redis
-from rq import Queue, Worker
+from rq import Queue, Retry, Worker
 import os
+import hashlib
+import json
 import logging
+import time
 import psutil
-import subprocess
-import shutil
+from typing import Any, Callable, Dict, Optional, Tuple
+
+# orjson parses large po_text bodies several times faster; fall back to the stdlib
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+from fair_queue import FAIR_QUEUING, priority_queue_depths, subqueue_for, tenant_stats
+from doc_source import document_key
+from payload_store import DOC_TTL, store_text
+from profiling import PROFILE_KINDS, list_profiles, load_profile
+from system_stats import get_gpu_stats
+from workload_trace import WORKLOAD_TRACE, record_arrival
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -23,27 +38,90 @@ redis_conn = Redis(
     password=os.getenv('REDIS_PASSWORD', None)
 )
 
+# Retries: failed jobs are retried with a delay; completed LLM stages are
+# checkpointed by the worker, so a retry only redoes the unfinished work.
+JOB_RETRIES = int(os.getenv('JOB_RETRIES', 2))
+JOB_RETRY_INTERVALS = [60, 300, 900]
+# Requests for the same document enqueued within this many seconds share one inference
+FUSION_WINDOW = int(os.getenv('FUSION_WINDOW_SECONDS', 120))
+# Deadlines (opt-in): a job must finish within this many seconds of ingestion, or
+# within the request's 'deadline_seconds'; the worker aborts or trims work after it
+# and reports expiry to error_field_id. 0 = only requests that ask get a deadline.
+JOB_DEADLINE_SECONDS = int(os.getenv('JOB_DEADLINE_SECONDS', 0))
+JOB_TIMEOUT_SECONDS = 3600      # Run-time limit of a job (RQ job_timeout), deadline or not
+CANCEL_FLAG_TTL = 86400         # Cancel flags must outlive the queue wait of the flagged job
+# A newer request for the same record and request (see supersede_key) cancels the older job
+SUPERSEDE_JOBS = os.getenv('SUPERSEDE_JOBS', 'true').lower() == 'true'
+
 # Queues
 q_high = Queue('high', connection=redis_conn)
 q_default = Queue('default', connection=redis_conn)
 q_low = Queue('low', connection=redis_conn)
 q_long = Queue('long_docs', connection=redis_conn)
 
-def get_gpu_stats():
-    """Parses nvidia-smi for GPU usage."""
-    if not shutil.which('nvidia-smi'):
-        return {"load": 0, "memory": 0, "mem_used_mb": 0}
-    try:
-        # Get GPU Load and Memory Used
-        output = subprocess.check_output(
-            ["nvidia-smi", "--query-gpu=utilization.gpu,memory.used,memory.total", "--format=csv,noheader,nounits"],
-            encoding='utf-8'
-        )
-        util, mem_used, mem_total = map(int, output.strip().split(', '))
-        mem_percent = round((mem_used / mem_total) * 100, 1)
-        return {"load": util, "memory": mem_percent, "mem_used_mb": mem_used}
-    except Exception:
-        return {"load": 0, "memory": 0, "mem_used_mb": 0}
+# Payload Validation
+# Field name -> (accepted types, required). Compiled once at import into flat
+# tuples so validating a request is a single pass with no per-request setup.
+PROCESS_PO_SCHEMA = {
+    'record_id': ((int, str), True),
+    'po_text': ((str,), False),         # Either the text itself...
+    'source': ((dict,), False),         # ...or a QuickBase reference (see worker.fetch_source_text)
+    'target_table_id': ((str,), True),
+    'target_field_ids': ((dict,), True),
+    'prompt_json': ((dict,), True),
+    'priority': ((str,), False),
+    'request_name': ((str,), False),
+    'error_field_id': ((int, str), False),
+    'deadline_seconds': ((int, float), False),
+    'profile': ((bool, str), False),    # true, or "cpu" to also sample stacks (see profiling.py)
+    'force_reextract': ((bool,), False),  # Ignore answers kept from the previous revision
+}
+
+def compile_validator(schema: Dict[str, Tuple[Tuple[type, ...], bool]]) -> Callable[[Any], Optional[str]]:
+    """Returns a function that checks a payload and returns an error message, or None if valid."""
+    required = tuple(name for name, (_, is_required) in schema.items() if is_required)
+    typed = tuple((name, types, '/'.join(t.__name__ for t in types)) for name, (types, _) in schema.items())
+
+    def validate(payload: Any) -> Optional[str]:
+        if not isinstance(payload, dict):
+            return 'Payload must be a JSON object'
+        missing = [name for name in required if name not in payload]
+        if missing:
+            return f"Missing fields: {', '.join(missing)}"
+        for name, types, type_names in typed:
+            value = payload.get(name)
+            if value is not None and not isinstance(value, types):
+                return f"Field '{name}' must be {type_names}"
+        return None
+
+    return validate
+
+validate_process_po = compile_validator(PROCESS_PO_SCHEMA)
+
+def validate_source(data: Dict[str, Any]) -> Optional[str]:
+    """Exactly one of po_text / source; a source names the table and field holding the document."""
+    if ('po_text' in data) == ('source' in data):
+        return "Give either 'po_text' or 'source'"
+    source = data.get('source')
+    if source is None:
+        return None
+    if not isinstance(source.get('table_id'), str) or not isinstance(source.get('field_id'), (int, str)):
+        return "Field 'source' needs 'table_id' (str) and 'field_id' (int/str)"
+    if not isinstance(source.get('size', 0), int):
+        return "Field 'source.size' must be of type int"
+    return None
+
+def supersede_key(data: Dict[str, Any]) -> str:
+    """
+    Names the request a job answers for its record: the client's request_name, or
+    without one a hash of the schema, so unnamed requests with different prompts
+    or target fields never supersede each other.
+    """
+    request_id = data.get('request_name')
+    if not request_id:
+        schema = json.dumps([data['prompt_json'], data['target_field_ids']], sort_keys=True, default=str)
+        request_id = f"schema:{hashlib.sha256(schema.encode('utf-8')).hexdigest()[:16]}"
+    return f"latest_job:{data['target_table_id']}:{data['record_id']}:{request_id}"
 
 @app.route('/api/status', methods=['GET'])
 def get_status():
@@ -58,19 +136,27 @@ def get_status():
         logs = [log.decode('utf-8') for log in raw_logs]
 
         # 2. Queue Depths
-        queues = {
-            "high": len(q_high),
-            "default": len(q_default),
-            "low": len(q_low),
-            "long_docs": len(q_long)
-        }
+        queues = priority_queue_depths(redis_conn, [q_high.name, q_default.name, q_low.name, q_long.name])
         total_depth = sum(queues.values())
 
         # 3. Worker Status
         workers = Worker.all(connection=redis_conn)
         active_count = sum(1 for w in workers if w.state == 'busy')
         
-        # 4. System Resources
+        # 4. Worker Metrics (counters pushed by worker.record_metric)
+        raw_metrics = redis_conn.hgetall("worker_metrics")
+        metrics = {k.decode('utf-8'): float(v) for k, v in raw_metrics.items()}
+
+        # 5. Re-query outcomes per key, hardest keys first
+        requery = {}
+        for field, count in redis_conn.hgetall("requery_stats").items():
+            key, _, outcome = field.decode('utf-8').rpartition(':')
+            requery.setdefault(key, {"attempted": 0, "recovered": 0})[outcome] = int(count)
+        for stats in requery.values():
+            stats["recovery_rate"] = round(stats["recovered"] / stats["attempted"], 3) if stats["attempted"] else None
+        hard_keys = dict(sorted(requery.items(), key=lambda kv: (kv[1]["recovery_rate"] or 0, -kv[1]["attempted"]))[:20])
+
+        # 6. System Resources
         sys_stats = {
             "cpu": psutil.cpu_percent(interval=None),
             "ram": psutil.virtual_memory().percent,
@@ -84,6 +170,9 @@ def get_status():
             "working_count": active_count,
             "queues": queues,
             "system": sys_stats,
+            "metrics": metrics,
+            "requery_keys": hard_keys,
+            "tenants": tenant_stats(redis_conn, list(queues.keys())),
             "logs": logs
         })
     except Exception as e:
@@ -97,15 +186,20 @@ def process_po():
         return jsonify({'error': 'Unauthorized'}), 401
 
     try:
-        data = request.get_json()
-        
-        required_fields = ['record_id', 'po_text', 'target_table_id', 'target_field_ids', 'prompt_json']
-        if any(f not in data for f in required_fields):
-            return jsonify({'error': 'Missing fields'}), 400
+        try:
+            data = json_loads(request.get_data(cache=False))
+        except ValueError:
+            return jsonify({'error': 'Invalid JSON body'}), 400
+
+        error = validate_process_po(data) or validate_source(data)
+        if error:
+            return jsonify({'error': error}), 400
 
         # Routing Logic
-        priority = data.get('priority', 'normal').lower()
-        text_len = len(data.get('po_text', '') or "")
+        request_name = data.get('request_name', 'Unknown Request')
+        priority = (data.get('priority') or 'normal').lower()
+        # Referenced documents are routed by the optional size hint (bytes) of the automation
+        text_len = len(data['po_text'] or "") if 'po_text' in data else data['source'].get('size', 0)
         LONG_DOC_THRESHOLD = 20000
         
         selected_queue = q_default
@@ -124,18 +218,63 @@ def process_po():
             selected_queue = q_default
             queue_name = "default"
 
-        from worker import process_po_job
+        if FAIR_QUEUING:
+            # One sub-queue per tenant inside the priority queue (see fair_queue.FairWorker)
+            selected_queue = subqueue_for(redis_conn, queue_name, data)
+
+        # Absolute deadline, carried by the job (see worker.check_abort)
+        deadline_seconds = data.pop('deadline_seconds', None) or JOB_DEADLINE_SECONDS
+        if deadline_seconds:
+            data['deadline'] = time.time() + max(1, deadline_seconds)
+
+        # Store the document out-of-band; the job only carries its reference.
+        # Source references are fetched (and cached on disk) by the worker.
+        po_text = ""
+        if 'po_text' in data:
+            po_text = data.pop('po_text') or ""
+            data['po_text_ref'] = store_text(redis_conn, po_text)
+            data['po_text_len'] = text_len
+
+        # Enqueue by dotted path: the API never imports the worker module
         job = selected_queue.enqueue(
-            process_po_job,
+            'worker.process_po_job',
             args=(data,),
-            job_timeout='60m'
+            description=f"process_po_job record {data['record_id']} ({request_name})",
+            # RQ's own timeout is only a backstop; the worker stops at the deadline
+            job_timeout=max(JOB_TIMEOUT_SECONDS, int(deadline_seconds) + 60),
+            retry=Retry(max=JOB_RETRIES, interval=JOB_RETRY_INTERVALS[:JOB_RETRIES]) if JOB_RETRIES > 0 else None
         )
         
+        if SUPERSEDE_JOBS:
+            # Flag the previous job for this record/request; it exits or aborts its generation
+            latest_key = supersede_key(data)
+            pipe = redis_conn.pipeline(transaction=False)
+            pipe.getset(latest_key, job.get_id())
+            pipe.expire(latest_key, CANCEL_FLAG_TTL)
+            previous = pipe.execute()[0]
+            if previous:
+                redis_conn.set(f"job_cancel:{previous.decode('utf-8')}", 'superseded', ex=CANCEL_FLAG_TTL)
+
+        if FUSION_WINDOW > 0:
+            # Register for request fusion: the first job to run for this document
+            # absorbs siblings queued within the window (see worker.collect_fusion_group)
+            group_key = f"fusion:{document_key(data)}"
+            pipe = redis_conn.pipeline(transaction=False)
+            pipe.rpush(group_key, job.get_id())
+            pipe.expire(group_key, DOC_TTL)
+            pipe.execute()
+
+        if WORKLOAD_TRACE:
+            try:
+                record_arrival(redis_conn, data, queue_name, priority, po_text)
+            except Exception as e:
+                logger.warning(f"Could not record workload trace entry: {e}")
+
         logger.info(f"Enqueued record {data['record_id']} to {queue_name}")
         
         return jsonify({
             'status': 'queued',
-            'queue': queue_name,
+            'queue': selected_queue.name,
             'job_id': job.get_id(),
             'message': f'Record {data["record_id"]} added to {queue_name} queue'
         }), 202
@@ -143,5 +282,50 @@ def process_po():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    client_key = request.headers.get('X-API-Key')
+    if client_key != API_KEY:
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    try:
+        # Queued jobs exit when they start; a running job aborts its Ollama generation
+        redis_conn.set(f"job_cancel:{job_id}", 'cancelled', ex=CANCEL_FLAG_TTL)
+        return jsonify({'status': 'cancelling', 'job_id': job_id}), 202
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/profiles', methods=['GET'])
+def get_profiles():
+    client_key = request.headers.get('X-API-Key')
+    if client_key != API_KEY:
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    try:
+        limit = min(int(request.args.get('limit', 100)), 1000)
+        return jsonify({'profiles': list_profiles(redis_conn, limit)})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/profiles/<job_id>', methods=['GET'])
+def download_profile(job_id):
+    client_key = request.headers.get('X-API-Key')
+    if client_key != API_KEY:
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    # kind=trace: Chrome trace of the stage/call spans; kind=cpu: speedscope stack samples
+    kind = request.args.get('kind', 'trace')
+    if kind not in PROFILE_KINDS:
+        return jsonify({'error': f"kind must be one of: {', '.join(PROFILE_KINDS)}"}), 400
+    try:
+        blob = load_profile(redis_conn, job_id, kind)
+        if blob is None:
+            return jsonify({'error': f"No {kind} profile for job {job_id}"}), 404
+        return Response(blob, mimetype='application/json', headers={
+            'Content-Disposition': f'attachment; filename="{job_id}.{PROFILE_KINDS[kind]}"'
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000)
@@ -0,0 +1,214 @@
+"""
+Worker autoscaler: a supervisor that starts and retires worker processes.
+
+It reads queue depths and worker states (the same data /api/status shows) plus
+GPU memory, and keeps each worker pool between its min and max size.
+
+    python autoscaler.py                        # supervise workers
+    python autoscaler.py --record load.jsonl    # also record observations
+    python autoscaler.py --simulate load.jsonl  # replay a recorded trace, no processes
+
+Pools are configured with AUTOSCALE_POOLS (JSON), e.g.
+    [{"name": "standard", "queues": ["high", "default", "low"], "min": 1, "max": 3, "jobs_per_worker": 4},
+     {"name": "heavy", "queues": ["long_docs"], "min": 0, "max": 2, "jobs_per_worker": 1}]
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import signal
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+DEFAULT_POOLS = [
+    {"name": "standard", "queues": ["high", "default", "low"], "min": 1, "max": 3, "jobs_per_worker": 4},
+    {"name": "heavy", "queues": ["long_docs"], "min": 0, "max": 2, "jobs_per_worker": 1},
+]
+AUTOSCALE_POOLS: List[Dict[str, Any]] = json.loads(os.getenv('AUTOSCALE_POOLS', 'null')) or DEFAULT_POOLS
+AUTOSCALE_MAX_WORKERS = int(os.getenv('AUTOSCALE_MAX_WORKERS', 4))         # Across all pools
+AUTOSCALE_GPU_MEM_MAX = float(os.getenv('AUTOSCALE_GPU_MEM_MAX', 90))      # % GPU memory: no scale-up above
+AUTOSCALE_INTERVAL = int(os.getenv('AUTOSCALE_INTERVAL', 15))              # Seconds between ticks
+AUTOSCALE_UP_TICKS = int(os.getenv('AUTOSCALE_UP_TICKS', 2))               # Consecutive ticks before scaling up
+AUTOSCALE_DOWN_TICKS = int(os.getenv('AUTOSCALE_DOWN_TICKS', 8))           # ... and before scaling down
+AUTOSCALE_COOLDOWN = int(os.getenv('AUTOSCALE_COOLDOWN', 120))             # Seconds after a change to a pool
+
+class ScalingPolicy:
+    """
+    Decides pool sizes from one observation:
+    {"t": seconds, "queues": {name: depth}, "busy": {pool: n}, "gpu_mem": percent}.
+    Hysteresis: a pool only grows after wanting more for AUTOSCALE_UP_TICKS ticks in
+    a row, only shrinks after AUTOSCALE_DOWN_TICKS, and never changes twice within
+    AUTOSCALE_COOLDOWN seconds.
+    """
+
+    def __init__(self, pools: List[Dict[str, Any]]):
+        self.pools = pools
+        self.size = {p['name']: p['min'] for p in pools}
+        self._streak = {p['name']: 0 for p in pools}
+        self._last_change = {p['name']: float('-inf') for p in pools}
+
+    def desired(self, pool: Dict[str, Any], observation: Dict[str, Any]) -> int:
+        queued = sum(observation['queues'].get(q, 0) for q in pool['queues'])
+        busy = observation.get('busy', {}).get(pool['name'], 0)
+        wanted = busy + math.ceil(queued / max(1, pool.get('jobs_per_worker', 1)))
+        return max(pool['min'], min(pool['max'], wanted))
+
+    def decide(self, observation: Dict[str, Any]) -> Dict[str, int]:
+        now = observation['t']
+        gpu_full = observation.get('gpu_mem', 0) >= AUTOSCALE_GPU_MEM_MAX
+        # Shrinking first frees room under AUTOSCALE_MAX_WORKERS for pools that need to grow
+        targets = {p['name']: self.desired(p, observation) for p in self.pools}
+        for pool in sorted(self.pools, key=lambda p: targets[p['name']] - self.size[p['name']]):
+            name = pool['name']
+            current, target = self.size[name], targets[name]
+            if target > current and gpu_full:
+                target = current
+            direction = (target > current) - (target < current)
+            if direction == 0:
+                self._streak[name] = 0
+                continue
+            # Streak counts consecutive ticks wanting the same direction
+            self._streak[name] = self._streak[name] + direction if self._streak[name] * direction > 0 else direction
+            needed = AUTOSCALE_UP_TICKS if direction > 0 else AUTOSCALE_DOWN_TICKS
+            if abs(self._streak[name]) < needed or now - self._last_change[name] < AUTOSCALE_COOLDOWN:
+                continue
+            if direction > 0:
+                room = AUTOSCALE_MAX_WORKERS - sum(self.size.values())
+                target = current + min(target - current, max(0, room))
+                if target == current:
+                    continue
+            self.size[name] = target
+            self._streak[name] = 0
+            self._last_change[name] = now
+        return dict(self.size)
+
+class WorkerProcessManager:
+    """Starts `python worker.py` processes per pool and retires them with a warm shutdown."""
+
+    def __init__(self, pools: List[Dict[str, Any]]):
+        self.pools = {p['name']: p for p in pools}
+        self.procs: Dict[str, List[subprocess.Popen]] = {name: [] for name in self.pools}
+        self.worker_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'worker.py')
+
+    def reap(self):
+        for name, procs in self.procs.items():
+            for proc in [p for p in procs if p.poll() is not None]:
+                logger.warning(f"Worker {proc.pid} in pool {name} exited with {proc.returncode}")
+                procs.remove(proc)
+
+    def spawn(self, name: str):
+        env = dict(os.environ, WORKER_QUEUES=','.join(self.pools[name]['queues']))
+        proc = subprocess.Popen([sys.executable, self.worker_script], env=env)
+        self.procs[name].append(proc)
+        logger.info(f"Started worker {proc.pid} for pool {name} on {self.pools[name]['queues']}")
+
+    def retire(self, name: str, idle_pids: set):
+        # Prefer an idle worker; SIGTERM lets RQ finish the current job first
+        procs = self.procs[name]
+        proc = next((p for p in procs if p.pid in idle_pids), procs[-1])
+        proc.send_signal(signal.SIGTERM)
+        procs.remove(proc)
+        logger.info(f"Retiring worker {proc.pid} from pool {name}")
+
+    def apply(self, sizes: Dict[str, int], idle_pids: set):
+        for name, size in sizes.items():
+            while len(self.procs[name]) < size:
+                self.spawn(name)
+            while len(self.procs[name]) > size:
+                self.retire(name, idle_pids)
+
+    def shutdown(self):
+        for procs in self.procs.values():
+            for proc in procs:
+                proc.send_signal(signal.SIGTERM)
+        for procs in self.procs.values():
+            for proc in procs:
+                proc.wait()
+
+def observe(redis_conn, manager: WorkerProcessManager) -> Dict[str, Any]:
+    """Queue depths, busy workers per pool and GPU memory, like /api/status."""
+    from rq import Worker
+    from fair_queue import priority_queue_depths
+    from system_stats import get_gpu_stats
+
+    queue_names = sorted({q for p in manager.pools.values() for q in p['queues']})
+    states = {w.pid: w.state for w in Worker.all(connection=redis_conn)}
+    busy = {name: sum(1 for p in procs if states.get(p.pid) == 'busy') for name, procs in manager.procs.items()}
+    return {
+        "t": time.time(),
+        "queues": priority_queue_depths(redis_conn, queue_names),
+        "busy": busy,
+        "idle_pids": [pid for pid, state in states.items() if state == 'idle'],
+        "gpu_mem": get_gpu_stats()["memory"]
+    }
+
+def supervise(record_path: Optional[str]):
+    from redis import Redis
+
+    redis_conn = Redis(
+        host=os.getenv('REDIS_HOST', 'localhost'),
+        port=int(os.getenv('REDIS_PORT', 6379)),
+        password=os.getenv('REDIS_PASSWORD', None)
+    )
+    policy = ScalingPolicy(AUTOSCALE_POOLS)
+    manager = WorkerProcessManager(AUTOSCALE_POOLS)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    record = open(record_path, 'a') if record_path else None
+    try:
+        manager.apply(policy.size, set())
+        while True:
+            time.sleep(AUTOSCALE_INTERVAL)
+            manager.reap()
+            observation = observe(redis_conn, manager)
+            if record:
+                record.write(json.dumps(observation) + '\n')
+                record.flush()
+            sizes = policy.decide(observation)
+            manager.apply(sizes, set(observation['idle_pids']))
+    finally:
+        manager.shutdown()
+        if record:
+            record.close()
+
+def simulate(trace_path: str):
+    """Replays recorded observations through the policy and reports its decisions."""
+    policy = ScalingPolicy(AUTOSCALE_POOLS)
+    previous = dict(policy.size)
+    changes = {"up": 0, "down": 0}
+    worker_seconds = 0.0
+    last_t = None
+    with open(trace_path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            observation = json.loads(line)
+            if last_t is not None:
+                worker_seconds += sum(previous.values()) * (observation['t'] - last_t)
+            last_t = observation['t']
+            sizes = policy.decide(observation)
+            for name, size in sizes.items():
+                if size != previous[name]:
+                    changes["up" if size > previous[name] else "down"] += 1
+                    print(f"t={observation['t']:.0f} {name}: {previous[name]} -> {size} "
+                          f"(queues={observation['queues']}, gpu_mem={observation.get('gpu_mem', 0)})")
+            previous = sizes
+    print(f"Scale-ups: {changes['up']}, scale-downs: {changes['down']}, worker-hours: {worker_seconds / 3600:.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--record', help='append each observation to this JSONL file')
+    parser.add_argument('--simulate', help='replay a recorded JSONL trace instead of supervising')
+    args = parser.parse_args()
+    if args.simulate:
+        simulate(args.simulate)
+    else:
+        supervise(args.record)
+
+if __name__ == '__main__':
+    main()
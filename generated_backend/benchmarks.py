@@ -0,0 +1,303 @@
+"""
+Operational benchmarks for the AI processor.
+
+Run against the same Redis the services use, e.g.:
+    python benchmarks.py payload --jobs 200 --size-kb 150
+
+Benchmarks enqueue into scratch queues (prefixed 'bench_') that no production
+worker listens on, and clean up after themselves.
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import string
+import time
+from typing import Any, Dict, List
+
+from redis import Redis
+from rq import Queue
+
+from payload_store import doc_key, store_text
+
+redis_conn = Redis(
+    host=os.getenv('REDIS_HOST', 'localhost'),
+    port=int(os.getenv('REDIS_PORT', 6379)),
+    password=os.getenv('REDIS_PASSWORD', None)
+)
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+def synthetic_document(size_bytes: int, seed: int = 0) -> str:
+    """PO-like filler text: repeated clauses with varying numbers, roughly size_bytes long."""
+    rng = random.Random(seed)
+    lines = []
+    total = 0
+    while total < size_bytes:
+        word = ''.join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 9)))
+        line = (f"Item {rng.randint(1, 999)}: {word} delivered by {rng.randint(1, 12)}/{rng.randint(1, 28)}/2025, "
+                f"quantity {rng.randint(1, 500)} at ${rng.randint(10, 9999)}.{rng.randint(0, 99):02d} each.")
+        lines.append(line)
+        total += len(line) + 1
+    return '\n'.join(lines)[:size_bytes]
+
+def sample_payload(record_id: int, text: str) -> Dict[str, Any]:
+    return {
+        "record_id": record_id,
+        "po_text": text,
+        "target_table_id": "bench_table",
+        "target_field_ids": {"payment_terms": 6},
+        "prompt_json": {"payment_terms": "What are the payment terms?"},
+        "request_name": "benchmark"
+    }
+
+def bench_payload(args):
+    """Redis memory per queued job and enqueue latency: inline po_text vs out-of-band reference."""
+    queue = Queue(args.queue, connection=redis_conn)
+    text = synthetic_document(args.size_kb * 1024)
+
+    for mode in ('inline', 'reference'):
+        queue.empty()
+        latencies = []
+        job_bytes = 0
+        doc_refs = set()
+        for i in range(args.jobs):
+            # Vary the tail so content-hash deduplication does not flatter the numbers
+            data = sample_payload(i, f"{text}\nRecord {i}")
+            started = time.perf_counter()
+            if mode == 'reference':
+                po_text = data.pop('po_text')
+                data['po_text_ref'] = store_text(redis_conn, po_text)
+                data['po_text_len'] = len(po_text)
+                doc_refs.add(data['po_text_ref'])
+            job = queue.enqueue('worker.process_po_job', args=(data,), job_timeout='60m',
+                                description=f"benchmark record {i}")
+            latencies.append((time.perf_counter() - started) * 1000)
+            job_bytes += redis_conn.memory_usage(job.key) or 0
+
+        doc_bytes = sum(redis_conn.memory_usage(doc_key(ref)) or 0 for ref in doc_refs)
+        print(f"[{mode}] {args.jobs} jobs x {args.size_kb} KB on '{args.queue}'")
+        print(f"  job hash bytes/job:   {job_bytes / args.jobs:,.0f}")
+        print(f"  doc blob bytes/job:   {doc_bytes / args.jobs:,.0f}")
+        print(f"  enqueue p50/p99 (ms): {percentile(latencies, 50):.2f} / {percentile(latencies, 99):.2f}")
+
+        queue.empty()
+        if doc_refs:
+            redis_conn.delete(*[doc_key(ref) for ref in doc_refs])
+
+def bench_ingest(args):
+    """Requests/second and p99 latency of POST /api/process_po for 1 KB and 200 KB payloads (in-process)."""
+    os.environ.setdefault('API_KEY', 'benchmark')
+    import app as api
+
+    # Route every queue to a scratch queue so no worker picks the jobs up
+    scratch = Queue(args.queue, connection=redis_conn)
+    api.q_high = api.q_default = api.q_low = api.q_long = scratch
+    client = api.app.test_client()
+    headers = {'X-API-Key': api.API_KEY, 'Content-Type': 'application/json'}
+
+    for size_kb in (1, 200):
+        text = synthetic_document(size_kb * 1024)
+        bodies = [json.dumps(sample_payload(i, f"{text}\nRecord {i}")) for i in range(args.requests)]
+        latencies = []
+        started = time.perf_counter()
+        for body in bodies:
+            t0 = time.perf_counter()
+            response = client.post('/api/process_po', data=body, headers=headers)
+            latencies.append((time.perf_counter() - t0) * 1000)
+            if response.status_code != 202:
+                raise SystemExit(f"Unexpected response {response.status_code}: {response.get_data(as_text=True)}")
+        elapsed = time.perf_counter() - started
+
+        print(f"[{size_kb} KB] {args.requests} requests")
+        print(f"  throughput:       {args.requests / elapsed:,.1f} req/s")
+        print(f"  p50/p99 (ms):     {percentile(latencies, 50):.2f} / {percentile(latencies, 99):.2f}")
+
+        refs = {hashlib.sha256(json.loads(body)['po_text'].encode('utf-8')).hexdigest() for body in bodies}
+        scratch.empty()
+        redis_conn.delete(*[doc_key(ref) for ref in refs], *[f"fusion:{ref}" for ref in refs])
+
+def tiny_po_job(data: Dict[str, Any]) -> int:
+    """Benchmark job: a tiny PO's per-job work (text fetch, preprocessing, prompt build, optional Ollama call)."""
+    import worker
+
+    text = worker.prepare_text(worker.load_po_text(data))
+    if data.get('call_ollama'):
+        worker.query_ollama(text, data['prompt_json'])
+    else:
+        worker.get_prompt_template(data['prompt_json'])
+    return len(text)
+
+def bench_worker(args):
+    """Per-job overhead for tiny documents: forking Worker vs non-forking WarmWorker (burst mode)."""
+    from rq import Worker
+    from rq.job import Job
+    from warm_worker import WarmWorker
+
+    queue = Queue(args.queue, connection=redis_conn)
+    text = synthetic_document(1024)
+    ref = store_text(redis_conn, text)
+    if args.with_ollama:
+        print(f"Calling Ollama at {os.getenv('OLLAMA_URL', 'http://localhost:11434/api/generate')} "
+              f"(use `python replay.py stub` for a fixed-latency backend)")
+
+    for mode, worker_class in (('fork', Worker), ('warm', WarmWorker)):
+        queue.empty()
+        job_ids = []
+        for i in range(args.jobs):
+            data = sample_payload(i, '')
+            data.pop('po_text')
+            data.update(po_text_ref=ref, po_text_len=len(text), call_ollama=args.with_ollama)
+            job_ids.append(queue.enqueue('benchmarks.tiny_po_job', args=(data,), job_timeout='5m').id)
+
+        started = time.perf_counter()
+        worker_class([queue], connection=redis_conn).work(burst=True, logging_level='WARNING')
+        elapsed = time.perf_counter() - started
+
+        jobs = [job for job in Job.fetch_many(job_ids, connection=redis_conn) if job is not None]
+        in_job = [(job.ended_at - job.started_at).total_seconds() * 1000 for job in jobs
+                  if job.ended_at and job.started_at]
+        failed = sum(1 for job in jobs if job.get_status(refresh=False) == 'failed')
+        print(f"[{mode}] {args.jobs} tiny jobs on '{args.queue}' ({failed} failed)")
+        print(f"  wall time/job (ms):     {elapsed / args.jobs * 1000:.1f}")
+        print(f"  in-job p50/p99 (ms):    {percentile(in_job, 50):.1f} / {percentile(in_job, 99):.1f}")
+
+    queue.empty()
+    redis_conn.delete(doc_key(ref))
+
+def bench_preemption(args):
+    """Latency of 'high' records behind long_docs work under a mixed load, preemption off vs on."""
+    import subprocess
+    import sys
+    from rq.job import Job
+
+    stub = args.stub.rstrip('/')
+    high_queue = Queue('bench_high', connection=redis_conn)
+    long_queue = Queue('bench_long_docs', connection=redis_conn)
+    long_text = synthetic_document(args.long_kb * 1024, seed=1)
+    high_text = synthetic_document(args.high_kb * 1024, seed=2)
+    refs = {'long': store_text(redis_conn, long_text), 'high': store_text(redis_conn, high_text)}
+    lengths = {'long': len(long_text), 'high': len(high_text)}
+    env = {
+        **os.environ,
+        'OLLAMA_URL': f"{stub}/api/generate",
+        'QUICKBASE_URL': f"{stub}/v1/records",
+        'QUICKBASE_FIELDS_URL': f"{stub}/v1/fields",
+        'WORKER_QUEUES': 'bench_high,bench_long_docs',
+        'PREEMPT_QUEUE': 'bench_high',
+        'PREEMPT_MIN_REMAINING_SECONDS': '0',
+        'OLLAMA_SLOTS': str(args.ollama_slots),
+        'FAIR_QUEUING': 'false',
+        'FUSION_WINDOW_SECONDS': '0',
+        'REVISION_DIFF': 'false',
+        'MICROBATCH_ENABLED': 'false',
+        'EXPERIMENT_FRACTION': '0'
+    }
+    print(f"Using the stub at {stub} (`python replay.py stub --parallel {max(1, args.ollama_slots)}`), "
+          f"{args.workers} worker(s) on bench_high,bench_long_docs")
+
+    def enqueue(queue: Queue, kind: str, record_id: str) -> str:
+        data = sample_payload(0, '')
+        data.pop('po_text')
+        data['prompt_json'] = {**data['prompt_json'], "document_summary": "Summarize the document."}
+        data['target_field_ids'] = {**data['target_field_ids'], "document_summary": 7}
+        data.update(record_id=record_id, po_text_ref=refs[kind], po_text_len=lengths[kind],
+                    priority='high' if kind == 'high' else 'low')
+        return queue.enqueue('worker.process_po_job', args=(data,), job_timeout='2h').id
+
+    def final_job(job_id: str) -> Job:
+        """Last job of a preemption chain (each continuation is recorded in meta['continued_as'])."""
+        job = Job.fetch(job_id, connection=redis_conn)
+        while job.meta.get('continued_as'):
+            job = Job.fetch(job.meta['continued_as'], connection=redis_conn)
+        return job
+
+    for mode in ('off', 'on'):
+        high_queue.empty()
+        long_queue.empty()
+        before = float(redis_conn.hget("worker_metrics", "jobs_preempted") or 0)
+        workers = [subprocess.Popen([sys.executable, 'worker.py'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                    env={**env, 'PREEMPTION': 'true' if mode == 'on' else 'false'},
+                                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                   for _ in range(args.workers)]
+        try:
+            long_ids = [enqueue(long_queue, 'long', f"{mode}-long-{i}") for i in range(args.long_jobs)]
+            time.sleep(args.warmup)
+            high_ids = []
+            for i in range(args.high_jobs):
+                high_ids.append(enqueue(high_queue, 'high', f"{mode}-high-{i}"))
+                time.sleep(args.high_interval)
+
+            deadline = time.time() + args.timeout
+            while time.time() < deadline:
+                jobs = [final_job(job_id) for job_id in long_ids + high_ids]
+                if all(job.get_status() in ('finished', 'failed') for job in jobs):
+                    break
+                time.sleep(1)
+        finally:
+            for process in workers:
+                process.terminate()
+            for process in workers:
+                process.wait()
+
+        high_jobs = [Job.fetch(job_id, connection=redis_conn) for job_id in high_ids]
+        high_latency = [(job.ended_at - job.enqueued_at).total_seconds() for job in high_jobs if job.ended_at]
+        long_done = []
+        for job_id in long_ids:
+            first, last = Job.fetch(job_id, connection=redis_conn), final_job(job_id)
+            if last.ended_at:
+                long_done.append((last.ended_at - first.enqueued_at).total_seconds())
+        preempted = float(redis_conn.hget("worker_metrics", "jobs_preempted") or 0) - before
+        print(f"[preemption {mode}] {len(high_latency)}/{len(high_ids)} high and "
+              f"{len(long_done)}/{len(long_ids)} long jobs finished, {preempted:.0f} yields")
+        print(f"  high latency p50/p95 (s):   {percentile(high_latency, 50):.1f} / {percentile(high_latency, 95):.1f}")
+        print(f"  long completion max (s):    {max(long_done, default=0):.1f}")
+
+    high_queue.empty()
+    long_queue.empty()
+    redis_conn.delete(*[doc_key(ref) for ref in refs.values()])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('payload', help=bench_payload.__doc__)
+    p.add_argument('--jobs', type=int, default=100)
+    p.add_argument('--size-kb', type=int, default=100)
+    p.add_argument('--queue', default='bench_long_docs')
+    p.set_defaults(func=bench_payload)
+
+    p = sub.add_parser('ingest', help=bench_ingest.__doc__)
+    p.add_argument('--requests', type=int, default=500)
+    p.add_argument('--queue', default='bench_ingest')
+    p.set_defaults(func=bench_ingest)
+
+    p = sub.add_parser('worker', help=bench_worker.__doc__)
+    p.add_argument('--jobs', type=int, default=200)
+    p.add_argument('--queue', default='bench_worker')
+    p.add_argument('--with-ollama', action='store_true', help='include one Ollama call per job (OLLAMA_URL)')
+    p.set_defaults(func=bench_worker)
+
+    p = sub.add_parser('preemption', help=bench_preemption.__doc__)
+    p.add_argument('--stub', default='http://localhost:8099', help='replay.py stub (fake Ollama + QuickBase)')
+    p.add_argument('--workers', type=int, default=1)
+    p.add_argument('--long-jobs', type=int, default=3)
+    p.add_argument('--long-kb', type=int, default=80)
+    p.add_argument('--high-jobs', type=int, default=6)
+    p.add_argument('--high-kb', type=int, default=2)
+    p.add_argument('--high-interval', type=float, default=7.0, help='seconds between high arrivals')
+    p.add_argument('--warmup', type=float, default=3.0, help='seconds before the first high arrival')
+    p.add_argument('--ollama-slots', type=int, default=0, help='OLLAMA_SLOTS for the workers (0 = off)')
+    p.add_argument('--timeout', type=int, default=1800)
+    p.set_defaults(func=bench_preemption)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == '__main__':
+    main()
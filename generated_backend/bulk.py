@@ -0,0 +1,210 @@
+"""
+Offline bulk processing: runs worker.process_po_job over many documents in one
+process, without the API or RQ. Meant for backfills and migrations.
+
+    python bulk.py records.jsonl --out results.jsonl --parallel 4
+    python bulk.py docs/ --schema schema.json --out results.jsonl --dry-run
+
+Input is either a JSONL file with one /api/process_po payload per line, or a
+directory of .txt documents (record ID = file name without extension) plus a
+--schema JSON file holding target_table_id, target_field_ids and prompt_json
+(and optionally request_name / error_field_id).
+
+Finished records are appended to a progress file (default <out or input>.progress),
+so re-running the same command resumes where it stopped. Results are streamed to
+--out and, unless --dry-run is given, upserted to QuickBase in batches of
+--batch-size records per table. --dry-run never calls QuickBase, and keeps its
+progress apart (default <out or input>.dryrun.progress) so a later real run
+still writes every record.
+
+--parallel only helps if Ollama serves requests concurrently (OLLAMA_NUM_PARALLEL).
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from requests.adapters import HTTPAdapter
+
+import worker
+
+REQUIRED_FIELDS = ('record_id', 'target_table_id', 'target_field_ids', 'prompt_json')   # Plus po_text or source
+
+def read_inputs(path: str, schema_path: Optional[str]) -> Iterator[Dict[str, Any]]:
+    """Yields payloads lazily, so large inputs are never held in memory at once."""
+    if os.path.isdir(path):
+        if not schema_path:
+            raise SystemExit("--schema is required when the input is a directory")
+        with open(schema_path) as f:
+            schema = json.load(f)
+        for name in sorted(os.listdir(path)):
+            if name.endswith('.txt'):
+                with open(os.path.join(path, name), encoding='utf-8', errors='replace') as f:
+                    yield {**schema, "record_id": os.path.splitext(name)[0], "po_text": f.read()}
+    else:
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+def record_key(data: Dict[str, Any]) -> str:
+    return f"{data.get('target_table_id', '')}:{data.get('record_id')}:{data.get('request_name', '')}"
+
+def run_one(data: Dict[str, Any]) -> Tuple[str, List[Tuple[Dict[str, Any], Dict[str, Any]]], Optional[Exception], float]:
+    """Runs the pipeline for one payload; returns (outcome, results, error, seconds)."""
+    started = time.time()
+    captured: List[Tuple[Dict[str, Any], Dict[str, Any]]] = []
+    missing = [name for name in REQUIRED_FIELDS if name not in data]
+    if 'po_text' not in data and 'source' not in data:
+        missing.append('po_text (or source)')
+    if missing:
+        return "Failed", captured, ValueError(f"Missing fields: {', '.join(missing)}"), 0.0
+    try:
+        outcome = worker.process_po_job(data, sink=captured.extend)
+        return outcome, captured, None, time.time() - started
+    except Exception as e:
+        return "Failed", captured, e, time.time() - started
+
+class QuickBaseBatcher:
+    """Collects records per table and upserts them in batches; on_done is called per written record."""
+
+    def __init__(self, batch_size: int, on_done: Callable[[str], None]):
+        self.batch_size = batch_size
+        self.on_done = on_done
+        self.pending: Dict[str, List[Tuple[str, Dict[str, Any]]]] = {}
+        self.written = 0
+        self.failed = 0
+
+    def add(self, key: str, member: Dict[str, Any], results: Dict[str, Any]):
+        table = member['target_table_id']
+        record = worker.build_quickbase_record(member['record_id'], table, member['target_field_ids'], results)
+        if record is None:
+            self.on_done(key)
+            return
+        self.pending.setdefault(table, []).append((key, record))
+        if len(self.pending[table]) >= self.batch_size:
+            self.flush(table)
+
+    def flush(self, table: Optional[str] = None):
+        for name in [table] if table else list(self.pending):
+            items = self.pending.pop(name, [])
+            if not items:
+                continue
+            body = {"to": name, "data": [record for _, record in items]}
+            try:
+                response = worker.quickbase_request('POST', worker.QUICKBASE_URL, json=body).json()
+            except Exception as e:
+                self.failed += len(items)
+                worker.log_safe_event(f"Bulk write of {len(items)} records to {name} failed: {e}")
+                continue
+            # lineErrors is keyed by the 1-based position of the record in 'data'
+            line_errors = (response.get('metadata') or {}).get('lineErrors') or {}
+            for position, (key, _) in enumerate(items, 1):
+                if str(position) in line_errors:
+                    self.failed += 1
+                    worker.logger.warning(f"QuickBase rejected {key}: {line_errors[str(position)]}")
+                else:
+                    self.written += 1
+                    self.on_done(key)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('input', help='JSONL file of payloads, or a directory of .txt documents')
+    parser.add_argument('--schema', help='JSON file with the shared schema (directory input)')
+    parser.add_argument('--out', help='append per-record results to this JSONL file')
+    parser.add_argument('--parallel', type=int, default=2, help='documents processed at once')
+    parser.add_argument('--batch-size', type=int, default=100, help='records per QuickBase upsert')
+    parser.add_argument('--progress', help='progress file (default <out or input>.progress, .dryrun.progress with --dry-run)')
+    parser.add_argument('--dry-run', action='store_true', help='skip QuickBase; results go to --out only')
+    args = parser.parse_args()
+    if args.dry_run and not args.out:
+        parser.error('--dry-run needs --out, otherwise results are discarded')
+
+    # One pooled connection per thread to Ollama and QuickBase
+    adapter = HTTPAdapter(pool_maxsize=max(10, args.parallel))
+    worker.http_session.mount('http://', adapter)
+    worker.http_session.mount('https://', adapter)
+
+    # Dry runs write nothing to QuickBase, so they must not count as done for a real run
+    suffix = '.dryrun.progress' if args.dry_run else '.progress'
+    progress_path = args.progress or f"{(args.out or args.input).rstrip('/')}{suffix}"
+    done = set()
+    if os.path.exists(progress_path):
+        with open(progress_path) as f:
+            done = {line.strip() for line in f if line.strip()}
+    progress = open(progress_path, 'a')
+    out = open(args.out, 'a') if args.out else None
+
+    def mark_done(key: str):
+        progress.write(key + '\n')
+        progress.flush()
+
+    batcher = None if args.dry_run else QuickBaseBatcher(args.batch_size, mark_done)
+    counts = {"ok": 0, "failed": 0, "other": 0, "resumed": 0}
+    started = time.time()
+
+    def handle(data: Dict[str, Any], result):
+        outcome, captured, error, seconds = result
+        key = record_key(data)
+        if error is not None:
+            counts["failed"] += 1
+            worker.log_safe_event(f"Bulk: {key} failed: {error}")
+            if not args.dry_run:
+                worker.report_job_error(data, error)
+        elif not captured:
+            counts["other"] += 1
+            mark_done(key)
+        else:
+            counts["ok"] += 1
+        if out:
+            for member, results in captured or [(data, {})]:
+                out.write(json.dumps({
+                    "record_id": member['record_id'],
+                    "target_table_id": member.get('target_table_id'),
+                    "request_name": member.get('request_name'),
+                    "status": "error" if error is not None else ("ok" if captured else outcome),
+                    "error": str(error) if error is not None else None,
+                    "results": results,
+                    "seconds": round(seconds, 2)
+                }, default=str) + '\n')
+            out.flush()
+        for member, results in captured:
+            if batcher is not None:
+                batcher.add(key, member, results)
+            else:
+                mark_done(key)
+
+    try:
+        with ThreadPoolExecutor(max_workers=args.parallel) as pool:
+            in_flight = {}
+            for data in read_inputs(args.input, args.schema):
+                if record_key(data) in done:
+                    counts["resumed"] += 1
+                    continue
+                data.pop('deadline', None)      # No deadlines offline
+                in_flight[pool.submit(run_one, data)] = data
+                if len(in_flight) >= args.parallel * 2:
+                    finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        handle(in_flight.pop(future), future.result())
+            for future in list(in_flight):
+                handle(in_flight.pop(future), future.result())
+    finally:
+        if batcher is not None:
+            batcher.flush()
+        progress.close()
+        if out:
+            out.close()
+
+    elapsed = time.time() - started
+    processed = counts["ok"] + counts["failed"] + counts["other"]
+    print(f"Processed {processed} records in {elapsed:.0f}s ({processed / max(elapsed, 0.001):.2f}/s): "
+          f"{counts['ok']} ok, {counts['failed']} failed, {counts['other']} skipped/expired, "
+          f"{counts['resumed']} already done")
+    if batcher is not None:
+        print(f"QuickBase: {batcher.written} records written, {batcher.failed} failed")
+
+if __name__ == '__main__':
+    main()
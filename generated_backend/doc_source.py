@@ -0,0 +1,124 @@
+import base64
+import hashlib
+import os
+import tempfile
+import zlib
+from datetime import datetime, timezone
+from typing import IO, Any, Dict, Iterable, Optional
+
+# PDF attachments need pypdf; text attachments and text fields work without it
+try:
+    from pypdf import PdfReader
+except ImportError:
+    PdfReader = None
+
+# Document Source Cache
+# Documents pulled from QuickBase (text fields or file attachments) are kept on
+# local disk, keyed by table, record, field and the record's modification stamp
+# (or attachment version), so an unchanged document is never downloaded twice.
+# Entries are zlib-compressed text; the least recently used are evicted once the
+# cache grows past SOURCE_CACHE_MAX_MB.
+
+SOURCE_CACHE_DIR = os.getenv('SOURCE_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'po_source_cache'))
+SOURCE_CACHE_MAX_MB = int(os.getenv('SOURCE_CACHE_MAX_MB', 2048))
+SOURCE_MAX_BYTES = int(os.getenv('SOURCE_MAX_BYTES', 50 * 1024 * 1024))   # Per downloaded attachment
+
+def document_key(data: Dict[str, Any]) -> str:
+    """Identifies a job's document: its payload-store reference, or its QuickBase source."""
+    if 'po_text_ref' in data:
+        return data['po_text_ref']
+    source = data['source']
+    return f"src:{source['table_id']}:{data['record_id']}:{source['field_id']}"
+
+def modified_stamp(value: Any) -> str:
+    """
+    Date Modified as epoch milliseconds, so the stamp a caller passes and the one
+    read from QuickBase (ISO 8601) name the same cache entry. Unparseable values
+    are used as given.
+    """
+    text = str(value).strip()
+    try:
+        number = float(text)
+        # Epoch seconds or milliseconds
+        return str(int(number if number > 1e11 else number * 1000))
+    except ValueError:
+        pass
+    try:
+        moment = datetime.fromisoformat(text)
+    except ValueError:
+        return text
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return str(int(moment.timestamp() * 1000))
+
+def cache_path(table_id: str, record_id: str, field_id: int, stamp: str) -> str:
+    digest = hashlib.sha256(f"{table_id}\0{record_id}\0{field_id}\0{stamp}".encode('utf-8')).hexdigest()
+    return os.path.join(SOURCE_CACHE_DIR, f"{digest}.z")
+
+def read_cached(path: str) -> Optional[str]:
+    try:
+        with open(path, 'rb') as f:
+            text = zlib.decompress(f.read()).decode('utf-8')
+    except (FileNotFoundError, zlib.error):
+        return None
+    os.utime(path)      # Recently used entries survive eviction
+    return text
+
+def write_cached(path: str, text: str):
+    os.makedirs(SOURCE_CACHE_DIR, exist_ok=True)
+    # Write then rename, so concurrent workers never read a partial entry
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(zlib.compress(text.encode('utf-8'), 6))
+    os.replace(tmp_path, path)
+    evict_cache()
+
+def evict_cache():
+    """Deletes least recently used entries until the cache is under 90% of its limit."""
+    limit = SOURCE_CACHE_MAX_MB * 1024 * 1024
+    entries = []
+    total = 0
+    for entry in os.scandir(SOURCE_CACHE_DIR):
+        if entry.is_file() and entry.name.endswith('.z'):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+    if total <= limit:
+        return
+    for _, size, path in sorted(entries):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        if total <= limit * 0.9:
+            break
+
+def decode_base64_stream(chunks: Iterable[bytes], out: IO[bytes]) -> int:
+    """Decodes a base64 body chunk by chunk into out; returns the decoded size."""
+    leftover = b''
+    size = 0
+    for chunk in chunks:
+        data = leftover + b''.join(chunk.split())
+        cut = len(data) - len(data) % 4
+        decoded = base64.b64decode(data[:cut])
+        leftover = data[cut:]
+        size += len(decoded)
+        if size > SOURCE_MAX_BYTES:
+            raise ValueError(f"Attachment larger than {SOURCE_MAX_BYTES} bytes")
+        out.write(decoded)
+    if leftover:
+        decoded = base64.b64decode(leftover)
+        size += len(decoded)
+        out.write(decoded)
+    return size
+
+def extract_text(f: IO[bytes], file_name: str) -> str:
+    """Text of a downloaded attachment: PDFs page by page (form feed between pages), else UTF-8."""
+    head = f.read(5)
+    f.seek(0)
+    if head == b'%PDF-' or file_name.lower().endswith('.pdf'):
+        if PdfReader is None:
+            raise RuntimeError("PDF attachments need the 'pypdf' package (pip install pypdf)")
+        return '\f'.join(page.extract_text() or '' for page in PdfReader(f).pages)
+    return f.read().decode('utf-8', errors='replace')
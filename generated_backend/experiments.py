@@ -0,0 +1,211 @@
+"""
+Inference experiments: compares alternative models / Ollama option sets with the
+production settings on latency, token counts and per-key agreement.
+
+Variants are configured with EXPERIMENT_VARIANTS (JSON), e.g.
+    {"ctx8k": {"extraction_options": {"num_ctx": 8192}},
+     "small": {"model": "llama3.2:3b"},
+     "short_summary": {"summary_options": {"num_predict": 2048, "top_k": 20}}}
+
+Live: with EXPERIMENT_FRACTION > 0 on the workers, that share of jobs is re-run with
+every variant on the 'experiments' queue (add it to a worker's WORKER_QUEUES).
+Offline: run the production settings and every variant over a corpus.
+
+    python experiments.py run corpus.jsonl --out exp.jsonl [--variants ctx8k,small]
+    python experiments.py report exp.jsonl
+    python experiments.py report --redis          # results of sampled live jobs
+"""
+import argparse
+import json
+import os
+import re
+import time
+from typing import Any, Dict, List, Tuple
+
+from validation import normalize_for_match, parse_amount, parse_date
+
+EXPERIMENT_VARIANTS: Dict[str, Dict[str, Any]] = json.loads(os.getenv('EXPERIMENT_VARIANTS', '{}'))
+EXPERIMENT_RESULTS_KEY = "experiment_results"
+EXPERIMENT_RESULTS_MAX = 20000
+EXTRACTION_AGREEMENT = 0.8      # Word overlap needed for two extraction answers to agree
+SUMMARY_AGREEMENT = 0.5
+
+def _empty(value: Any) -> bool:
+    return value is None or (isinstance(value, str) and not value.strip())
+
+def similarity(a: Any, b: Any) -> float:
+    """1.0 for the same answer (same date / amount / words), else word overlap (Jaccard)."""
+    if _empty(a) or _empty(b):
+        return 1.0 if _empty(a) and _empty(b) else 0.0
+    words_a, words_b = normalize_for_match(str(a)), normalize_for_match(str(b))
+    if words_a == words_b:
+        return 1.0
+    date_a, date_b = parse_date(a), parse_date(b)
+    if date_a is not None and date_a == date_b:
+        return 1.0
+    if re.fullmatch(r'[\W\d_]*\d[\W\d_]*', str(a)) and parse_amount(a) is not None and parse_amount(a) == parse_amount(b):
+        return 1.0
+    set_a, set_b = set(words_a.split()), set(words_b.split())
+    return len(set_a & set_b) / len(set_a | set_b) if set_a | set_b else 0.0
+
+def run_pass(po_text: str, prompt_map: Dict[str, str], is_summary: bool,
+             variant: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """One pass (with re-query, like production) under a variant; returns (results, stats)."""
+    import worker
+
+    worker.reset_usage()
+    started = time.time()
+    options = variant.get('summary_options' if is_summary else 'extraction_options')
+    results = worker.run_llm_pass(po_text, prompt_map, is_summary=is_summary, model=variant.get('model'), options=options)
+    return results, {"seconds": time.time() - started, **worker.current_usage()}
+
+def compare(name: str, stage: str, record_id: Any, po_text: str, prompt_map: Dict[str, str],
+            baseline_results: Dict[str, Any], baseline_stats: Dict[str, Any]) -> Dict[str, Any]:
+    """Runs one variant for one stage and scores it against the baseline answers."""
+    record: Dict[str, Any] = {"variant": name, "stage": stage, "record_id": record_id, "chars": len(po_text),
+                              "baseline": baseline_stats, "error": None}
+    try:
+        results, stats = run_pass(po_text, prompt_map, stage == 'summary', EXPERIMENT_VARIANTS[name])
+    except Exception as e:
+        record["error"] = str(e)[:200]
+        return record
+    threshold = SUMMARY_AGREEMENT if stage == 'summary' else EXTRACTION_AGREEMENT
+    scores = {k: round(similarity(baseline_results.get(k), results.get(k)), 3) for k in prompt_map}
+    record.update(stats=stats, similarity=scores, agree={k: s >= threshold for k, s in scores.items()})
+    return record
+
+def stage_prompts(prompt_map: Dict[str, str]) -> Dict[str, Dict[str, str]]:
+    import worker
+
+    summary_keys, extraction_keys = worker.split_prompt_keys(prompt_map)
+    stages = {'extraction': extraction_keys, 'summary': summary_keys}
+    return {stage: {k: prompt_map[k] for k in keys} for stage, keys in stages.items() if keys}
+
+def prepared_text(data: Dict[str, Any]) -> str:
+    """Document text as the production passes saw it (without re-counting preprocessing metrics)."""
+    import worker
+    from preprocess import preprocess_text
+
+    raw = worker.load_po_text(data)
+    return preprocess_text(raw).text if worker.PREPROCESS_TEXT else raw
+
+def run_shadow_experiment(payload: Dict[str, Any]):
+    """RQ job on the experiments queue: replays a sampled live job under every variant."""
+    import worker
+    from rq import get_current_job
+
+    job = get_current_job()
+    worker.start_job_context(job.id if job else None, {})
+    po_text = prepared_text(payload)
+    pipe = worker.redis_conn.pipeline(transaction=False)
+    for stage, prompt_map in stage_prompts(payload['prompt_json']).items():
+        if stage not in payload['baseline']:
+            continue
+        for name in EXPERIMENT_VARIANTS:
+            record = compare(name, stage, payload['record_id'], po_text, prompt_map,
+                             payload['results'], payload['baseline'][stage])
+            pipe.rpush(EXPERIMENT_RESULTS_KEY, json.dumps(record, default=str))
+    pipe.ltrim(EXPERIMENT_RESULTS_KEY, -EXPERIMENT_RESULTS_MAX, -1)
+    pipe.execute()
+    return "Success"
+
+def cmd_run(args):
+    """Runs the production settings and each variant over a JSONL corpus of /api/process_po payloads."""
+    import worker
+
+    worker.start_job_context(None, {})
+    with open(args.corpus) as f, open(args.out, 'a') as out:
+        for count, line in enumerate(f):
+            if args.limit and count >= args.limit:
+                break
+            if not line.strip():
+                continue
+            data = json.loads(line)
+            po_text = prepared_text(data)
+            for stage, prompt_map in stage_prompts(data['prompt_json']).items():
+                try:
+                    baseline_results, baseline_stats = run_pass(po_text, prompt_map, stage == 'summary', {})
+                except Exception as e:
+                    print(f"Baseline {stage} failed for {data['record_id']}: {e}")
+                    continue
+                for name in args.variants:
+                    record = compare(name, stage, data['record_id'], po_text, prompt_map,
+                                     baseline_results, baseline_stats)
+                    out.write(json.dumps(record, default=str) + '\n')
+                    out.flush()
+            print(f"{count + 1}: record {data['record_id']} done")
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+def _mean(values: List[float]) -> float:
+    return sum(values) / len(values) if values else 0.0
+
+def cmd_report(args):
+    """Per variant and stage: latency, tokens and agreement with the baseline, worst keys first."""
+    if args.redis:
+        import worker
+        records = [json.loads(raw) for raw in worker.redis_conn.lrange(EXPERIMENT_RESULTS_KEY, 0, -1)]
+    else:
+        with open(args.results) as f:
+            records = [json.loads(line) for line in f if line.strip()]
+
+    groups: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+    for record in records:
+        groups.setdefault((record['variant'], record['stage']), []).append(record)
+    for (name, stage), group in sorted(groups.items()):
+        ok = [r for r in group if not r.get('error')]
+        print(f"== {name} / {stage}: {len(group)} documents, {len(group) - len(ok)} errors")
+        if not ok:
+            continue
+        base_s = [r['baseline'].get('seconds', 0) for r in ok]
+        var_s = [r['stats']['seconds'] for r in ok]
+        print(f"   latency p50/p95 (s):   baseline {_percentile(base_s, 50):.1f} / {_percentile(base_s, 95):.1f}"
+              f"   variant {_percentile(var_s, 50):.1f} / {_percentile(var_s, 95):.1f}"
+              f"   ({_mean(var_s) / max(_mean(base_s), 0.001):.2f}x mean)")
+        for field in ('prompt_tokens', 'output_tokens', 'calls'):
+            print(f"   mean {field + ':':<15}  baseline {_mean([r['baseline'].get(field, 0) for r in ok]):,.0f}"
+                  f"   variant {_mean([r['stats'].get(field, 0) for r in ok]):,.0f}")
+        per_key: Dict[str, List[bool]] = {}
+        for r in ok:
+            for key, agreed in r['agree'].items():
+                per_key.setdefault(key, []).append(agreed)
+        total = sum(len(v) for v in per_key.values())
+        agreed = sum(sum(v) for v in per_key.values())
+        print(f"   agreement:            {agreed}/{total} keys ({agreed / max(total, 1):.1%})")
+        worst = sorted(per_key.items(), key=lambda kv: sum(kv[1]) / len(kv[1]))[:args.worst]
+        for key, values in worst:
+            print(f"     {key:<30} {sum(values)}/{len(values)} agree")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('run', help=cmd_run.__doc__)
+    p.add_argument('corpus')
+    p.add_argument('--out', required=True)
+    p.add_argument('--variants', default=','.join(EXPERIMENT_VARIANTS), help='comma-separated variant names')
+    p.add_argument('--limit', type=int, default=0)
+    p.set_defaults(func=cmd_run)
+
+    p = sub.add_parser('report', help=cmd_report.__doc__)
+    p.add_argument('results', nargs='?')
+    p.add_argument('--redis', action='store_true', help='report on results of sampled live jobs')
+    p.add_argument('--worst', type=int, default=5, help='keys with the lowest agreement to list')
+    p.set_defaults(func=cmd_report)
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        args.variants = [v.strip() for v in args.variants.split(',') if v.strip()]
+        unknown = [v for v in args.variants if v not in EXPERIMENT_VARIANTS]
+        if unknown or not args.variants:
+            parser.error(f"unknown or no variants {unknown}; configure EXPERIMENT_VARIANTS")
+    if args.command == 'report' and not (args.results or args.redis):
+        parser.error('give a results file or --redis')
+    args.func(args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+import json
+import os
+import re
+import time
+from typing import Any, Dict, List, Optional, Set
+
+from rq import Queue, Worker
+from rq.defaults import DEFAULT_LOGGING_DATE_FORMAT, DEFAULT_LOGGING_FORMAT
+from rq.scheduler import RQScheduler
+from rq.utils import utcnow
+
+# Fair Queuing
+# Inside each priority queue ('high', 'default', ...) jobs are split into one
+# sub-queue per tenant ('default.<tenant>'), where the tenant is the job's
+# target_table_id or request_name. FairWorker serves the priorities in order and,
+# within a priority, picks the tenant that has received the least service
+# relative to its weight (stride scheduling), skipping tenants at their
+# concurrency cap. A bulk re-run by one tenant no longer delays everyone else.
+# Retries and other scheduled jobs sit in each sub-queue's own scheduled
+# registry, so the workers run FairScheduler, which also covers every sub-queue.
+
+FAIR_QUEUING = os.getenv('FAIR_QUEUING', 'false').lower() == 'true'
+FAIR_TENANT_KEY = os.getenv('FAIR_TENANT_KEY', 'target_table_id')
+FAIR_TENANT_WEIGHTS: Dict[str, float] = json.loads(os.getenv('FAIR_TENANT_WEIGHTS', '{}'))
+FAIR_TENANT_MAX_CONCURRENCY = int(os.getenv('FAIR_TENANT_MAX_CONCURRENCY', 0))
+FAIR_POLL_SECONDS = 5          # How often an idle worker looks for new tenant sub-queues
+FAIR_RUNNING_WINDOW = 3600     # Running-job entries older than the job timeout are ignored
+
+def tenant_slug(value: Any) -> str:
+    slug = re.sub(r'[^A-Za-z0-9_-]+', '_', str(value or 'unknown')).strip('_')
+    return slug[:64] or 'unknown'
+
+def tenant_of(queue_name: str) -> Optional[str]:
+    return queue_name.split('.', 1)[1] if '.' in queue_name else None
+
+def base_queue_name(queue_name: str) -> str:
+    return queue_name.split('.', 1)[0]
+
+def subqueue_for(conn, base_name: str, data: Dict[str, Any]) -> Queue:
+    """Returns (and registers) the tenant sub-queue for a job payload."""
+    name = f"{base_name}.{tenant_slug(data.get(FAIR_TENANT_KEY))}"
+    conn.sadd(f"fair_subqueues:{base_name}", name)
+    return Queue(name, connection=conn)
+
+def subqueue_names(conn, base_name: str) -> List[str]:
+    return sorted(s.decode('utf-8') for s in conn.smembers(f"fair_subqueues:{base_name}"))
+
+def priority_queue_depths(conn, base_names: List[str]) -> Dict[str, int]:
+    """Depth per priority queue, including all of its tenant sub-queues."""
+    depths = {}
+    for base in base_names:
+        names = [base] + subqueue_names(conn, base)
+        pipe = conn.pipeline(transaction=False)
+        for name in names:
+            pipe.llen(f"rq:queue:{name}")
+        depths[base] = sum(pipe.execute())
+    return depths
+
+def running_count(conn, tenant: str) -> int:
+    return conn.zcount(f"fair_running:{tenant}", time.time() - FAIR_RUNNING_WINDOW, '+inf')
+
+def tenant_stats(conn, base_names: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Per-tenant queue depth, running jobs and wait times, for /api/status."""
+    stats: Dict[str, Dict[str, Any]] = {}
+    for base in base_names:
+        for name in subqueue_names(conn, base):
+            tenant = tenant_of(name)
+            entry = stats.setdefault(tenant, {"queued": {}, "running": running_count(conn, tenant)})
+            entry["queued"][base] = conn.llen(f"rq:queue:{name}")
+
+    for field, value in conn.hgetall("fair_wait").items():
+        tenant, _, metric = field.decode('utf-8').rpartition(':')
+        stats.setdefault(tenant, {"queued": {}, "running": 0})[metric] = float(value)
+    for entry in stats.values():
+        if entry.get("jobs"):
+            entry["avg_wait_seconds"] = round(entry["wait_seconds"] / entry["jobs"], 1)
+    return stats
+
+class FairScheduler(RQScheduler):
+    """RQ scheduler that also enqueues due jobs (retries) of the tenant sub-queues."""
+
+    def __init__(self, queues, *args, **kwargs):
+        super().__init__(queues, *args, **kwargs)
+        self.priority_names = sorted({base_queue_name(name) for name in self._queue_names})
+        self._tried: Set[str] = set()
+
+    def refresh_queue_names(self):
+        names = set(self.priority_names)
+        for base in self.priority_names:
+            names.update(subqueue_names(self.connection, base))
+        self._queue_names = names
+
+    @property
+    def should_reacquire_locks(self):
+        # Runs every scheduler loop: sub-queues created since the last attempt are locked right away
+        self.refresh_queue_names()
+        return bool(self._queue_names - self._tried) or super().should_reacquire_locks
+
+    def acquire_locks(self, auto_start=False):
+        self.refresh_queue_names()
+        self._tried = set(self._queue_names)
+        return super().acquire_locks(auto_start=auto_start)
+
+class FairWorker(Worker):
+    """RQ worker that serves tenant sub-queues fairly within each priority."""
+
+    def __init__(self, queues, *args, **kwargs):
+        queues = list(queues)
+        self.priority_names = [base_queue_name(q.name) for q in queues]
+        self._passes: Dict[str, float] = {}
+        super().__init__(queues, *args, **kwargs)
+
+    def _start_scheduler(self, burst: bool = False, logging_level: str = "INFO",
+                         date_format: str = DEFAULT_LOGGING_DATE_FORMAT, log_format: str = DEFAULT_LOGGING_FORMAT):
+        # As Worker._start_scheduler, with the sub-queue aware scheduler
+        self.scheduler = FairScheduler(self.priority_names, connection=self.connection, logging_level=logging_level,
+                                       date_format=date_format, log_format=log_format, serializer=self.serializer)
+        self.scheduler.acquire_locks()
+        if self.scheduler.acquired_locks:
+            if burst:
+                self.scheduler.enqueue_scheduled_jobs()
+                self.scheduler.release_locks()
+            else:
+                self.scheduler.start()
+
+    def _fair_order(self) -> List[Queue]:
+        ordered = []
+        for base in self.priority_names:
+            candidates = []
+            for name in subqueue_names(self.connection, base):
+                tenant = tenant_of(name)
+                if FAIR_TENANT_MAX_CONCURRENCY and running_count(self.connection, tenant) >= FAIR_TENANT_MAX_CONCURRENCY:
+                    continue
+                candidates.append(name)
+            if candidates:
+                # New tenants start level with the least-served one instead of at zero
+                floor = min((self._passes[n] for n in candidates if n in self._passes), default=0.0)
+                for name in candidates:
+                    self._passes.setdefault(name, floor)
+            # The plain priority queue keeps serving jobs enqueued before fair queuing
+            ordered.append(base)
+            ordered.extend(sorted(candidates, key=lambda n: (self._passes[n], n)))
+        return [Queue(name, connection=self.connection, serializer=self.serializer) for name in ordered]
+
+    def dequeue_job_and_maintain_ttl(self, timeout: Optional[int], max_idle_time: Optional[int] = None):
+        idle_since = time.time()
+        while True:
+            self.queues = self._fair_order()
+            self._ordered_queues = self.queues[:]
+            # Wake up regularly so sub-queues created while idle are picked up
+            poll = None if timeout is None else min(timeout, FAIR_POLL_SECONDS)
+            result = super().dequeue_job_and_maintain_ttl(poll, max_idle_time=FAIR_POLL_SECONDS)
+            if result is not None:
+                _, queue = result
+                tenant = tenant_of(queue.name)
+                if tenant:
+                    weight = float(FAIR_TENANT_WEIGHTS.get(tenant, 1)) or 1.0
+                    self._passes[queue.name] = self._passes.get(queue.name, 0.0) + 1.0 / weight
+                return result
+            if timeout is None:
+                return None
+            if max_idle_time is not None and time.time() - idle_since >= max_idle_time:
+                return None
+
+    def execute_job(self, job, queue):
+        tenant = tenant_of(queue.name)
+        if not tenant:
+            return super().execute_job(job, queue)
+
+        running_key = f"fair_running:{tenant}"
+        pipe = self.connection.pipeline()
+        pipe.zadd(running_key, {job.id: time.time()})
+        pipe.expire(running_key, FAIR_RUNNING_WINDOW)
+        if job.enqueued_at:
+            wait = max(0.0, (utcnow() - job.enqueued_at).total_seconds())
+            pipe.hincrbyfloat("fair_wait", f"{tenant}:wait_seconds", wait)
+            pipe.hincrby("fair_wait", f"{tenant}:jobs", 1)
+            pipe.hset("fair_wait", f"{tenant}:last_wait_seconds", round(wait, 1))
+        pipe.execute()
+        try:
+            return super().execute_job(job, queue)
+        finally:
+            self.connection.zrem(running_key, job.id)
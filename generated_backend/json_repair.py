@@ -0,0 +1,157 @@
+import json
+import re
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional
+
+# Tolerant parsing of LLM JSON output.
+# A response that is cut off at num_predict, or that contains a raw newline or a
+# trailing comma, should not throw away every key that the model got right.
+
+_KEY_RE = re.compile(r'\s*,?\s*"((?:[^"\\\n]|\\.){1,200})"\s*:\s*')
+_ANY_KEY_ANCHOR = r'"(?:[^"\\\n]|\\.){1,200}"'
+_CONTROL_ESCAPES = {'\n': '\\n', '\r': '\\r', '\t': '\\t'}
+
+class ParseResult(NamedTuple):
+    data: Dict[str, Any]
+    lost_keys: List[str]
+    repaired: bool
+
+def _strip_wrapping(raw: str) -> str:
+    """Drops markdown fences, any chatter before the first '{' and anything after a closing fence."""
+    text = raw.strip()
+    if text.startswith('```'):
+        text = re.sub(r'^```[a-zA-Z]*\s*', '', text)
+        text = re.sub(r'\s*```\s*$', '', text)
+    start = text.find('{')
+    text = text[start:] if start >= 0 else text
+    fence = text.find('```')
+    return text[:fence].rstrip() if fence > 0 else text
+
+def _sanitize(text: str) -> str:
+    """Escapes raw control characters inside strings and removes trailing commas."""
+    out = []
+    in_string = False
+    escaped = False
+    i = 0
+    while i < len(text):
+        ch = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == '\\':
+                escaped = True
+            elif ch == '"':
+                in_string = False
+            elif ch in _CONTROL_ESCAPES:
+                ch = _CONTROL_ESCAPES[ch]
+            elif ord(ch) < 0x20:
+                ch = f'\\u{ord(ch):04x}'
+            out.append(ch)
+        elif ch == '"':
+            in_string = True
+            out.append(ch)
+        elif ch == ',':
+            j = i + 1
+            while j < len(text) and text[j].isspace():
+                j += 1
+            if j >= len(text) or text[j] not in '}]':
+                out.append(ch)
+        else:
+            out.append(ch)
+        i += 1
+    return ''.join(out)
+
+def _loose_string(segment: str) -> Optional[str]:
+    """Reads a quoted value whose inner quotes were not escaped, e.g. "Net 30 "from invoice""."""
+    segment = segment.strip().rstrip(',').rstrip()
+    if segment.endswith('}'):
+        segment = segment[:-1].rstrip().rstrip(',').rstrip()
+    if len(segment) < 2 or not (segment.startswith('"') and segment.endswith('"')):
+        return None
+    backslashes = len(segment[:-1]) - len(segment[:-1].rstrip('\\'))
+    if backslashes % 2:
+        # The final quote is escaped, so the value was cut off mid-string
+        return None
+    inner = segment[1:-1]
+    try:
+        return json.loads('"' + inner.replace('\\"', '"').replace('"', '\\"') + '"')
+    except ValueError:
+        return inner
+
+def _next_anchor(text: str, pos: int, expected: List[str]) -> Optional[int]:
+    """Position of the ',' that starts the next key/value pair after pos, if any."""
+    if expected:
+        names = '|'.join(re.escape(json.dumps(k)) for k in expected)
+        pattern = rf',\s*(?:{names})\s*:'
+    else:
+        pattern = rf',\s*\n?\s*{_ANY_KEY_ANCHOR}\s*:'
+    match = re.compile(pattern).search(text, pos)
+    return match.start() if match else None
+
+def _salvage_pairs(text: str, expected: List[str]) -> Dict[str, Any]:
+    """Walks the top-level object and keeps every key/value pair that is complete."""
+    decoder = json.JSONDecoder()
+    result: Dict[str, Any] = {}
+    pos = text.find('{')
+    if pos < 0:
+        return result
+    pos += 1
+    while pos < len(text):
+        match = _KEY_RE.match(text, pos)
+        if not match:
+            break
+        try:
+            key = json.loads(f'"{match.group(1)}"')
+        except ValueError:
+            break
+        value_start = match.end()
+        try:
+            value, end = decoder.raw_decode(text, value_start)
+            follow = text[end:].lstrip()[:1]
+            # A complete value must be followed by the next pair or the closing brace
+            if follow in (',', '}', '"'):
+                result[key] = value
+                pos = end
+                continue
+        except ValueError:
+            pass
+
+        # The value itself is broken: resynchronise on the next key
+        anchor = _next_anchor(text, value_start, [k for k in expected if k != key])
+        segment = text[value_start:anchor] if anchor is not None else text[value_start:]
+        # With no next key, only the closing brace shows the value was not cut off
+        value = _loose_string(segment) if anchor is not None or segment.rstrip().endswith('}') else None
+        if value is not None:
+            result[key] = value
+        if anchor is None:
+            break
+        pos = anchor
+    return result
+
+def parse_llm_json(raw: str, expected_keys: Optional[Iterable[str]] = None) -> ParseResult:
+    """
+    Parses a model response into a dict, repairing or salvaging it when needed.
+    Returns the recovered data, the expected keys that could not be recovered and
+    whether any repair was necessary.
+    """
+    expected = list(expected_keys or [])
+    try:
+        parsed = json.loads(raw)
+        if isinstance(parsed, dict):
+            return ParseResult(parsed, [k for k in expected if k not in parsed], False)
+    except (TypeError, ValueError):
+        pass
+
+    text = _strip_wrapping(raw or '')
+    data: Dict[str, Any] = {}
+    for candidate in (text, _sanitize(text)):
+        try:
+            parsed = json.loads(candidate)
+        except ValueError:
+            continue
+        if isinstance(parsed, dict):
+            data = parsed
+            break
+    else:
+        data = _salvage_pairs(_sanitize(text), expected)
+
+    return ParseResult(data, [k for k in expected if k not in data], True)
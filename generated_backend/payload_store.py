@@ -0,0 +1,30 @@
+import hashlib
+import os
+import zlib
+
+# Document Payload Store
+# Document text is stored once in Redis as a compressed, content-addressed blob.
+# RQ jobs only carry the reference, so queued/finished jobs stay small and their
+# metadata can be read without deserializing the whole document.
+
+DOC_TTL = int(os.getenv('DOC_TTL', 3 * 86400))
+DOC_COMPRESSION_LEVEL = 6
+
+def doc_key(ref: str) -> str:
+    return f"doc:{ref}"
+
+def store_text(conn, text: str) -> str:
+    """Stores text (deduplicated by SHA-256) and returns its reference."""
+    raw = text.encode('utf-8')
+    ref = hashlib.sha256(raw).hexdigest()
+    key = doc_key(ref)
+    if not conn.set(key, zlib.compress(raw, DOC_COMPRESSION_LEVEL), ex=DOC_TTL, nx=True):
+        # Same document already stored: just extend its lifetime
+        conn.expire(key, DOC_TTL)
+    return ref
+
+def fetch_text(conn, ref: str) -> str:
+    blob = conn.get(doc_key(ref))
+    if blob is None:
+        raise LookupError(f"Document {ref[:12]} is missing or expired (DOC_TTL={DOC_TTL}s)")
+    return zlib.decompress(blob).decode('utf-8')
@@ -0,0 +1,137 @@
+import re
+from collections import Counter
+from typing import Any, Dict, List, NamedTuple, Set, Tuple
+
+# Document Preprocessing
+# PDF-to-text output is full of page furniture (headers, footers, page numbers,
+# dotted leaders) and repeated boilerplate. Stripping it before inference shrinks
+# the prompt without touching the content the model is asked about.
+
+CHARS_PER_TOKEN = 4                # Rough estimate for Llama-family tokenizers
+HEADER_FOOTER_ZONE = 2             # Lines checked at the top and bottom of each page
+HEADER_FOOTER_MAX_CHARS = 100      # Longer lines are treated as content
+HEADER_FOOTER_MIN_PAGES = 3
+HEADER_FOOTER_PAGE_RATIO = 0.6     # Line must repeat on this share of pages
+
+_PAGE_NUMBER_RE = re.compile(
+    r'^\s*(?:page\s*\d{1,4}(?:\s*(?:of|/)\s*\d{1,4})?|\d{1,4}\s*(?:of|/)\s*\d{1,4}|-\s*\d{1,4}\s*-)\s*$',
+    re.IGNORECASE
+)
+_LEADER_RE = re.compile(r'(?:\s?[.\-_=·•]){4,}\s?')
+_TABLE_GAP_RE = re.compile(r'[ \t]{3,}')
+_SPACES_RE = re.compile(r'[ \t\u00a0\u2000-\u200b]+')
+_BLANK_RUN_RE = re.compile(r'\n{3,}')
+
+class PreprocessResult(NamedTuple):
+    text: str
+    stats: Dict[str, Any]
+
+def _signature(line: str) -> str:
+    """
+    Line identity for header/footer matching. Only page numbers may differ per
+    page; any other line must repeat verbatim, so rows that differ in a value
+    (an amount, an item number) are never taken for a running header.
+    """
+    line = ' '.join(line.lower().split())
+    return re.sub(r'\d+', '#', line) if _PAGE_NUMBER_RE.match(line) else line
+
+def _split_pages(text: str) -> List[List[str]]:
+    """Splits on form feeds, or after standalone page-number lines when there are none."""
+    if '\f' in text:
+        return [page.split('\n') for page in text.split('\f')]
+    pages: List[List[str]] = [[]]
+    for line in text.split('\n'):
+        pages[-1].append(line)
+        if _PAGE_NUMBER_RE.match(line):
+            pages.append([])
+    return pages
+
+def _zone(page: List[str]) -> List[int]:
+    """Indexes of the first and last few non-empty lines of a page."""
+    filled = [i for i, line in enumerate(page) if line.strip()]
+    zone = set(filled[:HEADER_FOOTER_ZONE] + filled[-HEADER_FOOTER_ZONE:])
+    return sorted(i for i in zone if len(page[i].strip()) <= HEADER_FOOTER_MAX_CHARS)
+
+def remove_headers_footers(text: str) -> Tuple[str, int]:
+    """
+    Drops repeats of lines found in the header/footer zone of most pages. Page
+    numbers are dropped only in that zone and only when they repeat across pages:
+    elsewhere a line like "12/15" or "3 of 4" is usually a value.
+    """
+    pages = _split_pages(text)
+    repeated: Set[str] = set()
+    if len(pages) >= HEADER_FOOTER_MIN_PAGES:
+        counts = Counter()
+        for page in pages:
+            counts.update({_signature(page[i]) for i in _zone(page)})
+        min_pages = max(HEADER_FOOTER_MIN_PAGES, int(len(pages) * HEADER_FOOTER_PAGE_RATIO))
+        repeated = {sig for sig, n in counts.items() if n >= min_pages and sig}
+
+    removed = 0
+    seen: Set[str] = set()
+    kept_pages = []
+    for page in pages:
+        zone = set(_zone(page))
+        kept = []
+        for i, line in enumerate(page):
+            signature = _signature(line)
+            # The first copy of a running header is kept: it often carries the PO number or title
+            if i in zone and signature in repeated and (signature in seen or _PAGE_NUMBER_RE.match(line)):
+                removed += 1
+                continue
+            if i in zone:
+                seen.add(signature)
+            kept.append(line)
+        kept_pages.append('\n'.join(kept))
+    return '\n'.join(kept_pages), removed
+
+def _compact_line(line: str) -> str:
+    """Collapses dotted leaders and column padding; multi-column rows keep a ' | ' separator."""
+    line = _LEADER_RE.sub(' ', line)
+    gaps = _TABLE_GAP_RE.findall(line.strip())
+    if len(gaps) >= 2:
+        line = _TABLE_GAP_RE.sub(' | ', line.strip())
+    return _SPACES_RE.sub(' ', line).strip()
+
+def normalize_whitespace(text: str) -> str:
+    text = text.replace('\r\n', '\n').replace('\r', '\n')
+    text = '\n'.join(_compact_line(line) for line in text.split('\n'))
+    return _BLANK_RUN_RE.sub('\n\n', text).strip()
+
+def collapse_duplicate_paragraphs(text: str) -> Tuple[str, int]:
+    """
+    Keeps the first copy of repeated paragraphs (boilerplate clauses). Only exact
+    repeats (ignoring case and whitespace) are dropped: paragraphs that differ in
+    a single amount, date or term carry different values the model must see.
+    """
+    seen: Set[str] = set()
+    kept: List[str] = []
+    removed = 0
+
+    for paragraph in text.split('\n\n'):
+        normalized = ' '.join(paragraph.lower().split())
+        if not normalized:
+            continue
+        if normalized in seen:
+            removed += 1
+            continue
+        seen.add(normalized)
+        kept.append(paragraph)
+    return '\n\n'.join(kept), removed
+
+def preprocess_text(text: str) -> PreprocessResult:
+    """Runs the full pipeline and reports how much was removed."""
+    original_len = len(text)
+    cleaned, header_lines = remove_headers_footers(text.replace('\r\n', '\n'))
+    cleaned = normalize_whitespace(cleaned)
+    cleaned, duplicate_paragraphs = collapse_duplicate_paragraphs(cleaned)
+
+    chars_removed = original_len - len(cleaned)
+    return PreprocessResult(cleaned, {
+        "chars_before": original_len,
+        "chars_after": len(cleaned),
+        "chars_removed": chars_removed,
+        "tokens_removed_est": chars_removed // CHARS_PER_TOKEN,
+        "header_footer_lines": header_lines,
+        "duplicate_paragraphs": duplicate_paragraphs
+    })
@@ -0,0 +1,225 @@
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+import zlib
+from contextlib import contextmanager
+from functools import wraps
+from typing import Any, Callable, Dict, List, Optional
+
+# Job Profiling
+# Opt-in per job ("profile": true in the payload, or "cpu" to also sample stacks)
+# or for a random PROFILE_FRACTION of jobs. A profiled job records one span per
+# pipeline stage plus nested spans for traced calls (Redis logging, JSON parsing,
+# Ollama, QuickBase), saved as Chrome trace JSON (chrome://tracing, Perfetto,
+# speedscope). The optional sampler walks the job thread's stack every
+# PROFILE_SAMPLE_INTERVAL seconds and saves a speedscope profile. It samples wall
+# clock, so time spent waiting on Ollama or QuickBase shows up too. Profiles are
+# kept compressed in Redis (listed and downloaded via /api/profiles) and, with
+# PROFILE_DIR set, also written to disk as <job_id>.trace.json / .speedscope.json.
+# Untraced jobs pay one thread-local lookup per traced call.
+
+PROFILE_FRACTION = float(os.getenv('PROFILE_FRACTION', 0))
+PROFILE_CPU = os.getenv('PROFILE_CPU', 'false').lower() == 'true'      # Sample stacks for every profiled job
+PROFILE_SAMPLE_INTERVAL = float(os.getenv('PROFILE_SAMPLE_INTERVAL', 0.01))
+PROFILE_TTL = int(os.getenv('PROFILE_TTL', 7 * 86400))
+PROFILE_MAX = int(os.getenv('PROFILE_MAX', 500))                      # Oldest profiles are dropped
+PROFILE_DIR = os.getenv('PROFILE_DIR', '')
+PROFILE_INDEX_KEY = "profiles"
+PROFILE_KINDS = {"trace": "trace.json", "cpu": "speedscope.json"}
+
+_current = threading.local()
+
+class StackSampler(threading.Thread):
+    """Samples one thread's Python stack at a fixed interval (speedscope 'sampled' profile)."""
+
+    def __init__(self, thread_id: int, interval: float):
+        super().__init__(name='profile-sampler', daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.frame_index: Dict[tuple, int] = {}
+        self.frames: List[Dict[str, Any]] = []
+        self.samples: List[List[int]] = []
+        self.weights: List[float] = []
+
+    def run(self):
+        last = time.perf_counter()
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            now = time.perf_counter()
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                key = (code.co_name, code.co_filename, code.co_firstlineno)
+                index = self.frame_index.get(key)
+                if index is None:
+                    index = self.frame_index[key] = len(self.frames)
+                    self.frames.append({"name": code.co_name, "file": code.co_filename, "line": code.co_firstlineno})
+                stack.append(index)
+                frame = frame.f_back
+            stack.reverse()
+            self.samples.append(stack)
+            self.weights.append(now - last)
+            last = now
+
+    def finish(self, name: str) -> Dict[str, Any]:
+        self.stopped.set()
+        self.join()
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": self.frames},
+            "profiles": [{
+                "type": "sampled", "name": name, "unit": "seconds",
+                "startValue": 0, "endValue": sum(self.weights),
+                "samples": self.samples, "weights": self.weights
+            }],
+            "name": name,
+            "exporter": "profiling.py"
+        }
+
+class JobProfile:
+    """Spans of one job, as Chrome trace 'complete' events (microseconds since the job started)."""
+
+    def __init__(self, job_id: Optional[str], data: Dict[str, Any], cpu: bool):
+        self.job_id = job_id or f"local-{uuid.uuid4().hex[:12]}"
+        self.meta: Dict[str, Any] = {
+            "job_id": self.job_id,
+            "record_id": data.get('record_id'),
+            "request_name": data.get('request_name'),
+            "started": time.time(),
+            "pid": os.getpid(),
+        }
+        self.origin = time.perf_counter()
+        self.thread_id = threading.get_ident()
+        self.events: List[Dict[str, Any]] = []
+        self.annotations: List[Dict[str, Any]] = []     # Args of the open traced calls, innermost last
+        self.stage: Optional[tuple] = None
+        self.sampler = StackSampler(self.thread_id, PROFILE_SAMPLE_INTERVAL) if cpu else None
+        if self.sampler:
+            self.sampler.start()
+
+    def now(self) -> float:
+        return (time.perf_counter() - self.origin) * 1e6
+
+    def emit(self, name: str, category: str, start: float, args: Dict[str, Any]):
+        self.events.append({"name": name, "cat": category, "ph": "X", "ts": round(start, 1),
+                            "dur": round(self.now() - start, 1), "pid": self.meta["pid"],
+                            "tid": self.thread_id, "args": args})
+
+    def mark_stage(self, name: Optional[str]):
+        if self.stage is not None:
+            self.emit(self.stage[0], "stage", self.stage[1], {})
+        self.stage = (name, self.now()) if name else None
+
+def start_profile(job_id: Optional[str], data: Dict[str, Any]) -> Optional[JobProfile]:
+    """Starts profiling the current thread's job if it asked for it or was sampled."""
+    flag = data.get('profile')
+    if not flag and not (PROFILE_FRACTION > 0 and random.random() < PROFILE_FRACTION):
+        return None
+    profile = JobProfile(job_id, data, cpu=PROFILE_CPU or flag == 'cpu')
+    _current.profile = profile
+    return profile
+
+def profile_stage(name: str):
+    """Ends the current stage span of a profiled job and starts the next one."""
+    profile = getattr(_current, 'profile', None)
+    if profile is not None:
+        profile.mark_stage(name)
+
+def annotate_span(**args):
+    """Adds arguments to the innermost open traced call (shown in the trace viewer)."""
+    profile = getattr(_current, 'profile', None)
+    if profile is not None and profile.annotations:
+        profile.annotations[-1].update(args)
+
+@contextmanager
+def span(name: str, **args):
+    profile = getattr(_current, 'profile', None)
+    if profile is None:
+        yield
+        return
+    start = profile.now()
+    profile.annotations.append(dict(args))
+    try:
+        yield
+    finally:
+        profile.emit(name, "call", start, profile.annotations.pop())
+
+def traced(name: str) -> Callable:
+    """Decorator: records a span around every call made while a job is profiled."""
+    def decorate(func: Callable) -> Callable:
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            profile = getattr(_current, 'profile', None)
+            if profile is None:
+                return func(*args, **kwargs)
+            start = profile.now()
+            profile.annotations.append({})
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profile.emit(name, "call", start, profile.annotations.pop())
+        return wrapper
+    return decorate
+
+def finish_profile(conn, profile: JobProfile, outcome: str) -> Dict[str, Any]:
+    """Closes the profile, stores it and returns its metadata (with per-span totals)."""
+    _current.profile = None
+    profile.mark_stage(None)
+    totals: Dict[str, float] = {}
+    for event in profile.events:
+        totals[event["name"]] = totals.get(event["name"], 0.0) + event["dur"] / 1e6
+    profile.meta.update(
+        outcome=outcome,
+        seconds=round(profile.now() / 1e6, 3),
+        totals={name: round(seconds, 4) for name, seconds in sorted(totals.items(), key=lambda kv: -kv[1])},
+        has_cpu=profile.sampler is not None
+    )
+    label = f"job {profile.job_id} (record {profile.meta['record_id']})"
+    blobs = {"trace": {
+        "traceEvents": [
+            {"name": "process_name", "ph": "M", "pid": profile.meta["pid"], "args": {"name": label}},
+            {"name": "thread_name", "ph": "M", "pid": profile.meta["pid"], "tid": profile.thread_id,
+             "args": {"name": "process_po_job"}},
+        ] + profile.events,
+        "displayTimeUnit": "ms",
+        "otherData": profile.meta
+    }}
+    if profile.sampler is not None:
+        blobs["cpu"] = profile.sampler.finish(label)
+
+    encoded = {kind: json.dumps(blob, default=str).encode('utf-8') for kind, blob in blobs.items()}
+    key = f"profile:{profile.job_id}"
+    pipe = conn.pipeline(transaction=False)
+    pipe.hset(key, mapping={"meta": json.dumps(profile.meta, default=str),
+                            **{kind: zlib.compress(raw, 6) for kind, raw in encoded.items()}})
+    pipe.expire(key, PROFILE_TTL)
+    pipe.zadd(PROFILE_INDEX_KEY, {profile.job_id: profile.meta["started"]})
+    pipe.zremrangebyscore(PROFILE_INDEX_KEY, '-inf', time.time() - PROFILE_TTL)
+    pipe.zremrangebyrank(PROFILE_INDEX_KEY, 0, -PROFILE_MAX - 1)
+    pipe.execute()
+    if PROFILE_DIR:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        for kind, raw in encoded.items():
+            with open(os.path.join(PROFILE_DIR, f"{profile.job_id}.{PROFILE_KINDS[kind]}"), 'wb') as f:
+                f.write(raw)
+    return profile.meta
+
+def list_profiles(conn, limit: int = 100) -> List[Dict[str, Any]]:
+    """Metadata of the stored profiles, newest first."""
+    job_ids = conn.zrevrange(PROFILE_INDEX_KEY, 0, limit - 1)
+    pipe = conn.pipeline(transaction=False)
+    for job_id in job_ids:
+        pipe.hget(f"profile:{job_id.decode('utf-8')}", "meta")
+    return [json.loads(meta) for meta in pipe.execute() if meta]
+
+def load_profile(conn, job_id: str, kind: str) -> Optional[bytes]:
+    """Chrome trace ('trace') or speedscope ('cpu') JSON of one job, or None if not stored."""
+    blob = conn.hget(f"profile:{job_id}", kind)
+    return zlib.decompress(blob) if blob else None
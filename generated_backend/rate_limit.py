@@ -0,0 +1,116 @@
+import random
+import time
+from typing import Optional
+
+# Shared Rate Limiting
+# A token bucket kept in Redis, so every worker process on every host draws from
+# the same budget. The bucket is refilled inside a Lua script using the Redis
+# server clock, which keeps hosts with drifting clocks consistent.
+
+TOKEN_BUCKET_LUA = """
+local bucket = KEYS[1]
+local throttle = KEYS[2]
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+
+local until_ts = tonumber(redis.call('GET', throttle) or '0')
+if until_ts > now then
+    return tostring(until_ts - now)
+end
+
+local state = redis.call('HMGET', bucket, 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', bucket, 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', bucket, math.ceil(capacity / rate) + 60)
+return tostring(wait)
+"""
+
+THROTTLE_LUA = """
+local t = redis.call('TIME')
+local until_ts = tonumber(t[1]) + tonumber(t[2]) / 1000000 + tonumber(ARGV[1])
+local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+if until_ts > current then
+    redis.call('SET', KEYS[1], tostring(until_ts), 'EX', math.ceil(tonumber(ARGV[1])) + 1)
+end
+return 1
+"""
+
+SLOT_ACQUIRE_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+if redis.call('ZSCORE', KEYS[1], ARGV[2]) or redis.call('ZCARD', KEYS[1]) < tonumber(ARGV[1]) then
+    redis.call('ZADD', KEYS[1], now + tonumber(ARGV[3]), ARGV[2])
+    redis.call('EXPIRE', KEYS[1], math.ceil(tonumber(ARGV[3])) + 60)
+    return 1
+end
+return 0
+"""
+
+class RateLimitWaitExceeded(Exception):
+    """Raised when a token cannot be obtained within the caller's max_wait."""
+
+    def __init__(self, wait: float):
+        super().__init__(f"Rate limited: next slot in {wait:.1f}s")
+        self.wait = wait
+
+class TokenBucket:
+    def __init__(self, conn, name: str, rate_per_second: float, capacity: int):
+        self.bucket_key = f"ratelimit:{name}"
+        self.throttle_key = f"ratelimit:{name}:throttled_until"
+        self.rate = rate_per_second
+        self.capacity = capacity
+        self._acquire = conn.register_script(TOKEN_BUCKET_LUA)
+        self._throttle = conn.register_script(THROTTLE_LUA)
+
+    def try_acquire(self) -> float:
+        """Takes a token if one is available; otherwise returns the seconds to wait."""
+        return float(self._acquire(keys=[self.bucket_key, self.throttle_key], args=[self.rate, self.capacity]))
+
+    def acquire(self, max_wait: Optional[float] = None) -> float:
+        """Blocks (with jitter) until a token is taken; returns total seconds waited."""
+        waited = 0.0
+        while True:
+            wait = self.try_acquire()
+            if wait <= 0:
+                return waited
+            if max_wait is not None and waited + wait > max_wait:
+                raise RateLimitWaitExceeded(wait)
+            # Jitter spreads out workers that were all told to wait the same amount
+            pause = wait + random.uniform(0, min(1.0, wait * 0.25) + 0.05)
+            time.sleep(pause)
+            waited += pause
+
+    def throttle(self, seconds: float):
+        """Pauses every client of this bucket, e.g. after a 429 with Retry-After."""
+        self._throttle(keys=[self.throttle_key], args=[seconds])
+
+class SlotSemaphore:
+    """
+    Counting semaphore shared by all workers. Each holder leases a slot until it
+    releases it or the lease expires (a crashed worker cannot keep a slot).
+    Callers pass their own limit, so some slots can be kept for a subset of them.
+    """
+
+    def __init__(self, conn, name: str):
+        self.conn = conn
+        self.key = f"slots:{name}"
+        self._acquire = conn.register_script(SLOT_ACQUIRE_LUA)
+
+    def try_acquire(self, token: str, limit: int, lease: float) -> bool:
+        """Takes a slot if fewer than limit are held (counting every holder)."""
+        return bool(int(self._acquire(keys=[self.key], args=[limit, token, lease])))
+
+    def release(self, token: str):
+        self.conn.zrem(self.key, token)
@@ -0,0 +1,228 @@
+"""
+Workload replay: re-submits a recorded trace (see workload_trace.py) to judge
+capacity changes such as worker count, model or num_ctx before production.
+
+    python replay.py export trace.jsonl               # dump the recorded trace from Redis
+    python replay.py run trace.jsonl --speed 10       # re-submit at 10x through the API
+    python replay.py stub --port 8099                 # fake Ollama + QuickBase for workers
+
+Replayed jobs write to made-up table IDs, so point the workers at a staging
+QuickBase or at the stub backends:
+    OLLAMA_URL=http://localhost:8099/api/generate \\
+    QUICKBASE_URL=http://localhost:8099/v1/records \\
+    QUICKBASE_FIELDS_URL=http://localhost:8099/v1/fields python worker.py
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List
+
+import requests
+
+def load_trace(path: str) -> List[Dict[str, Any]]:
+    with open(path) as f:
+        entries = [json.loads(line) for line in f if line.strip()]
+    return sorted(entries, key=lambda e: e['t'])
+
+def replay_payload(index: int, entry: Dict[str, Any]) -> Dict[str, Any]:
+    """Rebuilds a request from a trace entry, synthesizing text unless a redacted copy was kept."""
+    from benchmarks import synthetic_document
+
+    text = entry.get('text') or synthetic_document(entry['text_len'], seed=int(entry['fingerprint'], 16))
+    keys = entry['keys'] or ['summary']
+    return {
+        "record_id": f"replay-{index}",
+        "po_text": text,
+        "target_table_id": f"replay_{entry['tenant']}",
+        "target_field_ids": {key: 100 + i for i, key in enumerate(keys)},
+        "prompt_json": {key: f"What is the {key.replace('_', ' ')}?" for key in keys},
+        "priority": entry.get('priority') or 'normal',
+        "request_name": "replay"
+    }
+
+def cmd_export(args):
+    """Writes the recorded trace from Redis to a JSONL file (redacted text is inlined)."""
+    from benchmarks import redis_conn
+    from payload_store import fetch_text
+    from workload_trace import read_trace
+
+    entries = read_trace(redis_conn)
+    with open(args.out, 'w') as f:
+        for entry in entries:
+            text_ref = entry.pop('text_ref', None)
+            if text_ref:
+                try:
+                    entry['text'] = fetch_text(redis_conn, text_ref)
+                except Exception:
+                    pass    # Expired after DOC_TTL: the replay synthesizes text instead
+            f.write(json.dumps(entry) + '\n')
+    span = entries[-1]['t'] - entries[0]['t'] if entries else 0
+    print(f"Exported {len(entries)} requests spanning {span / 60:.1f} minutes to {args.out}")
+
+def cmd_run(args):
+    """Re-submits a trace at --speed and reports queueing delay and throughput."""
+    from rq.job import Job
+    from benchmarks import percentile, redis_conn
+
+    trace = load_trace(args.trace)[:args.limit or None]
+    if not trace:
+        raise SystemExit("Trace is empty")
+    url = args.url.rstrip('/') + '/api/process_po'
+    headers = {'X-API-Key': os.getenv('API_KEY', ''), 'Content-Type': 'application/json'}
+
+    def submit(index: int, entry: Dict[str, Any]):
+        response = requests.post(url, data=json.dumps(replay_payload(index, entry)), headers=headers, timeout=60)
+        return response.json().get('job_id') if response.status_code == 202 else None
+
+    print(f"Replaying {len(trace)} requests at {args.speed}x against {url}")
+    started = time.time()
+    late = 0
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        futures = []
+        for index, entry in enumerate(trace):
+            due = started + (entry['t'] - trace[0]['t']) / args.speed
+            if due > time.time():
+                time.sleep(due - time.time())
+            elif time.time() - due > 1:
+                late += 1
+            futures.append(pool.submit(submit, index, entry))
+        job_ids = [f.result() for f in futures]
+    accepted = [job_id for job_id in job_ids if job_id]
+    submit_seconds = time.time() - started
+    print(f"Submitted in {submit_seconds:.1f}s: {len(accepted)} accepted, {len(job_ids) - len(accepted)} rejected, "
+          f"{late} sent more than 1s late")
+
+    deadline = time.time() + args.timeout
+    jobs = []
+    while time.time() < deadline:
+        jobs = [job for job in Job.fetch_many(accepted, connection=redis_conn) if job is not None]
+        if all(job.ended_at for job in jobs):
+            break
+        time.sleep(2)
+
+    done = [job for job in jobs if job.ended_at and job.started_at]
+    failed = sum(1 for job in done if job.get_status(refresh=False) == 'failed')
+    print(f"Completed: {len(done) - failed}, failed: {failed}, unfinished: {len(accepted) - len(done)}")
+    if not done:
+        return
+    first = min(job.enqueued_at for job in done)
+    last = max(job.ended_at for job in done)
+    print(f"Offered load:  {len(trace) / max(submit_seconds, 0.001):,.2f} req/s")
+    print(f"Throughput:    {len(done) / max((last - first).total_seconds(), 0.001):,.2f} jobs/s")
+
+    by_queue: Dict[str, Dict[str, List[float]]] = {}
+    for job in done:
+        stats = by_queue.setdefault(job.origin, {"wait": [], "service": []})
+        stats["wait"].append((job.started_at - job.enqueued_at).total_seconds())
+        stats["service"].append((job.ended_at - job.started_at).total_seconds())
+    for queue_name, stats in sorted(by_queue.items()):
+        print(f"  [{queue_name}] {len(stats['wait'])} jobs")
+        print(f"    queueing delay p50/p95/p99 (s): {percentile(stats['wait'], 50):.1f} / "
+              f"{percentile(stats['wait'], 95):.1f} / {percentile(stats['wait'], 99):.1f}")
+        print(f"    service time p50/p99 (s):       {percentile(stats['service'], 50):.1f} / "
+              f"{percentile(stats['service'], 99):.1f}")
+
+def stub_answer(schema: Any, words: List[int]) -> Any:
+    """Fills a JSON Schema with placeholder strings, counting the words generated."""
+    if isinstance(schema, dict) and schema.get('type') == 'object':
+        return {key: stub_answer(sub, words) for key, sub in schema.get('properties', {}).items()}
+    words[0] += 3
+    return "stub answer value"
+
+def cmd_stub(args):
+    """Serves a fake Ollama /api/generate and QuickBase /v1/records + /v1/fields with modelled latency."""
+    gpu_slots = threading.Semaphore(args.parallel)
+
+    class StubHandler(BaseHTTPRequestHandler):
+        def _reply(self, body: Any):
+            raw = json.dumps(body).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(raw)))
+            self.end_headers()
+            self.wfile.write(raw)
+
+        def do_GET(self):
+            # No field metadata: the worker writes values unchecked
+            self._reply([])
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            if not self.path.endswith('/api/generate'):
+                self._reply({"data": [], "metadata": {"totalNumberOfRecordsProcessed": len(body.get('data', []))}})
+                return
+            output_format = body.get('format')
+            if not isinstance(output_format, dict):
+                # Plain "json" mode: read the schema printed at the end of the prompt
+                schema_text = body.get('prompt', '').rpartition('REQUIRED OUTPUT SCHEMA')[2]
+                start = schema_text.find('{')
+                keys = json.JSONDecoder().raw_decode(schema_text[start:])[0] if start >= 0 else {}
+                output_format = {"type": "object", "properties": {k: {} for k in keys}}
+            words = [0]
+            answer = json.dumps(stub_answer(output_format, words))
+            prompt_tokens = len(body.get('prompt', '')) // 4
+            output_tokens = min(int(words[0] * 1.3) + 10, body.get('options', {}).get('num_predict', 1024))
+            final = {"done": True, "prompt_eval_count": prompt_tokens, "eval_count": output_tokens}
+            with gpu_slots:
+                time.sleep(prompt_tokens / args.prefill_tps)
+                if not body.get('stream', True):
+                    time.sleep(output_tokens / args.decode_tps)
+                    self._reply({"response": answer, **final})
+                    return
+                # Streamed like Ollama: one JSON line per token; a closed connection frees the slot
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/x-ndjson')
+                self.end_headers()
+                step = max(1, len(answer) // output_tokens)
+                try:
+                    for i in range(0, len(answer), step):
+                        time.sleep(1 / args.decode_tps)
+                        self.wfile.write(json.dumps({"response": answer[i:i + step], "done": False}).encode() + b'\n')
+                        self.wfile.flush()
+                    self.wfile.write(json.dumps({"response": "", **final}).encode() + b'\n')
+                except (BrokenPipeError, ConnectionResetError):
+                    print("Generation aborted by the client")
+
+        def log_message(self, format, *log_args):
+            pass
+
+    server = ThreadingHTTPServer(('0.0.0.0', args.port), StubHandler)
+    print(f"Stub backends on port {args.port} ({args.parallel} GPU slot(s), "
+          f"{args.prefill_tps:.0f} prefill / {args.decode_tps:.0f} decode tokens/s)")
+    server.serve_forever()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('export', help=cmd_export.__doc__)
+    p.add_argument('out')
+    p.set_defaults(func=cmd_export)
+
+    p = sub.add_parser('run', help=cmd_run.__doc__)
+    p.add_argument('trace')
+    p.add_argument('--speed', type=float, default=1.0, help='time compression, e.g. 10 for 10x')
+    p.add_argument('--url', default='http://localhost:5000')
+    p.add_argument('--limit', type=int, default=0, help='replay only the first N requests')
+    p.add_argument('--concurrency', type=int, default=8, help='parallel API submissions')
+    p.add_argument('--timeout', type=int, default=3600, help='seconds to wait for jobs to finish')
+    p.set_defaults(func=cmd_run)
+
+    p = sub.add_parser('stub', help=cmd_stub.__doc__)
+    p.add_argument('--port', type=int, default=8099)
+    p.add_argument('--parallel', type=int, default=1, help='concurrent generations, like OLLAMA_NUM_PARALLEL')
+    p.add_argument('--prefill-tps', type=float, default=2000.0)
+    p.add_argument('--decode-tps', type=float, default=40.0)
+    p.set_defaults(func=cmd_stub)
+
+    args = parser.parse_args()
+    if getattr(args, 'speed', 1) <= 0:
+        parser.error('--speed must be positive')
+    args.func(args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+import hashlib
+import re
+from collections import Counter
+from typing import Any, List, NamedTuple, Tuple
+
+from validation import appears_in_source, normalize_for_match
+
+# Section Diffs
+# A document is split into sections (paragraphs) and each section is reduced to a
+# short fingerprint of its whitespace-normalized text. Comparing the fingerprint
+# list of a revision with the one stored for the previous version tells which
+# passages were added, edited or removed, without keeping the old text around.
+
+_PARAGRAPH_RE = re.compile(r'\n\s*\n')
+SECTION_SEPARATOR = '\n\n[...]\n\n'
+
+class SectionDiff(NamedTuple):
+    fingerprints: List[str]     # Every section of the new text, in order
+    changed: List[str]          # Text of new or edited sections, in document order
+    removed: List[str]          # Fingerprints of old sections that no longer exist
+    changed_ratio: float        # Share of the new text (by characters) in changed sections
+
+    @property
+    def changed_text(self) -> str:
+        return SECTION_SEPARATOR.join(self.changed)
+
+def split_sections(text: str) -> List[str]:
+    return [s.strip() for s in _PARAGRAPH_RE.split(text) if s.strip()]
+
+def section_fingerprint(section: str) -> str:
+    return hashlib.sha1(' '.join(section.split()).encode('utf-8')).hexdigest()[:16]
+
+def diff_sections(previous: List[str], text: str) -> SectionDiff:
+    """Compares text with the fingerprints of the previous version (repeated sections are counted)."""
+    sections = split_sections(text)
+    fingerprints = [section_fingerprint(s) for s in sections]
+    unmatched = Counter(previous)
+    changed = []
+    for section, fp in zip(sections, fingerprints):
+        if unmatched[fp] > 0:
+            unmatched[fp] -= 1
+        else:
+            changed.append(section)
+    removed = [fp for fp, count in unmatched.items() if count > 0]
+    total = sum(len(s) for s in sections)
+    ratio = sum(len(s) for s in changed) / total if total else 0.0
+    return SectionDiff(fingerprints, changed, removed, ratio)
+
+def index_sections(text: str) -> List[Tuple[str, str]]:
+    """(fingerprint, normalized text) per section, for source_fingerprints."""
+    return [(section_fingerprint(s), normalize_for_match(s)) for s in split_sections(text)]
+
+def source_fingerprints(value: Any, indexed: List[Tuple[str, str]]) -> List[str]:
+    """Fingerprints of the sections an extracted value was taken from (empty if not found verbatim)."""
+    if value is None or (isinstance(value, str) and not value.strip()):
+        return []
+    return list(dict.fromkeys(fp for fp, normalized in indexed if appears_in_source(value, normalized)))
@@ -0,0 +1,21 @@
+import shutil
+import subprocess
+
+# System Stats
+# Shared by the API (/api/status) and the autoscaler.
+
+def get_gpu_stats():
+    """Parses nvidia-smi for GPU usage."""
+    if not shutil.which('nvidia-smi'):
+        return {"load": 0, "memory": 0, "mem_used_mb": 0}
+    try:
+        # Get GPU Load and Memory Used
+        output = subprocess.check_output(
+            ["nvidia-smi", "--query-gpu=utilization.gpu,memory.used,memory.total", "--format=csv,noheader,nounits"],
+            encoding='utf-8'
+        )
+        util, mem_used, mem_total = map(int, output.strip().split(', '))
+        mem_percent = round((mem_used / mem_total) * 100, 1)
+        return {"load": util, "memory": mem_percent, "mem_used_mb": mem_used}
+    except Exception:
+        return {"load": 0, "memory": 0, "mem_used_mb": 0}
@@ -0,0 +1,24 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from doc_source import cache_path, modified_stamp
+
+QUICKBASE_STAMP = '2024-03-01T12:34:56.000Z'     # Date Modified as /v1/records/query returns it
+
+@pytest.mark.parametrize('caller_stamp', [
+    '2024-03-01T12:34:56Z', '2024-03-01T12:34:56+00:00', '2024-03-01T07:34:56-05:00',
+    '1709296496000', 1709296496000, '1709296496',
+])
+def test_caller_stamp_names_the_same_cache_entry(caller_stamp):
+    assert cache_path('bck7abc', '42', 12, modified_stamp(caller_stamp)) == \
+        cache_path('bck7abc', '42', 12, modified_stamp(QUICKBASE_STAMP))
+
+def test_different_revisions_stay_apart():
+    assert modified_stamp('2024-03-01T12:34:57Z') != modified_stamp(QUICKBASE_STAMP)
+
+def test_unparseable_stamp_is_used_as_given():
+    assert modified_stamp(' 03-01-2024 12:34 PM ') == '03-01-2024 12:34 PM'
@@ -0,0 +1,80 @@
+"""
+Corpus and fuzz tests for json_repair.parse_llm_json. Each case in json_corpus/ has:
+    <case>.txt    model response as received
+    <case>.json   {"data": what must be recovered, "lost_keys": keys that cannot be}
+
+Beyond the corpus, every response (and mutated versions of the complete ones:
+raw newlines, trailing commas, unescaped quotes, fences and chatter) is cut off
+at every offset. A cut-off response may lose keys, but must never raise and
+never return a value that differs from the one in the full response.
+"""
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from json_repair import parse_llm_json
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'json_corpus')
+CASES = sorted(name[:-len('.json')] for name in os.listdir(CORPUS_DIR) if name.endswith('.json'))
+
+def _load(case: str):
+    with open(os.path.join(CORPUS_DIR, f"{case}.txt"), encoding='utf-8') as f:
+        raw = f.read()
+    with open(os.path.join(CORPUS_DIR, f"{case}.json"), encoding='utf-8') as f:
+        expected = json.load(f)
+    return raw, expected["data"], expected["lost_keys"]
+
+def _raw_newlines(text: str) -> str:
+    return text.replace('\\n', '\n').replace('\\t', '\t')
+
+def _trailing_commas(text: str) -> str:
+    return text.replace('"]', '",]').rstrip()[:-1].rstrip() + ',\n}'
+
+def _unescaped_quotes(text: str) -> str:
+    return text.replace('\\"', '"')
+
+def _fence_and_chatter(text: str) -> str:
+    return f"Sure, here is the extracted data:\n```json\n{text}\n```\nLet me know if you need anything else."
+
+MUTATIONS = {
+    'raw_newlines': _raw_newlines,
+    'trailing_commas': _trailing_commas,
+    'unescaped_quotes': _unescaped_quotes,
+    'fence_and_chatter': _fence_and_chatter,
+    'all': lambda text: _fence_and_chatter(_unescaped_quotes(_trailing_commas(_raw_newlines(text)))),
+}
+COMPLETE_CASES = [case for case in CASES if not _load(case)[2]]
+
+def _assert_prefixes_never_wrong(raw: str, data, keys):
+    for cut in range(len(raw) + 1):
+        result = parse_llm_json(raw[:cut], keys)
+        for key, value in result.data.items():
+            assert key in data and data[key] == value, f"cut at {cut}: {raw[:cut][-40:]!r} gave {key}={value!r}"
+        assert set(result.lost_keys) == set(keys) - set(result.data)
+
+@pytest.mark.parametrize('case', CASES)
+def test_corpus_response_is_recovered(case):
+    raw, data, lost_keys = _load(case)
+    result = parse_llm_json(raw, list(data) + lost_keys)
+    assert result.data == data
+    assert result.lost_keys == lost_keys
+
+@pytest.mark.parametrize('case', CASES)
+def test_truncation_at_every_offset(case):
+    raw, data, lost_keys = _load(case)
+    _assert_prefixes_never_wrong(raw, data, list(data) + lost_keys)
+
+@pytest.mark.parametrize('mutation', sorted(MUTATIONS))
+@pytest.mark.parametrize('case', COMPLETE_CASES)
+@pytest.mark.parametrize('indent', [None, 2])
+def test_mutated_response(case, mutation, indent):
+    data = _load(case)[1]
+    raw = MUTATIONS[mutation](json.dumps(data, indent=indent))
+    result = parse_llm_json(raw, list(data))
+    assert result.data == data
+    assert result.lost_keys == []
+    _assert_prefixes_never_wrong(raw, data, list(data))
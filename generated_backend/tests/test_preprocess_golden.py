@@ -0,0 +1,46 @@
+"""
+Golden files for preprocess.preprocess_text. Each case in golden/ has:
+    <case>.txt            document as received
+    <case>.expected.txt   exact preprocessed text
+    <case>.json           answers an extraction must find, {key: value}
+
+Every answer must still appear in the preprocessed text, so preprocessing
+cannot change what the model is able to extract. After an intended change,
+regenerate the expected files with `python tests/test_preprocess_golden.py`
+and review the diff.
+"""
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from preprocess import preprocess_text
+from validation import appears_in_source, normalize_for_match
+
+GOLDEN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'golden')
+CASES = sorted(name[:-len('.json')] for name in os.listdir(GOLDEN_DIR) if name.endswith('.json'))
+
+def _read(name: str) -> str:
+    with open(os.path.join(GOLDEN_DIR, name), encoding='utf-8') as f:
+        return f.read()
+
+@pytest.mark.parametrize('case', CASES)
+def test_preprocessed_text_matches_golden(case):
+    assert preprocess_text(_read(f"{case}.txt")).text == _read(f"{case}.expected.txt")
+
+@pytest.mark.parametrize('case', CASES)
+def test_answers_survive_preprocessing(case):
+    raw = _read(f"{case}.txt")
+    cleaned = preprocess_text(raw).text
+    for key, value in json.loads(_read(f"{case}.json")).items():
+        assert appears_in_source(value, normalize_for_match(raw)), f"{case}: '{key}' not in the input"
+        assert value in cleaned, f"{case}: '{key}' ({value!r}) lost in preprocessing"
+
+if __name__ == '__main__':
+    for case in CASES:
+        with open(os.path.join(GOLDEN_DIR, f"{case}.expected.txt"), 'w', encoding='utf-8') as f:
+            f.write(preprocess_text(_read(f"{case}.txt")).text)
+        print(f"Updated {case}.expected.txt")
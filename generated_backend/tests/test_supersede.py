@@ -0,0 +1,48 @@
+"""
+Superseding: a newer request for the same record and request cancels the older
+job, but two different requests for one record must never cancel each other.
+Needs the API's dependencies (flask, redis, rq); the end-to-end case also fakeredis.
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip('flask')
+pytest.importorskip('redis')
+pytest.importorskip('rq')
+
+import app
+
+TERMS = {"record_id": 7, "target_table_id": "bck7abc", "po_text": "Purchase order 7. " * 5,
+         "target_field_ids": {"payment_terms": 10}, "prompt_json": {"payment_terms": "Payment terms?"}}
+INSURANCE = {**TERMS, "target_field_ids": {"coverage_limit": 11}, "prompt_json": {"coverage_limit": "Coverage limit?"}}
+
+def test_unnamed_requests_with_different_schemas_have_different_keys():
+    assert app.supersede_key(TERMS) != app.supersede_key(INSURANCE)
+
+def test_same_schema_or_same_name_supersedes():
+    assert app.supersede_key(TERMS) == app.supersede_key(dict(TERMS))
+    assert app.supersede_key({**TERMS, "request_name": "Review"}) == \
+        app.supersede_key({**INSURANCE, "request_name": "Review"})
+
+def test_two_schemas_for_one_record_both_stay_queued(monkeypatch):
+    fakeredis = pytest.importorskip('fakeredis')
+    conn = fakeredis.FakeRedis()
+    monkeypatch.setattr(app, 'redis_conn', conn)
+    for name in ('q_high', 'q_default', 'q_low', 'q_long'):
+        monkeypatch.setattr(app, name, app.Queue(getattr(app, name).name, connection=conn))
+    monkeypatch.setattr(app, 'API_KEY', 'test')
+    client = app.app.test_client()
+
+    job_ids = []
+    for payload in (TERMS, INSURANCE, INSURANCE):
+        response = client.post('/api/process_po', json=payload, headers={'X-API-Key': 'test'})
+        assert response.status_code == 202
+        job_ids.append(response.get_json()['job_id'])
+
+    assert conn.get(f"job_cancel:{job_ids[0]}") is None
+    assert conn.get(f"job_cancel:{job_ids[1]}") == b'superseded'
+    assert conn.get(f"job_cancel:{job_ids[2]}") is None
@@ -0,0 +1,27 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from validation import coerce_field_value
+
+@pytest.mark.parametrize('value, expected', [
+    ('1250', 1250.0), ('$12,450.00', 12450.0), ('-$500', -500.0), ('$-500', -500.0), ('+3.5', 3.5),
+    ('USD 1,000', 1000.0), ('1,000 EUR', 1000.0), ('€ 99.90', 99.9), ('.75', 0.75), (' 42 ', 42.0),
+    (1250, 1250.0), (0.5, 0.5),
+])
+def test_single_number_is_accepted(value, expected):
+    assert coerce_field_value(value, {'type': 'currency'}) == (True, expected)
+
+@pytest.mark.parametrize('value', [
+    'Qty 2 @ $500 each', 'Net 30 days, 2% 10', '30 days', '$500 - $700', '1,2345', '12.5.1', '-$-5', 'TBD', '', True,
+])
+def test_phrase_or_malformed_number_is_rejected(value):
+    accepted, returned = coerce_field_value(value, {'type': 'numeric'})
+    assert not accepted and returned == value
+
+def test_percent_field_scales_percent_values():
+    assert coerce_field_value('2.5%', {'type': 'percent'}) == (True, 0.025)
+    assert coerce_field_value('0.025', {'type': 'percent'}) == (True, 0.025)
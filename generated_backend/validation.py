@@ -0,0 +1,173 @@
+import re
+from datetime import date, datetime
+from typing import Any, Dict, Optional, Tuple
+
+# Value Checks
+# Cheap local checks on extracted values: is it a parseable date / amount, and
+# does it actually appear in the source document?
+
+DATE_HINTS = ('date', 'deadline', 'expir', 'due', 'effective')
+AMOUNT_HINTS = ('amount', 'total', 'price', 'cost', 'fee', 'value', 'sum', 'limit')
+LONG_VALUE_CHARS = 120          # Longer values are matched by word overlap, not substring
+LONG_VALUE_OVERLAP = 0.8
+
+_DATE_FORMATS = (
+    '%m/%d/%Y', '%m/%d/%y', '%m-%d-%Y', '%m-%d-%y', '%m.%d.%Y', '%Y-%m-%d', '%Y/%m/%d',
+    '%B %d, %Y', '%B %d %Y', '%b %d, %Y', '%b %d %Y', '%d %B %Y', '%d %b %Y', '%B %Y', '%b %Y'
+)
+_DATE_CANDIDATE_RE = re.compile(
+    r'\b(?:\d{4}[-/]\d{1,2}[-/]\d{1,2}'
+    r'|\d{1,2}[-/.]\d{1,2}[-/.]\d{2,4}'
+    r'|\d{1,2}\s+[A-Za-z]{3,9}\.?\s+\d{4}'
+    r'|[A-Za-z]{3,9}\.?\s+\d{1,2},?\s+\d{4}'
+    r'|[A-Za-z]{3,9}\.?\s+\d{4})\b'
+)
+_ORDINAL_RE = re.compile(r'(\d)(st|nd|rd|th)\b', re.IGNORECASE)
+_AMOUNT_RE = re.compile(r'[-+]?\$?\s*\d[\d,]*(?:\.\d+)?')
+_NUMBER_RE = re.compile(
+    r'(?P<sign>[-+])?\s*(?:[$€£]|USD|EUR|GBP)?\s*(?P<inner_sign>[-+])?\s*'
+    r'(?P<number>\d{1,3}(?:,\d{3})+(?:\.\d+)?|\d+(?:\.\d+)?|\.\d+)'
+    r'\s*(?:USD|EUR|GBP)?\s*(?P<percent>%)?',
+    re.IGNORECASE
+)
+_NON_WORD_RE = re.compile(r'[^a-z0-9]+')
+
+def parse_date(value: Any) -> Optional[date]:
+    """Finds the first recognisable date in value."""
+    if value is None:
+        return None
+    text = _ORDINAL_RE.sub(r'\1', str(value))
+    for candidate in _DATE_CANDIDATE_RE.findall(text):
+        candidate = candidate.replace('.', '') if not re.match(r'^\d', candidate) else candidate
+        for fmt in _DATE_FORMATS:
+            try:
+                return datetime.strptime(candidate, fmt).date()
+            except ValueError:
+                continue
+    return None
+
+def parse_amount(value: Any) -> Optional[float]:
+    """First number in value, ignoring currency symbols and thousands separators."""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    if value is None:
+        return None
+    match = _AMOUNT_RE.search(str(value))
+    if not match:
+        return None
+    try:
+        return float(re.sub(r'[$,\s]', '', match.group(0)))
+    except ValueError:
+        return None
+
+def parse_number(value: Any) -> Optional[Tuple[float, bool]]:
+    """
+    (number, is_percent) if value is a single number, optionally with a sign,
+    currency, thousands separators or '%'. Anything else ("Qty 2 @ $500 each",
+    "Net 30 days, 2% 10") is None, so no number is picked out of a phrase.
+    """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value), False
+    if value is None:
+        return None
+    match = _NUMBER_RE.fullmatch(str(value).strip())
+    if not match or (match.group('sign') and match.group('inner_sign')):
+        return None
+    number = float(match.group('number').replace(',', ''))
+    if '-' in (match.group('sign'), match.group('inner_sign')):
+        number = -number
+    return number, bool(match.group('percent'))
+
+def normalize_for_match(text: str) -> str:
+    return ' '.join(_NON_WORD_RE.sub(' ', text.lower()).split())
+
+def appears_in_source(value: Any, normalized_source: str) -> bool:
+    """True if the value (or, for long values, most of its words) occurs in the source."""
+    needle = normalize_for_match(str(value))
+    if not needle:
+        return False
+    if len(needle) <= LONG_VALUE_CHARS:
+        return needle in normalized_source
+    words = set(needle.split())
+    source_words = set(normalized_source.split())
+    return len(words & source_words) / len(words) >= LONG_VALUE_OVERLAP
+
+def _hinted(key: str, question: str, hints) -> bool:
+    label = f"{key} {question}".lower()
+    return any(hint in label for hint in hints)
+
+def has_expected_type(key: str, question: str, value: Any) -> bool:
+    """False if a date or amount key's value does not parse as one."""
+    if _hinted(key, question, DATE_HINTS) and parse_date(value) is None:
+        return False
+    if _hinted(key, question, AMOUNT_HINTS) and parse_amount(value) is None:
+        return False
+    return True
+
+def validate_extracted_value(key: str, question: str, value: Any, normalized_source: str) -> bool:
+    """Checks an extraction answer: present, well-typed for date/amount keys, grounded in the text."""
+    if value is None or (isinstance(value, str) and not value.strip()):
+        return False
+    return has_expected_type(key, question, value) and appears_in_source(value, normalized_source)
+
+# QuickBase Field Coercion
+# Values are shaped for the target field type before writing, so type mismatches
+# are caught locally instead of failing the whole write after the round trip.
+TEXT_FIELD_TYPES = {'text', 'text-multi-line', 'rich-text', 'email', 'phone', 'url', 'text-multiple-choice'}
+NUMERIC_FIELD_TYPES = {'numeric', 'currency', 'percent', 'rating'}
+READ_ONLY_MODES = {'formula', 'lookup', 'summary'}
+NON_WRITABLE_FIELD_TYPES = {'user', 'multiuser', 'file', 'recordid', 'dblink', 'icon'}
+_TRUE_WORDS = {'true', 'yes', 'y', '1', 'checked', 'x'}
+_FALSE_WORDS = {'false', 'no', 'n', '0', 'unchecked', 'none', 'n/a'}
+
+def coerce_field_value(value: Any, field: Dict[str, Any]) -> Tuple[bool, Any]:
+    """
+    Coerces an AI value for a QuickBase field described by
+    {"type", "mode", "max_length", "choices", "allow_new_choices"}.
+    Returns (accepted, value); rejected values should not be written.
+    """
+    if value is None:
+        return True, None
+    if field.get('mode') in READ_ONLY_MODES:
+        return False, value
+    if isinstance(value, list):
+        value = '<br>'.join(str(v) for v in value if v is not None)
+    elif isinstance(value, dict):
+        value = '<br>'.join(f"{k}: {v}" for k, v in value.items())
+
+    field_type = field.get('type', 'text')
+    if field_type == 'date':
+        parsed = parse_date(value)
+        return (True, parsed.isoformat()) if parsed else (False, value)
+    if field_type in ('datetime', 'timestamp'):
+        parsed = parse_date(value)
+        return (True, f"{parsed.isoformat()}T00:00:00Z") if parsed else (False, value)
+    if field_type in NUMERIC_FIELD_TYPES:
+        parsed = parse_number(value)
+        if parsed is None:
+            return False, value
+        number, is_percent = parsed
+        if field_type == 'percent' and is_percent:
+            number = number / 100
+        return True, number
+    if field_type == 'checkbox':
+        word = str(value).strip().lower()
+        if isinstance(value, bool):
+            return True, value
+        if word in _TRUE_WORDS or word in _FALSE_WORDS:
+            return True, word in _TRUE_WORDS
+        return False, value
+    if field_type in TEXT_FIELD_TYPES:
+        text = str(value)
+        choices = field.get('choices') or []
+        if field_type == 'text-multiple-choice' and choices and not field.get('allow_new_choices', True):
+            match = next((c for c in choices if c.lower() == text.strip().lower()), None)
+            return (True, match) if match is not None else (False, value)
+        max_length = field.get('max_length') or 0
+        if max_length and len(text) > max_length:
+            text = text[:max(0, max_length - 3)] + '...'
+        return True, text
+    if field_type in NON_WRITABLE_FIELD_TYPES:
+        return False, value
+    # Unknown types are passed through unchanged and left to QuickBase
+    return True, value
@@ -0,0 +1,60 @@
+import logging
+import os
+
+import psutil
+from rq import SimpleWorker
+
+from fair_queue import FairWorker
+
+logger = logging.getLogger(__name__)
+
+# Warm Workers
+# RQ's default Worker forks a child per job, so every job starts with a cold
+# Redis client, new HTTP connections and empty in-process caches. WarmWorker runs
+# jobs in the worker process itself, keeping connection pools, compiled prompt
+# templates and caches across jobs. Isolation comes from the supervisor instead:
+# systemd (Restart=always) or autoscaler.py restarts the process when it exits,
+# and the watchdog below exits on purpose (warm shutdown, between jobs) once the
+# process has grown past WARM_MAX_RSS_MB or has run WARM_MAX_JOBS jobs.
+
+WORKER_MODE = os.getenv('WORKER_MODE', 'fork').lower()       # 'fork' or 'warm'
+WARM_MAX_RSS_MB = int(os.getenv('WARM_MAX_RSS_MB', 2048))
+WARM_MAX_JOBS = int(os.getenv('WARM_MAX_JOBS', 1000))        # 0 = no limit
+
+class WarmWorker(SimpleWorker):
+    """Non-forking worker that recycles itself when memory grows or after WARM_MAX_JOBS jobs."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._process = psutil.Process()
+        self._jobs_run = 0
+        self._baseline_rss_mb = None
+
+    def execute_job(self, job, queue):
+        try:
+            return super().execute_job(job, queue)
+        finally:
+            self._check_recycle()
+
+    def _check_recycle(self):
+        self._jobs_run += 1
+        rss_mb = self._process.memory_info().rss / (1024 * 1024)
+        if self._baseline_rss_mb is None:
+            # Measured after the first job, once imports and caches are loaded
+            self._baseline_rss_mb = rss_mb
+        reason = None
+        if WARM_MAX_RSS_MB and rss_mb > WARM_MAX_RSS_MB:
+            reason = f"RSS {rss_mb:.0f} MB above {WARM_MAX_RSS_MB} MB (was {self._baseline_rss_mb:.0f} MB after the first job)"
+        elif WARM_MAX_JOBS and self._jobs_run >= WARM_MAX_JOBS:
+            reason = f"{self._jobs_run} jobs run"
+        if reason:
+            logger.info(f"Recycling warm worker {os.getpid()}: {reason}")
+            try:
+                self.connection.hincrbyfloat("worker_metrics", "warm_worker_recycles", 1)
+            except Exception as e:
+                logger.warning(f"Could not record metric warm_worker_recycles: {e}")
+            # Same as a SIGTERM warm shutdown: the work loop exits before the next job
+            self._stop_requested = True
+
+class WarmFairWorker(FairWorker, WarmWorker):
+    """FairWorker scheduling with WarmWorker execution."""
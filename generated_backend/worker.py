@@ -2,10 +2,30 @@ import os
 import requests
 import json
 import time
+import hashlib
+import random
 import logging
-from typing import Dict, Any, Union
+import re
+import tempfile
+import threading
+import uuid
+from email.utils import parsedate_to_datetime
+from typing import Callable, Dict, Any, List, Optional, Tuple, Union
 from redis import Redis
-from rq import Worker, Queue, Connection
+from rq import Worker, Queue, Connection, Retry, get_current_job
+from rq.exceptions import NoSuchJobError
+from rq.job import Job
+
+from doc_source import cache_path, decode_base64_stream, document_key, extract_text, modified_stamp, read_cached, write_cached
+from fair_queue import FAIR_QUEUING, FairWorker, base_queue_name, subqueue_names
+from json_repair import parse_llm_json
+from payload_store import fetch_text
+from preprocess import CHARS_PER_TOKEN, preprocess_text
+from profiling import annotate_span, finish_profile, profile_stage, start_profile, traced
+from rate_limit import RateLimitWaitExceeded, SlotSemaphore, TokenBucket
+from section_diff import SectionDiff, diff_sections, index_sections, source_fingerprints
+from validation import coerce_field_value, has_expected_type, normalize_for_match, validate_extracted_value
+from warm_worker import WORKER_MODE, WarmFairWorker, WarmWorker
 
 # Configure Logging
 logging.basicConfig(
@@ -19,6 +39,11 @@ OLLAMA_URL = os.getenv('OLLAMA_URL', 'http://localhost:11434/api/generate')
 QUICKBASE_URL = os.getenv('QUICKBASE_URL', 'https://api.quickbase.com/v1/records')
 QUICKBASE_USER_TOKEN = os.getenv('QUICKBASE_USER_TOKEN')
 QUICKBASE_REALM = os.getenv('QUICKBASE_REALM', 'your-realm.quickbase.com')
+OLLAMA_MODEL = os.getenv('OLLAMA_MODEL', 'llama3.1')
+# Pass a JSON Schema in Ollama's 'format' field (set to 'false' to fall back to plain "json" mode)
+OLLAMA_STRUCTURED_OUTPUT = os.getenv('OLLAMA_STRUCTURED_OUTPUT', 'true').lower() == 'true'
+# Strip page furniture and duplicate boilerplate from po_text before inference
+PREPROCESS_TEXT = os.getenv('PREPROCESS_TEXT', 'true').lower() == 'true'
 
 # Redis Connection (Global)
 redis_conn = Redis(
@@ -27,6 +52,11 @@ redis_conn = Redis(
     password=os.getenv('REDIS_PASSWORD', None)
 )
 
+# HTTP Session (Global): keeps Ollama and QuickBase connections open across jobs
+# in warm workers (see warm_worker.py); a forked job starts with an empty pool.
+http_session = requests.Session()
+
+@traced('redis_log')
 def log_safe_event(message: str):
     """Logs a message to stdout (for systemd) AND pushes it to Redis (for Dashboard)."""
     logger.info(message)
@@ -39,43 +69,301 @@ def log_safe_event(message: str):
     except Exception as e:
         logger.warning(f"Could not push log to Redis: {e}")
 
-def query_ollama(po_text: str, prompt_json: Dict[str, str], is_summary: bool = False) -> Dict[str, Any]:
+@traced('redis_metric')
+def record_metric(name: str, amount: float = 1):
+    """Increments a counter in the shared 'worker_metrics' hash (shown on /api/status)."""
+    try:
+        redis_conn.hincrbyfloat("worker_metrics", name, amount)
+    except Exception as e:
+        logger.warning(f"Could not record metric {name}: {e}")
+
+# Deadlines & Cancellation
+# The API stamps every job with an absolute 'deadline'. Ollama is called in
+# streaming mode so a generation can be dropped between tokens: closing the
+# connection makes Ollama stop and frees the GPU slot right away. A job is
+# aborted when its deadline passes or when it is cancelled (POST
+# /api/jobs/<id>/cancel, or superseded by a newer request for the same record),
+# and the summary pass is skipped when the time left cannot cover it.
+ABORT_CHECK_INTERVAL = 1.0       # Seconds between cancel-flag checks while streaming
+DEADLINE_SUMMARY_MIN_SECONDS = int(os.getenv('DEADLINE_SUMMARY_MIN_SECONDS', 60))
+STAGE_ESTIMATE_MIN_RUNS = 5      # Stage timings needed before estimates are trusted
+_active_job = threading.local()  # Per thread: bulk.py runs several jobs at once
+
+class JobAborted(Exception):
+    """Raised inside a job that was cancelled, superseded or ran past its deadline."""
+
+    def __init__(self, reason: str):
+        super().__init__(f"Job aborted: {reason}")
+        self.reason = reason
+
+def cancel_reason(job_id: Optional[str]) -> Optional[str]:
+    """'cancelled' or 'superseded' if the job was flagged by the API, else None."""
+    if not job_id:
+        return None
+    try:
+        raw = redis_conn.get(f"job_cancel:{job_id}")
+    except Exception as e:
+        logger.warning(f"Could not check cancel flag for {job_id}: {e}")
+        return None
+    return raw.decode('utf-8') if raw else None
+
+_usage = threading.local()       # Ollama usage of the current pass (see reset_usage)
+
+def reset_usage():
+    """Starts counting Ollama calls and tokens on this thread (read with current_usage)."""
+    _usage.totals = {"calls": 0, "prompt_tokens": 0, "output_tokens": 0}
+
+def current_usage() -> Dict[str, int]:
+    return dict(getattr(_usage, 'totals', None) or {})
+
+def start_job_context(job_id: Optional[str], data: Dict[str, Any]):
+    _active_job.id = job_id
+    _active_job.deadline = data.get('deadline')
+    # A preempted job continues under a new ID; cancels still target the original one
+    _active_job.alias = data.get('resumes_job')
+    _active_job.high = (data.get('priority') or '').lower() == 'high'
+
+def seconds_left() -> Optional[float]:
+    deadline = getattr(_active_job, 'deadline', None)
+    return None if deadline is None else deadline - time.time()
+
+def check_abort():
+    """Raises JobAborted if the current job is past its deadline or was cancelled."""
+    left = seconds_left()
+    if left is not None and left <= 0:
+        raise JobAborted('deadline')
+    reason = cancel_reason(getattr(_active_job, 'id', None)) or cancel_reason(getattr(_active_job, 'alias', None))
+    if reason:
+        raise JobAborted(reason)
+
+def estimate_stage_seconds(stage: str, chars: int) -> Optional[float]:
+    """Rough stage duration from past runs (seconds per character), None until enough history."""
+    try:
+        runs, seconds, total_chars = redis_conn.hmget(
+            "worker_metrics", f"stage_runs:{stage}", f"stage_seconds:{stage}", f"stage_chars:{stage}")
+    except Exception as e:
+        logger.warning(f"Could not read stage timings: {e}")
+        return None
+    if not runs or float(runs) < STAGE_ESTIMATE_MIN_RUNS or not total_chars or float(total_chars) <= 0:
+        return None
+    return float(seconds) / float(total_chars) * chars
+
+def record_abort(reason: str, record_id: Any, reclaimed: float, expired: List[Dict[str, Any]] = ()) -> str:
     """
-    Send text + schema to Ollama.
-    IMPROVEMENT: Added 'is_summary' flag to adjust settings dynamically.
+    Counts an aborted job and the GPU time it did not spend; returns the job result.
+    On a missed deadline the error is reported to every request in 'expired'.
+    Requests the job absorbed (fusion, micro-batch) are handed back to the queue.
     """
-    if is_summary:
-        system_instruction = (
-            "You are an expert legal analyst. Summarize the document sections as requested. "
-            "Use <br> tags for line breaks. Do not use newlines inside values. "
-            "Output ONLY valid JSON."
-        )
-        # Summaries need more "creativity" and length
-        options = {
-            "temperature": 0.1, 
-            "num_predict": 4096, 
-            "top_k": 40, 
-            "num_ctx": 32000,
-            "repeat_penalty": 1.1
-        }
-    else:
-        system_instruction = (
-            "You are a strict data extraction engine. Extract specific terms exactly as they appear. "
-            "Output ONLY valid JSON."
-        )
-        # Data extraction needs to be deterministic (0 temperature)
-        options = {
-            "temperature": 0.0, 
-            "num_predict": 1024, 
-            "top_k": 20, 
-            "num_ctx": 32000
-        }
+    record_metric(f"jobs_aborted:{reason}")
+    if reclaimed > 0:
+        record_metric("gpu_seconds_reclaimed", reclaimed)
+    log_safe_event(f"Record {record_id}: aborted ({reason}), ~{reclaimed:.0f} GPU-seconds reclaimed")
+    if reason == 'deadline':
+        for member in expired:
+            report_job_error(member, Exception("Expired: not processed before its deadline"))
+    job = get_current_job()
+    if job is not None:
+        release_absorbed(job.id)
+    return "Expired" if reason == 'deadline' else reason.capitalize()
+
+def release_absorbed(job_id: str):
+    """
+    Re-enqueues the requests an aborted job had fused or micro-batched, since the
+    abort only applies to the job itself. Members that were cancelled or
+    superseded on their own are dropped; those past their own deadline are
+    reported as expired instead.
+    """
+    member_ids = []
+    for key in (f"fusion_members:{job_id}", f"microbatch_members:{job_id}"):
+        member_ids += [raw.decode('utf-8') for raw in redis_conn.lrange(key, 0, -1)]
+        redis_conn.delete(key)
+    for member_job in Job.fetch_many(member_ids, connection=redis_conn):
+        if member_job is None:
+            continue
+        member = member_job.args[0]
+        if cancel_reason(member_job.id) or cancel_reason(member.get('resumes_job')):
+            continue
+        deadline = member.get('deadline')
+        if deadline is not None and deadline <= time.time():
+            record_metric("jobs_aborted:deadline")
+            report_job_error(member, Exception("Expired: not processed before its deadline"))
+            continue
+        continuation_id = enqueue_continuation(member_job, member)
+        record_metric("absorbed_jobs_released")
+        log_safe_event(f"Record {member['record_id']}: released from aborted job {job_id}, "
+                       f"continues as job {continuation_id}")
+
+def enqueue_continuation(job: Job, data: Dict[str, Any], continuation_id: Optional[str] = None) -> str:
+    """Re-enqueues a job's request at the front of its queue under a new ID; returns that ID."""
+    continuation_id = continuation_id or str(uuid.uuid4())
+    Queue(job.origin, connection=redis_conn).enqueue(
+        'worker.process_po_job',
+        args=({**data, 'resumes_job': data.get('resumes_job') or job.id},),
+        job_id=continuation_id,
+        description=job.description,
+        job_timeout=job.timeout,
+        retry=Retry(max=job.retries_left, interval=job.retry_intervals) if job.retries_left else None,
+        at_front=True
+    )
+    job.meta['continued_as'] = continuation_id
+    job.save_meta()
+    return continuation_id
 
-    full_prompt = f"""
-{system_instruction}
+# Priority Preemption
+# A worker serving several queues cannot pick up a new 'high' record while it is
+# busy with a long job. Between stages (each one checkpointed), a job that is not
+# high priority checks for waiting high work and, if the stages it still has to
+# run are estimated to take PREEMPT_MIN_REMAINING_SECONDS longer than the waiting
+# job, yields: it re-enqueues itself at the front of its queue and returns, the
+# worker takes the high job next (list PREEMPT_QUEUE first in WORKER_QUEUES), and
+# the continuation resumes from the checkpoint. A job yields at most PREEMPT_MAX
+# times, and never while either estimate is unknown (no size, or fewer than
+# STAGE_ESTIMATE_MIN_RUNS past runs of a stage). Independently, with OLLAMA_SLOTS
+# set (to OLLAMA_NUM_PARALLEL), other jobs may only hold OLLAMA_SLOTS minus
+# OLLAMA_HIGH_RESERVED_SLOTS concurrent generations, so a high job always finds
+# a free GPU slot on a worker that is idle for it.
+PREEMPTION = os.getenv('PREEMPTION', 'true').lower() == 'true'
+PREEMPT_QUEUE = os.getenv('PREEMPT_QUEUE', 'high')
+PREEMPT_MAX = int(os.getenv('PREEMPT_MAX', 3))
+PREEMPT_MIN_REMAINING_SECONDS = int(os.getenv('PREEMPT_MIN_REMAINING_SECONDS', 30))
+OLLAMA_SLOTS = int(os.getenv('OLLAMA_SLOTS', 0))                    # 0 = no slot accounting
+OLLAMA_HIGH_RESERVED_SLOTS = int(os.getenv('OLLAMA_HIGH_RESERVED_SLOTS', 1))
+WORKER_QUEUE_NAMES = [q.strip() for q in os.getenv('WORKER_QUEUES', 'default').split(',') if q.strip()]
+ollama_slots = SlotSemaphore(redis_conn, 'ollama')
+
+def acquire_ollama_slot() -> Optional[str]:
+    """Waits for a generation slot (high jobs may also use the reserved ones); returns its token."""
+    if OLLAMA_SLOTS <= 0:
+        return None
+    high = getattr(_active_job, 'high', False)
+    limit = OLLAMA_SLOTS if high else max(1, OLLAMA_SLOTS - OLLAMA_HIGH_RESERVED_SLOTS)
+    left = seconds_left()
+    lease = (3600 if left is None else max(1.0, left)) + 60
+    token = f"{os.getpid()}:{uuid.uuid4().hex[:12]}"
+    started = time.time()
+    while not ollama_slots.try_acquire(token, limit, lease):
+        check_abort()
+        time.sleep(random.uniform(0.2, 0.5))
+    waited = time.time() - started
+    if waited >= 0.5:
+        record_metric(f"ollama_slot_wait_seconds:{'high' if high else 'other'}", waited)
+    return token
+
+def estimate_job_seconds(data: Dict[str, Any]) -> Optional[float]:
+    """Estimated LLM time of a queued job's payload, None if its size or a stage timing is unknown."""
+    chars = data.get('po_text_len') or (data.get('source') or {}).get('size')
+    if not chars:
+        return None
+    summary_keys, extraction_keys = split_prompt_keys(data.get('prompt_json', {}))
+    estimates = [estimate_stage_seconds(stage, chars)
+                 for stage, keys in (('extraction', extraction_keys), ('summary', summary_keys)) if keys]
+    return None if None in estimates else sum(estimates)
+
+def waiting_high_seconds() -> Optional[float]:
+    """
+    Estimated run time of the longest job at the head of PREEMPT_QUEUE (or of
+    its tenant sub-queues); None if nothing is waiting or any estimate is unknown.
+    """
+    try:
+        names = [PREEMPT_QUEUE] + subqueue_names(redis_conn, PREEMPT_QUEUE)
+        head_ids = [raw.decode('utf-8') for name in names for raw in redis_conn.lrange(f"rq:queue:{name}", 0, 0)]
+        heads = [job for job in Job.fetch_many(head_ids, connection=redis_conn) if job is not None]
+    except Exception as e:
+        logger.warning(f"Could not check the {PREEMPT_QUEUE} queue: {e}")
+        return None
+    estimates = [estimate_job_seconds(job.args[0] if job.args and isinstance(job.args[0], dict) else {})
+                 for job in heads]
+    return max(estimates) if estimates and None not in estimates else None
+
+def maybe_preempt(data: Dict[str, Any], remaining: List[Tuple[str, int]]) -> Optional[str]:
+    """
+    Called between stages with the (stage, chars) still to run. Returns "Preempted"
+    after re-enqueueing this job behind the waiting high work, else None.
+    """
+    job = get_current_job()
+    if (not PREEMPTION or job is None or getattr(_active_job, 'high', False)
+            or PREEMPT_QUEUE not in WORKER_QUEUE_NAMES or base_queue_name(job.origin) == PREEMPT_QUEUE
+            or data.get('preemptions', 0) >= PREEMPT_MAX or not remaining):
+        return None
+    # Only yield when it clearly pays off: both sizes known, this job's rest much longer
+    estimates = [estimate_stage_seconds(stage, chars) for stage, chars in remaining]
+    if None in estimates:
+        return None
+    high_seconds = waiting_high_seconds()
+    if high_seconds is None or sum(estimates) - high_seconds < PREEMPT_MIN_REMAINING_SECONDS:
+        return None
+
+    continuation_id = str(uuid.uuid4())
+    # Requests fused into this job move to the continuation with it
+    sibling_ids = redis_conn.lrange(f"fusion_members:{job.id}", 0, -1)
+    if sibling_ids:
+        redis_conn.rpush(f"fusion_members:{continuation_id}", *sibling_ids)
+        redis_conn.expire(f"fusion_members:{continuation_id}", FUSION_CLAIM_TTL)
+    enqueue_continuation(job, {**data, 'preemptions': data.get('preemptions', 0) + 1}, continuation_id)
+    record_metric("jobs_preempted")
+    log_safe_event(f"Record {data['record_id']}: yielded to {PREEMPT_QUEUE} work before {remaining[0][0]}, "
+                   f"continues as job {continuation_id}")
+    return "Preempted"
+
+# Prompt Templates
+# Static parts of each prompt are compiled once per schema and reused, so a job
+# only has to splice its document text between the cached head and tail.
+EXTRACTION_INSTRUCTION = (
+    "You are a strict data extraction engine. Extract specific terms exactly as they appear. "
+    "Output ONLY valid JSON."
+)
+SUMMARY_INSTRUCTION = (
+    "You are an expert legal analyst. Summarize the document sections as requested. "
+    "Use <br> tags for line breaks. Do not use newlines inside values. "
+    "Output ONLY valid JSON."
+)
+# Data extraction needs to be deterministic (0 temperature)
+EXTRACTION_OPTIONS = {
+    "temperature": 0.0,
+    "num_predict": 1024,
+    "top_k": 20,
+    "num_ctx": 32000
+}
+# Summaries need more "creativity" and length
+SUMMARY_OPTIONS = {
+    "temperature": 0.1,
+    "num_predict": 4096,
+    "top_k": 40,
+    "num_ctx": 32000,
+    "repeat_penalty": 1.1
+}
+PROMPT_CACHE_SIZE = 256
+PROMPT_VERSION = 1               # Bump when the template text changes (see pipeline_fingerprint)
+_prompt_cache: Dict[Tuple[str, bool], Dict[str, Any]] = {}
+
+def schema_hash(prompt_json: Dict[str, str]) -> str:
+    """Stable short hash of a prompt schema (key order matters, it is kept in the prompt)."""
+    canonical = json.dumps(prompt_json, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha1(canonical.encode('utf-8')).hexdigest()[:16]
+
+def build_output_schema(keys: List[str]) -> Dict[str, Any]:
+    """JSON Schema for Ollama structured output: every key required, string or null."""
+    return {
+        "type": "object",
+        "properties": {k: {"type": ["string", "null"]} for k in keys},
+        "required": list(keys)
+    }
+
+def get_prompt_template(prompt_json: Dict[str, str], is_summary: bool = False) -> Dict[str, Any]:
+    """Returns the compiled template for this schema, building it on first use."""
+    cache_key = (schema_hash(prompt_json), is_summary)
+    template = _prompt_cache.get(cache_key)
+    if template is not None:
+        return template
+
+    instruction = SUMMARY_INSTRUCTION if is_summary else EXTRACTION_INSTRUCTION
+    schema_text = json.dumps(prompt_json, indent=2)
+    head = f"""
+{instruction}
 
 --- BEGIN DOCUMENT TEXT ---
-{po_text}
+"""
+    tail = f"""
 --- END DOCUMENT TEXT ---
 
 **INSTRUCTIONS:**
@@ -84,72 +372,678 @@ def query_ollama(po_text: str, prompt_json: Dict[str, str], is_summary: bool = F
 3. Return ONLY the JSON object.
 
 **REQUIRED OUTPUT SCHEMA:**
-{json.dumps(prompt_json, indent=2)}
+{schema_text}
 """
-
-    payload = {
-        "model": "llama3.1",
-        "format": "json",
-        "prompt": full_prompt,
-        "stream": False,
-        "options": options
+    template = {
+        "hash": cache_key[0],
+        "head": head,
+        "tail": tail,
+        "schema_text": schema_text,
+        "format": build_output_schema(list(prompt_json.keys())) if OLLAMA_STRUCTURED_OUTPUT else "json",
+        "options": SUMMARY_OPTIONS if is_summary else EXTRACTION_OPTIONS
     }
+    if len(_prompt_cache) >= PROMPT_CACHE_SIZE:
+        # Oldest entry first (dicts keep insertion order)
+        _prompt_cache.pop(next(iter(_prompt_cache)))
+    _prompt_cache[cache_key] = template
+    return template
 
+@traced('ollama_generate')
+def ollama_generate(payload: Dict[str, Any]) -> str:
+    """
+    Streams a generate request and returns the raw model response text.
+    Between tokens the job's deadline and cancel flag are checked; on abort the
+    connection is closed, which stops the generation in Ollama.
+    """
+    output_mode = "schema" if OLLAMA_STRUCTURED_OUTPUT else "json"
+    check_abort()
+    slot = acquire_ollama_slot()
     try:
-        response = requests.post(OLLAMA_URL, json=payload, timeout=1800)
-        response.raise_for_status()
-        return json.loads(response.json().get('response', '{}'))
+        return _stream_generate(payload, output_mode)
+    finally:
+        if slot is not None:
+            ollama_slots.release(slot)
+
+def _stream_generate(payload: Dict[str, Any], output_mode: str) -> str:
+    left = seconds_left()
+    # The read timeout also bounds a long prompt evaluation before the first token
+    read_timeout = 1800 if left is None else max(1.0, min(1800, left))
+    pieces = []
+    body: Dict[str, Any] = {}
+    try:
+        with http_session.post(OLLAMA_URL, json={**payload, "stream": True}, stream=True,
+                           timeout=(10, read_timeout)) as response:
+            response.raise_for_status()
+            next_check = time.time() + ABORT_CHECK_INTERVAL
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                body = json.loads(line)
+                if body.get('error'):
+                    raise requests.RequestException(f"Ollama error: {body['error']}")
+                pieces.append(body.get('response', ''))
+                if body.get('done'):
+                    break
+                if time.time() >= next_check:
+                    check_abort()
+                    next_check = time.time() + ABORT_CHECK_INTERVAL
+    except requests.Timeout:
+        left = seconds_left()
+        if left is not None and left <= 1:
+            raise JobAborted('deadline')
+        log_safe_event("Error querying Ollama: timed out")
+        raise
     except requests.RequestException as e:
         log_safe_event(f"Error querying Ollama: {e}")
         raise
-    except json.JSONDecodeError as e:
-        log_safe_event(f"Error parsing AI response: {e}")
-        raise
+    record_metric(f"ollama_calls:{output_mode}")
+    record_metric(f"ollama_prompt_tokens:{output_mode}", body.get('prompt_eval_count', 0))
+    record_metric(f"ollama_output_tokens:{output_mode}", body.get('eval_count', 0))
+    annotate_span(model=payload.get('model'), prompt_chars=len(payload.get('prompt', '')),
+                  prompt_tokens=body.get('prompt_eval_count', 0), output_tokens=body.get('eval_count', 0))
+    usage = getattr(_usage, 'totals', None)
+    if usage is not None:
+        usage["calls"] += 1
+        usage["prompt_tokens"] += body.get('prompt_eval_count', 0)
+        usage["output_tokens"] += body.get('eval_count', 0)
+    return ''.join(pieces) or '{}'
 
-def update_quickbase(record_id: str, target_table_id: str, target_field_ids: Dict[str, int], ai_data: Dict[str, Any]):
-    """Update the record in Quickbase using the dynamic field map."""
-    headers = {
+@traced('parse_json')
+def parse_ai_response(raw: str, expected_keys: List[str]) -> Dict[str, Any]:
+    """Parses (and if needed repairs) a model response; raises if nothing is usable."""
+    output_mode = "schema" if OLLAMA_STRUCTURED_OUTPUT else "json"
+    parsed = parse_llm_json(raw, expected_keys)
+    if parsed.repaired:
+        record_metric(f"ollama_json_repaired:{output_mode}")
+        if parsed.lost_keys:
+            record_metric(f"ollama_json_lost_keys:{output_mode}", len(parsed.lost_keys))
+            log_safe_event(f"Malformed AI response, salvaged {len(parsed.data)} key(s), lost: {parsed.lost_keys}")
+    if parsed.repaired and not parsed.data:
+        record_metric(f"ollama_parse_failures:{output_mode}")
+        log_safe_event("Error parsing AI response: nothing could be salvaged")
+        raise ValueError("AI response was not valid JSON and no keys could be salvaged")
+    return parsed.data
+
+def query_ollama(po_text: str, prompt_json: Dict[str, str], is_summary: bool = False,
+                 model: Optional[str] = None, options: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Send text + schema to Ollama.
+    The 'is_summary' flag selects the summary instruction and generation settings;
+    'model' and 'options' override the defaults for this call only.
+    """
+    template = get_prompt_template(prompt_json, is_summary)
+    payload = {
+        "model": model or OLLAMA_MODEL,
+        "format": template["format"],
+        "prompt": template["head"] + po_text + template["tail"],
+        "options": {**template["options"], **(options or {})}
+    }
+    return parse_ai_response(ollama_generate(payload), list(prompt_json.keys()))
+
+def query_ollama_batch(docs: List[Tuple[str, str]], prompt_json: Dict[str, str],
+                       is_summary: bool = False) -> Dict[str, Any]:
+    """
+    Sends several short documents that share one schema in a single prompt.
+    docs is [(record_id, text), ...]; returns {record_id: {key: value}}.
+    """
+    template = get_prompt_template(prompt_json, is_summary)
+    record_ids = [rid for rid, _ in docs]
+    instruction = SUMMARY_INSTRUCTION if is_summary else EXTRACTION_INSTRUCTION
+    sections = ''.join(f"\n--- BEGIN DOCUMENT {rid} ---\n{text}\n--- END DOCUMENT {rid} ---\n" for rid, text in docs)
+    prompt = f"""
+{instruction}
+{sections}
+**INSTRUCTIONS:**
+1. Read each document above independently. Never mix information between documents.
+2. For each document, answer every key in the schema below using only that document.
+3. Return ONLY one JSON object whose keys are the document IDs ({', '.join(record_ids)}),
+   each mapping to an object with the schema below.
+
+**REQUIRED OUTPUT SCHEMA (per document):**
+{template["schema_text"]}
+"""
+    if OLLAMA_STRUCTURED_OUTPUT:
+        output_format: Any = {
+            "type": "object",
+            "properties": {rid: template["format"] for rid in record_ids},
+            "required": record_ids
+        }
+    else:
+        output_format = "json"
+    base = template["options"]
+    payload = {
+        "model": OLLAMA_MODEL,
+        "format": output_format,
+        "prompt": prompt,
+        "options": {**base, "num_predict": base["num_predict"] * len(docs)}
+    }
+    return parse_ai_response(ollama_generate(payload), record_ids)
+
+# Targeted Re-query
+# Keys that come back missing (lost from a malformed response) or malformed
+# (empty, or a date/amount that does not parse) are asked again in a small
+# follow-up prompt over the most relevant slice of the document, with a bounded
+# number of attempts. A null means "not in the document" and is only re-asked for
+# keys listed in REQUERY_NULL_KEYS. Per-key outcomes go to the 'requery_stats'
+# hash so chronically hard keys show up on /api/status.
+REQUERY_MAX_ATTEMPTS = int(os.getenv('REQUERY_MAX_ATTEMPTS', 2))
+REQUERY_SLICE_CHARS = int(os.getenv('REQUERY_SLICE_CHARS', 6000))
+REQUERY_TOKENS_PER_KEY = int(os.getenv('REQUERY_TOKENS_PER_KEY', 256))
+REQUERY_SUMMARY_TOKENS_PER_KEY = 1024
+REQUERY_CHUNK_CHARS = 1000
+REQUERY_NULL_KEYS = {k.strip() for k in os.getenv('REQUERY_NULL_KEYS', '').split(',') if k.strip()}
+_STOPWORDS = {'the', 'and', 'for', 'are', 'what', 'this', 'that', 'with', 'from', 'which', 'when',
+              'where', 'who', 'how', 'does', 'any', 'all', 'document', 'contract', 'provide', 'list'}
+
+def question_terms(questions: Dict[str, str]) -> set:
+    """Content words of the keys and questions, used to find the passages they are about."""
+    return {w for text in list(questions.keys()) + list(questions.values())
+            for w in re.findall(r'[a-z0-9]{3,}', text.lower().replace('_', ' ')) if w not in _STOPWORDS}
+
+def select_relevant_slice(po_text: str, questions: Dict[str, str], max_chars: int) -> str:
+    """Highest-scoring chunks (by overlap with the keys/questions), kept in document order."""
+    if len(po_text) <= max_chars:
+        return po_text
+
+    chunks, current = [], ""
+    for paragraph in po_text.split('\n\n'):
+        if current and len(current) + len(paragraph) > REQUERY_CHUNK_CHARS:
+            chunks.append(current)
+            current = ""
+        current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current:
+        chunks.append(current)
+
+    terms = question_terms(questions)
+    scored = sorted(range(len(chunks)),
+                    key=lambda i: -len(terms & set(re.findall(r'[a-z0-9]{3,}', chunks[i].lower()))))
+    selected, total = [], 0
+    for idx in scored:
+        if total + len(chunks[idx]) > max_chars and selected:
+            break
+        selected.append(idx)
+        total += len(chunks[idx])
+    return '\n\n[...]\n\n'.join(chunks[i][:max_chars] for i in sorted(selected))
+
+def _is_unanswered(value: Any) -> bool:
+    return value is None or (isinstance(value, str) and not value.strip())
+
+def _needs_requery(key: str, question: str, res: Dict[str, Any], is_summary: bool) -> bool:
+    """Missing or malformed answers are re-asked; nulls only for REQUERY_NULL_KEYS."""
+    if key not in res:
+        return True
+    value = res[key]
+    if value is None:
+        return key in REQUERY_NULL_KEYS
+    if isinstance(value, str) and not value.strip():
+        return True
+    return not is_summary and not has_expected_type(key, question, value)
+
+def requery_missing_keys(po_text: str, prompt_map: Dict[str, str], res: Dict[str, Any], is_summary: bool = False,
+                         model: Optional[str] = None, options: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Re-asks for missing or malformed keys with a narrow prompt; updates and returns res."""
+    missing = [k for k in prompt_map if _needs_requery(k, prompt_map[k], res, is_summary)]
+    if not missing or REQUERY_MAX_ATTEMPTS <= 0:
+        return res
+
+    initially_missing = list(missing)
+    tokens_per_key = REQUERY_SUMMARY_TOKENS_PER_KEY if is_summary else REQUERY_TOKENS_PER_KEY
+    for attempt in range(1, REQUERY_MAX_ATTEMPTS + 1):
+        subset = {k: prompt_map[k] for k in missing}
+        context = select_relevant_slice(po_text, subset, REQUERY_SLICE_CHARS * attempt)
+        logger.info(f"Re-query {attempt}/{REQUERY_MAX_ATTEMPTS} for keys {missing} over {len(context)} chars")
+        try:
+            retry = query_ollama(context, subset, is_summary=is_summary, model=model,
+                                 options={**(options or {}), "num_predict": tokens_per_key * len(missing)})
+        except JobAborted:
+            raise
+        except Exception as e:
+            log_safe_event(f"Re-query for {missing} failed: {e}")
+            break
+        for k in missing:
+            if k in retry and (k not in res or not _needs_requery(k, prompt_map[k], retry, is_summary)):
+                res[k] = retry[k]
+        missing = [k for k in missing if _needs_requery(k, prompt_map[k], res, is_summary)]
+        if not missing:
+            break
+
+    try:
+        pipe = redis_conn.pipeline()
+        for k in initially_missing:
+            pipe.hincrby("requery_stats", f"{k}:attempted", 1)
+            if k not in missing:
+                pipe.hincrby("requery_stats", f"{k}:recovered", 1)
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"Could not record re-query stats: {e}")
+    log_safe_event(f"Re-query recovered {len(initially_missing) - len(missing)}/{len(initially_missing)} keys"
+                   + (f", still empty: {missing}" if missing else ""))
+    return res
+
+def run_llm_pass(po_text: str, prompt_map: Dict[str, str], is_summary: bool = False,
+                 model: Optional[str] = None, options: Optional[Dict[str, Any]] = None,
+                 requery: bool = True) -> Dict[str, Any]:
+    """Runs one pass, then re-queries any keys that came back missing or malformed."""
+    res = query_ollama(po_text, prompt_map, is_summary=is_summary, model=model, options=options)
+    if requery:
+        res = requery_missing_keys(po_text, prompt_map, res, is_summary=is_summary, model=model, options=options)
+    return res
+
+# Model Cascade
+# Extraction keys go to the fast model(s) in CASCADE_MODELS first. Answers are
+# checked locally (present, date/amount parses, value found in the text) and only
+# the keys that fail are escalated to the next tier, ending with OLLAMA_MODEL.
+CASCADE_MODELS = [m.strip() for m in os.getenv('CASCADE_MODELS', '').split(',') if m.strip()]
+CASCADE_MAX_CHARS = int(os.getenv('CASCADE_MAX_CHARS', 20000))
+CASCADE_NUM_CTX = int(os.getenv('CASCADE_NUM_CTX', 8192))
+
+def run_extraction_pass(po_text: str, prompt_map: Dict[str, str]) -> Dict[str, Any]:
+    """Extraction pass, through the model cascade when one is configured and the document is short."""
+    if not CASCADE_MODELS or len(po_text) > CASCADE_MAX_CHARS:
+        return run_llm_pass(po_text, prompt_map, is_summary=False)
+
+    normalized_source = normalize_for_match(po_text)
+    results: Dict[str, Any] = {}
+    pending = dict(prompt_map)
+    for model in CASCADE_MODELS:
+        tier_start = time.time()
+        try:
+            res = run_llm_pass(po_text, pending, is_summary=False, model=model,
+                               options={"num_ctx": CASCADE_NUM_CTX}, requery=False)
+        except JobAborted:
+            raise
+        except Exception as e:
+            record_metric(f"cascade_tier_errors:{model}")
+            log_safe_event(f"Cascade tier {model} failed: {e}")
+            continue
+        finally:
+            record_metric(f"cascade_tier_calls:{model}")
+            record_metric(f"cascade_tier_seconds:{model}", time.time() - tier_start)
+
+        accepted = {k: res[k] for k in pending
+                    if k in res and validate_extracted_value(k, pending[k], res[k], normalized_source)}
+        results.update(accepted)
+        pending = {k: q for k, q in pending.items() if k not in accepted}
+        if not pending:
+            break
+
+    record_metric("cascade_keys", len(prompt_map))
+    record_metric("cascade_keys_escalated", len(pending))
+    log_safe_event(
+        f"Cascade: {len(prompt_map) - len(pending)}/{len(prompt_map)} keys accepted from fast tier, "
+        f"{len(pending)} escalated to {OLLAMA_MODEL}"
+    )
+    if pending:
+        tier_start = time.time()
+        try:
+            results.update(run_llm_pass(po_text, pending, is_summary=False))
+        finally:
+            record_metric(f"cascade_tier_calls:{OLLAMA_MODEL}")
+            record_metric(f"cascade_tier_seconds:{OLLAMA_MODEL}", time.time() - tier_start)
+    return results
+
+# Stage Checkpoints
+# Completed LLM passes are stored in Redis so a retry (e.g. after a QuickBase 5xx)
+# resumes from the first incomplete stage instead of re-running inference.
+CHECKPOINT_TTL = int(os.getenv('CHECKPOINT_TTL', 86400))
+
+def checkpoint_key(data: Dict[str, Any], po_text: str, prompt_map: Dict[str, str]) -> str:
+    """Content key: same record, target, text and schema share one checkpoint."""
+    digest = hashlib.sha256()
+    for part in (str(data['record_id']), str(data.get('target_table_id', '')), po_text,
+                 json.dumps(prompt_map, sort_keys=True)):
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return f"checkpoint:{digest.hexdigest()}"
+
+@traced('checkpoint_io')
+def load_checkpoint(key: str) -> Dict[str, Dict[str, Any]]:
+    try:
+        raw = redis_conn.hgetall(key)
+        return {stage.decode('utf-8'): json.loads(value) for stage, value in raw.items()}
+    except Exception as e:
+        logger.warning(f"Could not load checkpoint {key}: {e}")
+        return {}
+
+@traced('checkpoint_io')
+def save_checkpoint(key: str, stage: str, results: Dict[str, Any], duration: float):
+    try:
+        redis_conn.hset(key, stage, json.dumps({"results": results, "duration": duration}))
+        redis_conn.expire(key, CHECKPOINT_TTL)
+    except Exception as e:
+        logger.warning(f"Could not save checkpoint {key}/{stage}: {e}")
+
+def clear_checkpoint(key: str):
+    try:
+        redis_conn.delete(key)
+    except Exception as e:
+        logger.warning(f"Could not clear checkpoint {key}: {e}")
+
+def run_checkpointed_stage(key: str, checkpoint: Dict[str, Dict[str, Any]], stage: str,
+                           run: Callable[[], Dict[str, Any]], chars: int = 0) -> Dict[str, Any]:
+    """
+    Returns the checkpointed results for a stage, or runs it and checkpoints the output.
+    Run times are recorded per stage (see estimate_stage_seconds).
+    """
+    saved = checkpoint.get(stage)
+    if saved is not None:
+        record_metric("checkpoint_resumed_stages")
+        record_metric("checkpoint_gpu_seconds_saved", saved.get('duration', 0))
+        log_safe_event(f"Resuming from checkpoint: skipped {stage} pass ({saved.get('duration', 0):.0f}s saved)")
+        return saved['results']
+
+    stage_start = time.time()
+    results = run()
+    duration = time.time() - stage_start
+    save_checkpoint(key, stage, results, duration)
+    if chars:
+        record_metric(f"stage_runs:{stage}")
+        record_metric(f"stage_seconds:{stage}", duration)
+        record_metric(f"stage_chars:{stage}", chars)
+    return results
+
+# Incremental Re-extraction
+# After a successful write, the section fingerprints of the text and, per key, the
+# question, answer and the sections the answer was found in are kept per record.
+# When a revision of the document arrives, only keys whose source passage changed
+# (or whose terms appear in a new/edited section) are re-asked, over the changed
+# sections only; every other answer is reused. Summaries are reused only when no
+# section changed. Above REVISION_MAX_CHANGED_RATIO the job runs a full pass, as
+# it does after a model or prompt change (pipeline_fingerprint) or when the
+# payload sets "force_reextract".
+REVISION_DIFF = os.getenv('REVISION_DIFF', 'true').lower() == 'true'
+REVISION_TTL = int(os.getenv('REVISION_TTL', 30 * 86400))
+REVISION_MAX_CHANGED_RATIO = float(os.getenv('REVISION_MAX_CHANGED_RATIO', 0.5))
+
+def revision_key(data: Dict[str, Any]) -> str:
+    return f"revision:{data.get('target_table_id', '')}:{data['record_id']}"
+
+def pipeline_fingerprint() -> str:
+    """Hash of the models, instructions and settings that shaped the stored answers."""
+    settings = [PROMPT_VERSION, OLLAMA_MODEL, CASCADE_MODELS, OLLAMA_STRUCTURED_OUTPUT, EXTRACTION_INSTRUCTION,
+                SUMMARY_INSTRUCTION, EXTRACTION_OPTIONS, SUMMARY_OPTIONS]
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+def load_revision(data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    if not REVISION_DIFF or data.get('force_reextract'):
+        return None
+    try:
+        raw = redis_conn.get(revision_key(data))
+        revision = json.loads(raw) if raw else None
+    except Exception as e:
+        logger.warning(f"Could not load revision state for {data['record_id']}: {e}")
+        return None
+    if revision and revision.get('pipeline') != pipeline_fingerprint():
+        log_safe_event(f"Revision of {data['record_id']}: model or prompt changed since the last run, "
+                       f"running full passes")
+        return None
+    return revision
+
+def save_revision(data: Dict[str, Any], po_text: str, prompt_map: Dict[str, str], results: Dict[str, Any]):
+    """Stores section fingerprints and per-key answers with their source sections."""
+    if not REVISION_DIFF:
+        return
+    indexed = index_sections(po_text)
+    keys = {}
+    for key, question in prompt_map.items():
+        value = results.get(key)
+        if key not in results or (isinstance(value, str) and value.startswith('Error: ')):
+            continue
+        keys[key] = {"question": question, "value": value, "sources": source_fingerprints(value, indexed)}
+    state = {"sections": [fp for fp, _ in indexed], "keys": keys, "pipeline": pipeline_fingerprint()}
+    try:
+        redis_conn.set(revision_key(data), json.dumps(state), ex=REVISION_TTL)
+    except Exception as e:
+        logger.warning(f"Could not save revision state for {data['record_id']}: {e}")
+
+def revision_diff(record_id: Any, revision: Optional[Dict[str, Any]], po_text: str) -> Optional[SectionDiff]:
+    """Section diff against the previous version, or None when a full run is needed."""
+    if not revision:
+        return None
+    diff = diff_sections(revision.get('sections', []), po_text)
+    if diff.changed_ratio > REVISION_MAX_CHANGED_RATIO:
+        log_safe_event(f"Revision of {record_id}: {len(diff.changed)}/{len(diff.fingerprints)} sections changed "
+                       f"({diff.changed_ratio:.0%} of text), running full passes")
+        return None
+    return diff
+
+def reusable_results(revision: Dict[str, Any], prompt_map: Dict[str, str]) -> Optional[Dict[str, Any]]:
+    """Previous answers for prompt_map, if every key was answered before with the same question."""
+    prior = revision.get('keys', {})
+    if not all(k in prior and prior[k]['question'] == q for k, q in prompt_map.items()):
+        return None
+    return {k: prior[k]['value'] for k in prompt_map}
+
+def run_revision_extraction(record_id: Any, po_text: str, prompt_map: Dict[str, str],
+                            revision: Dict[str, Any], diff: SectionDiff) -> Dict[str, Any]:
+    """Extraction pass for a revised document: reuse, re-ask over changed sections, or full pass per key."""
+    prior = revision.get('keys', {})
+    present = set(diff.fingerprints)
+    changed_text = diff.changed_text
+    changed_words = set(re.findall(r'[a-z0-9]{3,}', changed_text.lower()))
+    results: Dict[str, Any] = {}
+    incremental: Dict[str, str] = {}
+    full: Dict[str, str] = {}
+    moved: set = set()
+
+    for key, question in prompt_map.items():
+        previous = prior.get(key)
+        if previous is None or previous['question'] != question:
+            full[key] = question
+            continue
+        source_changed = any(fp not in present for fp in previous['sources'])
+        if source_changed:
+            moved.add(key)
+        # An edit mentioning the key's terms only matters if it had no answer found in the text
+        mentioned = not previous['sources'] and question_terms({key: question}) & changed_words
+        if (source_changed or mentioned) and changed_text:
+            incremental[key] = question
+        elif source_changed:
+            full[key] = question
+        else:
+            results[key] = previous['value']
+
+    chars_sent = 0
+    if incremental:
+        res = run_llm_pass(changed_text, incremental, is_summary=False, requery=False)
+        chars_sent += len(changed_text)
+        changed_index = index_sections(changed_text)
+        for key in incremental:
+            # Only an answer found verbatim in a changed section replaces the previous value
+            if not _is_unanswered(res.get(key)) and source_fingerprints(res[key], changed_index):
+                results[key] = res[key]
+            elif key in moved:
+                # Its passage changed and the edit does not answer it: look at the whole document
+                full[key] = prompt_map[key]
+            else:
+                results[key] = prior[key]['value']
+    if full:
+        results.update(run_extraction_pass(po_text, full))
+        chars_sent += len(po_text)
+
+    tokens_saved = max(0, len(po_text) - chars_sent) // CHARS_PER_TOKEN
+    reused = len(prompt_map) - len(set(incremental) | set(full))
+    record_metric("revision_jobs")
+    record_metric("revision_keys_reused", reused)
+    record_metric("revision_tokens_saved_est", tokens_saved)
+    log_safe_event(
+        f"Revision of {record_id}: {len(diff.changed)}/{len(diff.fingerprints)} sections changed "
+        f"({diff.changed_ratio:.0%} of text), {reused} keys reused, {len(incremental)} re-asked on changed "
+        f"sections, {len(full)} full-text; ~{tokens_saved} tokens saved"
+    )
+    return results
+
+# QuickBase Access
+# Every QuickBase call goes through one Redis token bucket shared by all workers
+# and hosts (QuickBase limits requests per user token). A 429 pauses the whole
+# bucket for Retry-After seconds. If a finished job would have to wait longer than
+# QB_MAX_INLINE_WAIT, its write is handed to the QB_WRITE_QUEUE queue so the GPU
+# worker can move on to the next document.
+QB_RATE_PER_SECOND = float(os.getenv('QB_RATE_PER_SECOND', 8))
+QB_BURST = int(os.getenv('QB_BURST', 10))
+QB_MAX_RETRIES = int(os.getenv('QB_MAX_RETRIES', 5))
+QB_MAX_INLINE_WAIT = float(os.getenv('QB_MAX_INLINE_WAIT', 30))
+QB_WRITE_QUEUE = os.getenv('QB_WRITE_QUEUE', 'quickbase_writes')
+
+quickbase_bucket = TokenBucket(redis_conn, 'quickbase', QB_RATE_PER_SECOND, QB_BURST)
+
+def quickbase_headers() -> Dict[str, str]:
+    return {
         'QB-Realm-Hostname': QUICKBASE_REALM,
         'User-Agent': 'Python-Worker',
         'Authorization': f'QB-USER-TOKEN {QUICKBASE_USER_TOKEN}',
         'Content-Type': 'application/json'
     }
 
+def _retry_after_seconds(response: requests.Response, attempt: int) -> float:
+    """Retry-After as seconds (numeric or HTTP date), else exponential backoff."""
+    header = response.headers.get('Retry-After')
+    if header:
+        try:
+            return max(0.0, float(header))
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(header).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+    return float(min(60, 2 ** attempt))
+
+@traced('quickbase')
+def quickbase_request(method: str, url: str, max_wait: Optional[float] = None, **kwargs) -> requests.Response:
+    """Rate-limited QuickBase call; retries 429s after Retry-After (plus jitter)."""
+    annotate_span(method=method, url=url)
+    for attempt in range(QB_MAX_RETRIES + 1):
+        waited = quickbase_bucket.acquire(max_wait)
+        if waited:
+            record_metric("qb_throttle_wait_seconds", waited)
+        response = http_session.request(method, url, headers=quickbase_headers(), timeout=60, **kwargs)
+        if response.status_code == 429 and attempt < QB_MAX_RETRIES:
+            delay = _retry_after_seconds(response, attempt)
+            record_metric("qb_429_responses")
+            log_safe_event(f"QuickBase rate limit (429): pausing all workers for {delay:.1f}s")
+            quickbase_bucket.throttle(delay)
+            continue
+        response.raise_for_status()
+        return response
+
+def post_quickbase_records(body: Dict[str, Any], record_id: str) -> Dict[str, Any]:
+    """Posts records inline, or defers the write to QB_WRITE_QUEUE if throttled for too long."""
+    try:
+        return quickbase_request('POST', QUICKBASE_URL, max_wait=QB_MAX_INLINE_WAIT, json=body).json()
+    except RateLimitWaitExceeded as e:
+        Queue(QB_WRITE_QUEUE, connection=redis_conn).enqueue(
+            'worker.deferred_quickbase_write',
+            args=(body, record_id),
+            description=f"deferred_quickbase_write record {record_id}",
+            job_timeout='30m',
+            retry=Retry(max=5, interval=[30, 60, 120, 300, 600])
+        )
+        record_metric("qb_deferred_writes")
+        log_safe_event(f"QuickBase throttled (next slot in {e.wait:.0f}s): write for {record_id} queued on '{QB_WRITE_QUEUE}'")
+        return {"deferred": True}
+
+def deferred_quickbase_write(body: Dict[str, Any], record_id: str):
+    """Runs on QB_WRITE_QUEUE: waits on the shared limiter as long as needed."""
+    quickbase_request('POST', QUICKBASE_URL, json=body)
+    log_safe_event(f"Deferred QuickBase write complete for {record_id}")
+    return "Success"
+
+# QuickBase Field Metadata
+# Each target table's field schema is fetched once and cached in Redis, so values
+# can be coerced (dates, numbers, max length, choices) before the write.
+QUICKBASE_FIELDS_URL = os.getenv('QUICKBASE_FIELDS_URL', 'https://api.quickbase.com/v1/fields')
+QB_FIELD_CACHE_TTL = int(os.getenv('QB_FIELD_CACHE_TTL', 3600))
+QB_FIELD_LOCAL_TTL = 60         # In-process copy, reused across jobs by warm workers
+_field_cache: Dict[str, Tuple[float, Dict[str, Dict[str, Any]]]] = {}
+
+def get_table_fields(target_table_id: str) -> Optional[Dict[str, Dict[str, Any]]]:
+    """Returns {field_id: {type, mode, max_length, choices, allow_new_choices}}, or None if unavailable."""
+    local = _field_cache.get(target_table_id)
+    if local and time.time() - local[0] < QB_FIELD_LOCAL_TTL:
+        return local[1]
+
+    cache_key = f"qb_fields:{target_table_id}"
+    try:
+        cached = redis_conn.get(cache_key)
+        if cached:
+            fields = json.loads(cached)
+            _field_cache[target_table_id] = (time.time(), fields)
+            return fields
+    except Exception as e:
+        logger.warning(f"Could not read field cache for {target_table_id}: {e}")
+
+    try:
+        response = quickbase_request('GET', QUICKBASE_FIELDS_URL, max_wait=QB_MAX_INLINE_WAIT,
+                                     params={'tableId': target_table_id})
+        fields = {}
+        for field in response.json():
+            props = field.get('properties') or {}
+            fields[str(field['id'])] = {
+                "type": field.get('fieldType', 'text'),
+                "mode": field.get('mode') or '',
+                "max_length": props.get('maxLength') or 0,
+                "choices": props.get('choices') or [],
+                "allow_new_choices": props.get('allowNewChoices', True)
+            }
+    except Exception as e:
+        logger.warning(f"Could not fetch field metadata for {target_table_id}, writing values unchecked: {e}")
+        return None
+
+    try:
+        redis_conn.set(cache_key, json.dumps(fields), ex=QB_FIELD_CACHE_TTL)
+    except Exception as e:
+        logger.warning(f"Could not cache field metadata for {target_table_id}: {e}")
+    _field_cache[target_table_id] = (time.time(), fields)
+    return fields
+
+def build_quickbase_record(record_id: str, target_table_id: str, target_field_ids: Dict[str, int],
+                           ai_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Record fields for one upsert (values coerced to their field types), or None if nothing to write."""
     fields_to_update = {}
     fields_to_update["3"] = {"value": record_id}
+    table_fields = get_table_fields(target_table_id)
 
     for json_key, fid in target_field_ids.items():
-        if json_key in ai_data:
-            fields_to_update[str(fid)] = {"value": ai_data[json_key]}
-        else:
+        if json_key not in ai_data:
             logger.warning(f"Key '{json_key}' missing from AI response.")
+            continue
+        value = ai_data[json_key]
+        field = table_fields.get(str(fid)) if table_fields else None
+        if field is not None:
+            accepted, coerced = coerce_field_value(value, field)
+            if not accepted:
+                record_metric("qb_values_rejected")
+                log_safe_event(f"Dropped '{json_key}' for field {fid} ({field['type']}): {str(value)[:60]!r} does not fit")
+                continue
+            if coerced != value:
+                record_metric("qb_values_coerced")
+            value = coerced
+        fields_to_update[str(fid)] = {"value": value}
 
     if len(fields_to_update) <= 1:
         logger.warning("No new data fields to update.")
+        return None
+    return fields_to_update
+
+def update_quickbase(record_id: str, target_table_id: str, target_field_ids: Dict[str, int], ai_data: Dict[str, Any]):
+    """Update the record in Quickbase using the dynamic field map."""
+    record = build_quickbase_record(record_id, target_table_id, target_field_ids, ai_data)
+    if record is None:
         return {}
 
     body = {
         "to": target_table_id,
-        "data": [fields_to_update]
+        "data": [record]
     }
 
     try:
-        response = requests.post(QUICKBASE_URL, headers=headers, json=body)
-        response.raise_for_status()
-        return response.json()
+        return post_quickbase_records(body, record_id)
     except requests.RequestException as e:
         log_safe_event(f"Error updating Quickbase: {e}")
         logger.error(f"Failed Payload Metadata: {{'to': target_table_id, 'record_id': record_id, 'error': str(e)}}")
         raise
 
 def update_quickbase_error(record_id: str, target_table_id: str, error_field_id: int, error_message: str):
-    headers = {
-        'QB-Realm-Hostname': QUICKBASE_REALM,
-        'User-Agent': 'Python-Worker',
-        'Authorization': f'QB-USER-TOKEN {QUICKBASE_USER_TOKEN}',
-        'Content-Type': 'application/json'
-    }
-
     body = {
         "to": target_table_id,
         "data": [
@@ -161,96 +1055,595 @@ def update_quickbase_error(record_id: str, target_table_id: str, error_field_id:
     }
 
     try:
-        requests.post(QUICKBASE_URL, headers=headers, json=body)
+        post_quickbase_records(body, record_id)
     except Exception as e:
         logger.error(f"Failed to report error to QuickBase: {e}")
 
-def process_po_job(data: Dict[str, Any]):
+# QuickBase Document Source
+# Instead of embedding po_text, a request may point at the document in QuickBase:
+#   "source": {"table_id": "bq...", "field_id": 7}                 text field
+#   "source": {"table_id": "bq...", "field_id": 8, "file": true}   file attachment
+# The worker pulls the text itself through the on-disk cache in doc_source.py,
+# keyed by the record's Date Modified (field 2) or the attachment version. The
+# automation can pass "modified" (Date Modified) to skip the freshness query.
+QUICKBASE_QUERY_URL = os.getenv('QUICKBASE_QUERY_URL', 'https://api.quickbase.com/v1/records/query')
+QUICKBASE_FILES_URL = os.getenv('QUICKBASE_FILES_URL', 'https://api.quickbase.com/v1/files')
+DATE_MODIFIED_FID = 2
+
+def query_record_fields(table_id: str, record_id: str, field_ids: List[int]) -> Dict[int, Any]:
+    """Values of the given fields for one record."""
+    body = {"from": table_id, "select": field_ids, "where": f"{{3.EX.'{record_id}'}}"}
+    rows = quickbase_request('POST', QUICKBASE_QUERY_URL, json=body).json().get('data') or []
+    if not rows:
+        raise ValueError(f"Record {record_id} not found in table {table_id}")
+    return {fid: (rows[0].get(str(fid)) or {}).get('value') for fid in field_ids}
+
+def download_attachment(table_id: str, record_id: str, field_id: int, version: Dict[str, Any]) -> Tuple[str, int]:
+    """Streams one attachment version (base64 body) to a temp file; returns (text, bytes)."""
+    url = f"{QUICKBASE_FILES_URL}/{table_id}/{record_id}/{field_id}/{version['versionNumber']}"
+    response = quickbase_request('GET', url, stream=True)
+    try:
+        with tempfile.TemporaryFile() as raw:
+            size = decode_base64_stream(response.iter_content(chunk_size=65536), raw)
+            raw.seek(0)
+            return extract_text(raw, version.get('fileName') or ''), size
+    finally:
+        response.close()
+
+def fetch_source_text(record_id: str, source: Dict[str, Any]) -> str:
+    """Document text for a source reference, downloaded only if not cached for this revision."""
+    table_id, field_id = source['table_id'], int(source['field_id'])
+    if source.get('file'):
+        # The field value only lists the versions; the content comes from the files endpoint
+        value = query_record_fields(table_id, record_id, [field_id])[field_id] or {}
+        versions = value.get('versions') or []
+        if not versions:
+            raise ValueError(f"No file attached in field {field_id} of record {record_id}")
+        version = max(versions, key=lambda v: v.get('versionNumber', 0))
+        path = cache_path(table_id, record_id, field_id, f"v{version['versionNumber']}")
+        text = read_cached(path)
+        if text is not None:
+            record_metric("source_cache_hits")
+            return text
+        text, size = download_attachment(table_id, record_id, field_id, version)
+    else:
+        modified = source.get('modified') or query_record_fields(table_id, record_id, [DATE_MODIFIED_FID])[DATE_MODIFIED_FID]
+        text = read_cached(cache_path(table_id, record_id, field_id, modified_stamp(modified)))
+        if text is not None:
+            record_metric("source_cache_hits")
+            return text
+        values = query_record_fields(table_id, record_id, [DATE_MODIFIED_FID, field_id])
+        text = str(values[field_id] or "")
+        size = len(text.encode('utf-8'))
+        # Cached under the stamp read together with the text, in case the record changed in between
+        path = cache_path(table_id, record_id, field_id, modified_stamp(values[DATE_MODIFIED_FID]))
+
+    record_metric("source_cache_misses")
+    record_metric("source_bytes_downloaded", size)
+    try:
+        write_cached(path, text)
+    except OSError as e:
+        logger.warning(f"Could not cache source document for {record_id}: {e}")
+    return text
+
+def load_po_text(data: Dict[str, Any]) -> str:
+    """Returns the document text, fetching it from the payload store or QuickBase when passed by reference."""
+    if 'po_text' in data:
+        # Jobs enqueued before out-of-band storage carry the text inline
+        return data['po_text'] or ""
+    if 'source' in data:
+        return fetch_source_text(data['record_id'], data['source'])
+    return fetch_text(redis_conn, data['po_text_ref'])
+
+# Request Fusion
+# Several requests for the same document (e.g. terms extraction + insurance review)
+# are merged into one extraction pass and one summary pass over the union of keys.
+# Every job claims itself when it starts; the first one to run also claims its
+# still-queued siblings, and claimed siblings exit immediately when they run.
+FUSION_WINDOW = int(os.getenv('FUSION_WINDOW_SECONDS', 120))
+FUSION_CLAIM_TTL = 86400
+
+def claim_job(job_id: str, owner_id: str) -> Optional[str]:
+    """Claims job_id for owner_id; returns the owner that holds the claim."""
+    key = f"fusion_claim:{job_id}"
+    if redis_conn.set(key, owner_id, nx=True, ex=FUSION_CLAIM_TTL):
+        return owner_id
+    owner = redis_conn.get(key)
+    return owner.decode('utf-8') if owner else owner_id
+
+def collect_fusion_group(data: Dict[str, Any]) -> List[Tuple[str, Dict[str, Any]]]:
+    """
+    Returns [(job_id, data), ...] for this job plus every sibling it absorbed.
+    The job must already own its claim (see _run_po_job).
+    """
+    job = get_current_job()
+    if job is None or FUSION_WINDOW <= 0 or ('po_text_ref' not in data and 'source' not in data):
+        return [(job.id if job else '', data)]
+
+    members_key = f"fusion_members:{job.id}"
+    sibling_ids = [s.decode('utf-8') for s in redis_conn.lrange(members_key, 0, -1)]
+    if not sibling_ids:
+        # First run (not a retry): claim siblings queued for the same document
+        group_key = f"fusion:{document_key(data)}"
+        for raw_id in redis_conn.lrange(group_key, 0, -1):
+            sibling_id = raw_id.decode('utf-8')
+            if sibling_id == job.id:
+                continue
+            try:
+                sibling = Job.fetch(sibling_id, connection=redis_conn)
+            except NoSuchJobError:
+                redis_conn.lrem(group_key, 0, sibling_id)
+                continue
+            if sibling.get_status() != 'queued' or not sibling.enqueued_at or not job.enqueued_at:
+                continue
+            if cancel_reason(sibling_id):
+                continue
+            if abs((sibling.enqueued_at - job.enqueued_at).total_seconds()) > FUSION_WINDOW:
+                continue
+            if claim_job(sibling_id, job.id) == job.id:
+                sibling_ids.append(sibling_id)
+                redis_conn.lrem(group_key, 0, sibling_id)
+        redis_conn.lrem(group_key, 0, job.id)
+        if sibling_ids:
+            redis_conn.rpush(members_key, *sibling_ids)
+            redis_conn.expire(members_key, FUSION_CLAIM_TTL)
+
+    members = [(job.id, data)]
+    for sibling_id in sibling_ids:
+        try:
+            members.append((sibling_id, Job.fetch(sibling_id, connection=redis_conn).args[0]))
+        except NoSuchJobError:
+            log_safe_event(f"Fused job {sibling_id} no longer exists, skipping it")
+    return members
+
+def fuse_prompts(members: List[Tuple[str, Dict[str, Any]]]) -> Tuple[Dict[str, str], List[Dict[str, str]]]:
+    """
+    Builds the union prompt map. Identical key/question pairs are shared; a key
+    reused with a different question gets a numbered alias.
+    Returns the union map and, per member, {own_key: fused_key}.
+    """
+    union: Dict[str, str] = {}
+    key_maps = []
+    for _, member in members:
+        mapping = {}
+        for key, question in member.get('prompt_json', {}).items():
+            fused_key, n = key, 2
+            while fused_key in union and union[fused_key] != question:
+                fused_key, n = f"{key}_{n}", n + 1
+            union[fused_key] = question
+            mapping[key] = fused_key
+        key_maps.append(mapping)
+    return union, key_maps
+
+def report_job_error(data: Dict[str, Any], error: Exception):
+    if 'error_field_id' in data and 'target_table_id' in data:
+        logger.info(f"Reporting error to QuickBase field {data['error_field_id']}...")
+        update_quickbase_error(
+            data['record_id'],
+            data['target_table_id'],
+            data['error_field_id'],
+            str(error)
+        )
+
+def prepare_text(raw_text: str) -> str:
+    """Runs document preprocessing (when enabled) and logs what was removed."""
+    if not PREPROCESS_TEXT:
+        return raw_text
+    prep = preprocess_text(raw_text)
+    record_metric("preprocess_chars_removed", prep.stats['chars_removed'])
+    record_metric("preprocess_tokens_removed_est", prep.stats['tokens_removed_est'])
+    log_safe_event(
+        f"Preprocessed text: {prep.stats['chars_before']} -> {prep.stats['chars_after']} chars "
+        f"(~{prep.stats['tokens_removed_est']} tokens removed, "
+        f"{prep.stats['header_footer_lines']} header/footer lines, "
+        f"{prep.stats['duplicate_paragraphs']} duplicate paragraphs)"
+    )
+    return prep.text
+
+def split_prompt_keys(prompt_map: Dict[str, str]) -> Tuple[List[str], List[str]]:
+    """Identify summary keys based on name "summary" or "description"; the rest are extraction keys."""
+    summary_keys = [k for k in prompt_map.keys() if 'summary' in k.lower() or 'description' in k.lower()]
+    extraction_keys = [k for k in prompt_map.keys() if k not in summary_keys]
+    return summary_keys, extraction_keys
+
+def write_results(outputs: List[Tuple[Dict[str, Any], Dict[str, Any]]]):
+    """Writes each (job data, results) pair to QuickBase; reports and re-raises the first failure."""
+    failures = []
+    for member, results in outputs:
+        try:
+            logger.info(f"Updating QuickBase table {member['target_table_id']}...")
+            update_quickbase(
+                member['record_id'],
+                member['target_table_id'],
+                member['target_field_ids'],
+                results
+            )
+            log_safe_event(f"Job complete for {member['record_id']}")
+        except Exception as e:
+            log_safe_event(f"Job failed for {member['record_id']}: {e}")
+            report_job_error(member, e)
+            failures.append(e)
+
+    if failures:
+        raise failures[0]
+
+# Experiments
+# A sample of live jobs (EXPERIMENT_FRACTION) is re-run in the background on
+# EXPERIMENT_QUEUE with every variant in EXPERIMENT_VARIANTS (see experiments.py).
+# Production results are never changed; the shadow job compares its answers,
+# latency and token counts with the production passes measured here.
+EXPERIMENT_FRACTION = float(os.getenv('EXPERIMENT_FRACTION', 0))
+EXPERIMENT_QUEUE = os.getenv('EXPERIMENT_QUEUE', 'experiments')
+
+def schedule_experiment(data: Dict[str, Any], prompt_map: Dict[str, str], results: Dict[str, Any],
+                        baseline: Dict[str, Dict[str, Any]]):
+    """Enqueues a shadow experiment for a sampled job whose passes ran in full."""
+    if (EXPERIMENT_FRACTION <= 0 or not baseline or ('po_text_ref' not in data and 'source' not in data)
+            or random.random() >= EXPERIMENT_FRACTION):
+        return
+    try:
+        Queue(EXPERIMENT_QUEUE, connection=redis_conn).enqueue(
+            'experiments.run_shadow_experiment',
+            args=({
+                "record_id": data['record_id'],
+                **{k: data[k] for k in ('po_text_ref', 'source') if k in data},
+                "prompt_json": prompt_map,
+                "results": results,
+                "baseline": baseline
+            },),
+            description=f"experiment record {data['record_id']}",
+            job_timeout='60m'
+        )
+    except Exception as e:
+        logger.warning(f"Could not schedule experiment for {data['record_id']}: {e}")
+
+# Micro-batching
+# Short documents that share one schema are sent to the model together; the
+# response is a JSON object keyed by record ID that is fanned back out per job.
+MICROBATCH_ENABLED = os.getenv('MICROBATCH_ENABLED', 'false').lower() == 'true'
+MICROBATCH_QUEUES = [q.strip() for q in os.getenv('MICROBATCH_QUEUES', 'high,default').split(',') if q.strip()]
+MICROBATCH_MAX_DOC_CHARS = int(os.getenv('MICROBATCH_MAX_DOC_CHARS', 3000))
+MICROBATCH_MAX_CHARS = int(os.getenv('MICROBATCH_MAX_CHARS', 16000))
+MICROBATCH_MAX_DOCS = int(os.getenv('MICROBATCH_MAX_DOCS', 8))
+MICROBATCH_SCAN_DEPTH = 50
+
+def collect_microbatch(data: Dict[str, Any]) -> List[Tuple[str, Dict[str, Any]]]:
+    """Claims queued short jobs with the same schema from this job's queue (same claim as fusion)."""
+    job = get_current_job()
+    if (not MICROBATCH_ENABLED or job is None or base_queue_name(job.origin) not in MICROBATCH_QUEUES
+            or 'po_text_ref' not in data or data.get('po_text_len', 0) > MICROBATCH_MAX_DOC_CHARS
+            or 'resumes_job' in data):
+        # A preempted job's continuation resumes from its own checkpoint instead
+        return [(job.id if job else '', data)]
+
+    members_key = f"microbatch_members:{job.id}"
+    batch_ids = [s.decode('utf-8') for s in redis_conn.lrange(members_key, 0, -1)]
+    if not batch_ids:
+        target_hash = schema_hash(data.get('prompt_json', {}))
+        record_ids = {str(data['record_id'])}
+        total_chars = data['po_text_len']
+        queue = Queue(job.origin, connection=redis_conn)
+        for candidate in Job.fetch_many(queue.get_job_ids(0, MICROBATCH_SCAN_DEPTH), connection=redis_conn):
+            if len(batch_ids) + 1 >= MICROBATCH_MAX_DOCS:
+                break
+            if candidate is None or candidate.id == job.id or candidate.func_name != job.func_name:
+                continue
+            other = candidate.args[0] if candidate.args and isinstance(candidate.args[0], dict) else None
+            if (other is None or 'po_text_ref' not in other or 'resumes_job' in other
+                    or other.get('po_text_len', MICROBATCH_MAX_DOC_CHARS + 1) > MICROBATCH_MAX_DOC_CHARS
+                    or str(other.get('record_id')) in record_ids
+                    or total_chars + other['po_text_len'] > MICROBATCH_MAX_CHARS
+                    or schema_hash(other.get('prompt_json', {})) != target_hash
+                    or cancel_reason(candidate.id)):
+                continue
+            if claim_job(candidate.id, job.id) == job.id:
+                batch_ids.append(candidate.id)
+                record_ids.add(str(other['record_id']))
+                total_chars += other['po_text_len']
+        if batch_ids:
+            redis_conn.rpush(members_key, *batch_ids)
+            redis_conn.expire(members_key, FUSION_CLAIM_TTL)
+
+    batch = [(job.id, data)]
+    for other_job in Job.fetch_many(batch_ids, connection=redis_conn):
+        if other_job is not None:
+            batch.append((other_job.id, other_job.args[0]))
+    return batch
+
+def process_microbatch(batch: List[Tuple[str, Dict[str, Any]]], start_time: float):
+    """Runs extraction and summary passes once for the whole batch, falling back per document."""
+    docs = []
+    for _, member in batch:
+        raw_text = load_po_text(member)
+        docs.append((str(member['record_id']), prepare_text(raw_text) if len(raw_text.strip()) >= 10 else ""))
+    docs = [(rid, text) for rid, text in docs if text]
+
+    prompt_map = batch[0][1]['prompt_json']
+    summary_keys, extraction_keys = split_prompt_keys(prompt_map)
+    results: Dict[str, Dict[str, Any]] = {rid: {} for rid, _ in docs}
+    record_metric("microbatch_batches")
+    record_metric("microbatch_docs", len(docs))
+    log_safe_event(f"Micro-batch: {len(docs)} short documents in one prompt ({sum(len(t) for _, t in docs)} chars)")
+
+    for keys, is_summary in ((extraction_keys, False), (summary_keys, True)):
+        if not keys or not docs:
+            continue
+        pass_prompt = {k: prompt_map[k] for k in keys}
+        try:
+            batch_res = query_ollama_batch(docs, pass_prompt, is_summary=is_summary)
+        except JobAborted:
+            raise
+        except Exception as e:
+            log_safe_event(f"Micro-batch {'summary' if is_summary else 'extraction'} failed, "
+                           f"falling back to per-document calls: {e}")
+            batch_res = {}
+
+        for rid, text in docs:
+            doc_res = batch_res.get(rid)
+            try:
+                if isinstance(doc_res, dict):
+                    doc_res = requery_missing_keys(text, pass_prompt, doc_res, is_summary=is_summary)
+                else:
+                    record_metric("microbatch_fallbacks")
+                    doc_res = (run_llm_pass(text, pass_prompt, is_summary=True) if is_summary
+                               else run_extraction_pass(text, pass_prompt))
+            except JobAborted:
+                raise
+            except Exception as e:
+                log_safe_event(f"{'Summarization' if is_summary else 'Extraction'} failed for {rid}: {e}")
+                doc_res = {k: f"Error: {str(e)[:100]}..." for k in keys} if is_summary else {}
+            results[rid].update(doc_res)
+
+    write_results([(member, results[str(member['record_id'])]) for _, member in batch
+                   if results.get(str(member['record_id']))])
+    log_safe_event(f"PERFORMANCE: Job finished in {time.time() - start_time:.2f} seconds")
+    return "Success"
+
+def process_po_job(data: Dict[str, Any],
+                   sink: Optional[Callable[[List[Tuple[Dict[str, Any], Dict[str, Any]]]], None]] = None):
+    """
+    Runs the full pipeline for one request. RQ calls it with the payload only;
+    bulk.py passes a sink that receives the (job data, results) pairs instead of
+    writing them (or any error) to QuickBase. Profiled jobs (see profiling.py)
+    are traced stage by stage.
+    """
+    job = get_current_job()
+    profile = start_profile(job.id if job else None, data)
+    if profile is None:
+        return _run_po_job(data, sink)
+    outcome = "Failed"
+    try:
+        outcome = _run_po_job(data, sink)
+        return outcome
+    finally:
+        try:
+            meta = finish_profile(redis_conn, profile, outcome)
+            log_safe_event(f"Profile saved for job {meta['job_id']}: {meta['seconds']:.2f}s, "
+                           f"/api/profiles/{meta['job_id']}")
+        except Exception as e:
+            logger.warning(f"Could not save profile for record {data.get('record_id')}: {e}")
+
+def _run_po_job(data: Dict[str, Any],
+                sink: Optional[Callable[[List[Tuple[Dict[str, Any], Dict[str, Any]]]], None]]):
     start_time = time.time()
+    profile_stage('setup')
     record_id = data['record_id']
     request_name = data.get('request_name', 'Unknown Request')
     
     log_safe_event(f"Processing Job: '{request_name}' for Record: {record_id}")
 
     # --- GUARD RAILS ---
-    if not data.get('po_text') or len(data.get('po_text', '').strip()) < 10:
+    if data.get('po_text_len', 10) < 10:
         log_safe_event("Skipped: Text empty.")
         return "Skipped"
 
+    # --- FUSION / MICRO-BATCH CLAIM ---
+    # Every job claims itself first; one already claimed by another job was
+    # handled by it, whether fusion or micro-batching claimed it
+    job = get_current_job()
+    if job is not None:
+        owner = claim_job(job.id, job.id)
+        if owner != job.id:
+            log_safe_event(f"Record {record_id} was merged into job {owner} (fusion or micro-batch)")
+            return "Fused"
+
+    # --- DEADLINE / CANCELLATION ---
+    start_job_context(job.id if job else None, data)
+    try:
+        check_abort()
+    except JobAborted as e:
+        summary_keys, extraction_keys = split_prompt_keys(data.get('prompt_json', {}))
+        text_len = data.get('po_text_len', 0)
+        reclaimed = sum(estimate_stage_seconds(stage, text_len) or 0
+                        for stage, keys in (('extraction', extraction_keys), ('summary', summary_keys)) if keys)
+        return record_abort(e.reason, record_id, reclaimed, [data] if sink is None else [])
+
+    profile_stage('fusion')
+    members = collect_fusion_group(data)
+
+    if len(members) == 1:
+        batch = collect_microbatch(data)
+        if len(batch) > 1:
+            profile_stage('microbatch')
+            try:
+                return process_microbatch(batch, start_time)
+            except JobAborted as e:
+                return record_abort(e.reason, record_id, 0.0, [data] if sink is None else [])
+
+    profile_stage('load_text')
+    raw_text = load_po_text(data)
+    if len(raw_text.strip()) < 10:
+        log_safe_event("Skipped: Text empty.")
+        return "Skipped"
+
+    # --- PREPROCESSING ---
+    profile_stage('preprocess')
+    po_text = prepare_text(raw_text)
+
     # --- IMPROVED SPLIT LOGIC ---
-    full_prompt_map = data.get('prompt_json', {})
+    full_prompt_map, key_maps = fuse_prompts(members)
+    if len(members) > 1:
+        record_metric("fused_requests", len(members) - 1)
+        record_metric("fusion_prompt_chars_saved", len(po_text) * (len(members) - 1))
+        log_safe_event(
+            f"Fused {len(members)} requests for Record {record_id} into one inference "
+            f"({len(full_prompt_map)} keys)"
+        )
     
     # 1. Identify keys based on name "summary" or "description"
-    summary_keys = [k for k in full_prompt_map.keys() if 'summary' in k.lower() or 'description' in k.lower()]
-    extraction_keys = [k for k in full_prompt_map.keys() if k not in summary_keys]
+    summary_keys, extraction_keys = split_prompt_keys(full_prompt_map)
+    # Told about a missed deadline (bulk.py handles its own errors); fused
+    # members go back to the queue, or expire on their own deadline
+    expired_members = [data] if sink is None else []
 
     final_results = {}
     any_success = False
+    profile_stage('checkpoint_revision')
+    ckpt_key = checkpoint_key(data, raw_text, full_prompt_map)
+    checkpoint = load_checkpoint(ckpt_key)
+    revision = load_revision(data)
+    diff = revision_diff(record_id, revision, po_text)
+    baseline: Dict[str, Dict[str, Any]] = {}     # Timings of passes that ran in full (for experiments)
 
     # 2. Run Strict Extraction (Dates, Amounts) - HIGH IMPORTANCE
+    # Stage boundary: yield to waiting high-priority work (see maybe_preempt)
+    preempted = maybe_preempt(data, [(stage, len(po_text)) for stage, keys in
+                                     (('extraction', extraction_keys), ('summary', summary_keys))
+                                     if keys and stage not in checkpoint])
+    if preempted:
+        return preempted
+
     if extraction_keys:
+        profile_stage('extraction')
+        stage_start = time.time()
         try:
             logger.info(f"Extracting Data fields: {extraction_keys}")
             extraction_prompt = {k: full_prompt_map[k] for k in extraction_keys}
             
             # Call with is_summary=False for strict settings
-            res = query_ollama(data['po_text'], extraction_prompt, is_summary=False)
+            if diff is not None:
+                # Revised document: only keys touched by the edit are re-asked
+                res = run_checkpointed_stage(
+                    ckpt_key, checkpoint, 'extraction',
+                    lambda: run_revision_extraction(record_id, po_text, extraction_prompt, revision, diff)
+                )
+            else:
+                reset_usage()
+                res = run_checkpointed_stage(
+                    ckpt_key, checkpoint, 'extraction',
+                    lambda: run_extraction_pass(po_text, extraction_prompt),
+                    chars=len(po_text)
+                )
+                if 'extraction' not in checkpoint:
+                    baseline['extraction'] = {"seconds": time.time() - stage_start, **current_usage()}
             final_results.update(res)
             any_success = True
+        except JobAborted as e:
+            reclaimed = max(0.0, (estimate_stage_seconds('extraction', len(po_text)) or 0) - (time.time() - stage_start))
+            if summary_keys:
+                reclaimed += estimate_stage_seconds('summary', len(po_text)) or 0
+            return record_abort(e.reason, record_id, reclaimed, expired_members)
         except Exception as e:
             log_safe_event(f"Extraction failed: {e}")
 
     # 3. Run Summarization (Isolated) - LOWER IMPORTANCE / HIGHER RISK
-    if summary_keys:
+    # Reused as-is when a resubmission did not change any section
+    reused_summary = None
+    if summary_keys and diff is not None and not diff.changed and not diff.removed:
+        reused_summary = reusable_results(revision, {k: full_prompt_map[k] for k in summary_keys})
+    if reused_summary is not None:
+        final_results.update(reused_summary)
+        any_success = True
+        summary_keys = []
+        record_metric("revision_tokens_saved_est", len(po_text) // CHARS_PER_TOKEN)
+        log_safe_event(f"Revision of {record_id}: text unchanged, reused {len(reused_summary)} summary fields")
+
+    # Skipped when the time left before the deadline cannot cover it
+    summary_skipped = False
+    left = seconds_left()
+    summary_estimate = estimate_stage_seconds('summary', len(po_text)) if summary_keys else None
+    if summary_keys and 'summary' not in checkpoint and left is not None \
+            and left < max(DEADLINE_SUMMARY_MIN_SECONDS, summary_estimate or 0):
+        summary_skipped = True
+        record_metric("deadline_summary_skipped")
+        if summary_estimate:
+            record_metric("gpu_seconds_reclaimed", summary_estimate)
+        log_safe_event(f"Skipped summary pass for {record_id}: {max(0.0, left):.0f}s left before the deadline "
+                       f"(estimated {summary_estimate or 0:.0f}s)")
+    elif summary_keys:
+        # Second boundary, unless extraction failed (a continuation would only repeat it)
+        if 'summary' not in checkpoint and (any_success or not extraction_keys):
+            preempted = maybe_preempt(data, [('summary', len(po_text))])
+            if preempted:
+                return preempted
+        profile_stage('summary')
+        stage_start = time.time()
         try:
             logger.info(f"Generating Summary fields: {summary_keys}")
             summary_prompt = {k: full_prompt_map[k] for k in summary_keys}
             
             # Call with is_summary=True for creative settings
-            res = query_ollama(data['po_text'], summary_prompt, is_summary=True)
+            reset_usage()
+            res = run_checkpointed_stage(
+                ckpt_key, checkpoint, 'summary',
+                lambda: run_llm_pass(po_text, summary_prompt, is_summary=True),
+                chars=len(po_text)
+            )
+            if 'summary' not in checkpoint:
+                baseline['summary'] = {"seconds": time.time() - stage_start, **current_usage()}
             final_results.update(res)
             any_success = True
+        except JobAborted as e:
+            reclaimed = max(0.0, (summary_estimate or 0) - (time.time() - stage_start))
+            if e.reason != 'deadline' or not any_success:
+                return record_abort(e.reason, record_id, reclaimed, expired_members)
+            # Out of time: the extraction results are still written
+            summary_skipped = True
+            record_metric("deadline_summary_skipped")
+            record_metric("gpu_seconds_reclaimed", reclaimed)
+            log_safe_event(f"Summary pass for {record_id} stopped at the deadline, writing extraction results only")
         except Exception as e:
             log_safe_event(f"Summarization failed: {e}")
             for k in summary_keys:
                 final_results[k] = f"Error: {str(e)[:100]}..."
 
-    # 4. Update QuickBase with aggregated results
-    try:
-        if not any_success:
-            raise Exception("Both Extraction and Summarization steps failed.")
+    # 4. Update QuickBase with aggregated results (split back out per fused request)
+    if not any_success and summary_skipped:
+        return record_abort('deadline', record_id, 0.0, expired_members)
+    if not any_success:
+        e = Exception("Both Extraction and Summarization steps failed.")
+        for _, member in members:
+            log_safe_event(f"Job failed for {member['record_id']}: {e}")
+            if sink is None:
+                report_job_error(member, e)
+        raise e
 
-        logger.info(f"Updating QuickBase table {data['target_table_id']}...")
-        update_quickbase(
-            record_id,
-            data['target_table_id'],
-            data['target_field_ids'],
-            final_results
-        )
-        
-        end_time = time.time()
-        duration = end_time - start_time
-        log_safe_event(f"Job complete for {record_id}")
-        log_safe_event(f"PERFORMANCE: Job finished in {duration:.2f} seconds")
-        return "Success"
+    profile_stage('write_results')
+    (sink or write_results)([
+        (member, {k: final_results[fk] for k, fk in key_map.items() if fk in final_results})
+        for (_, member), key_map in zip(members, key_maps)
+    ])
 
-    except Exception as e:
-        log_safe_event(f"Job failed for {record_id}: {e}")
-        if 'error_field_id' in data and 'target_table_id' in data:
-            logger.info(f"Reporting error to QuickBase field {data['error_field_id']}...")
-            update_quickbase_error(
-                record_id,
-                data['target_table_id'],
-                data['error_field_id'],
-                str(e)
-            )
-        raise e
+    profile_stage('bookkeeping')
+    save_revision(data, po_text, full_prompt_map, final_results)
+    schedule_experiment(data, full_prompt_map, final_results, baseline)
+    clear_checkpoint(ckpt_key)
+    end_time = time.time()
+    duration = end_time - start_time
+    log_safe_event(f"PERFORMANCE: Job finished in {duration:.2f} seconds")
+    return "Success"
 
 if __name__ == '__main__':
     # Read queues from Env Var, default to 'default'
-    queue_names = os.getenv('WORKER_QUEUES', 'default').split(',')
+    queue_names = WORKER_QUEUE_NAMES
     
     with Connection(redis_conn):
         logger.info(f"Worker listening on queues: {queue_names}")
-        worker = Worker(map(Queue, queue_names))
-        worker.work()
+        if WORKER_MODE == 'warm':
+            # Jobs run in this process; systemd or autoscaler.py restarts it when it recycles
+            worker_class = WarmFairWorker if FAIR_QUEUING else WarmWorker
+        else:
+            worker_class = FairWorker if FAIR_QUEUING else Worker
+        worker = worker_class(map(Queue, queue_names))
+        # The scheduler runs the delayed retries configured by the API (see JOB_RETRIES)
+        worker.work(with_scheduler=True)
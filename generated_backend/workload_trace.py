@@ -0,0 +1,56 @@
+import hashlib
+import json
+import os
+import re
+import time
+from typing import Any, Dict, List
+
+from doc_source import document_key
+from payload_store import store_text
+
+# Workload Trace
+# When WORKLOAD_TRACE is on, the API appends one anonymized entry per accepted
+# request to the 'workload_trace' Redis list: arrival time, queue, text length,
+# schema keys and a text fingerprint. replay.py exports the list and re-submits
+# it at a chosen speed, so capacity changes can be judged before production.
+# Document text is left out unless WORKLOAD_TRACE_TEXT=redacted, which keeps a
+# copy with every letter and digit masked (layout and length stay realistic).
+
+WORKLOAD_TRACE = os.getenv('WORKLOAD_TRACE', 'false').lower() == 'true'
+WORKLOAD_TRACE_TEXT = os.getenv('WORKLOAD_TRACE_TEXT', 'none').lower()     # 'none' or 'redacted'
+WORKLOAD_TRACE_MAX = int(os.getenv('WORKLOAD_TRACE_MAX', 50000))            # Oldest entries are trimmed
+TRACE_KEY = "workload_trace"
+
+_UPPER_RE = re.compile(r'[A-Z]')
+_LOWER_RE = re.compile(r'[a-z]')
+_DIGIT_RE = re.compile(r'[0-9]')
+
+def anonymize(value: Any) -> str:
+    """Short stable hash, so tenants and documents can be told apart but not identified."""
+    return hashlib.sha256(str(value).encode('utf-8')).hexdigest()[:12]
+
+def redact_text(text: str) -> str:
+    """Masks letters and digits but keeps whitespace, punctuation and length."""
+    return _DIGIT_RE.sub('9', _LOWER_RE.sub('x', _UPPER_RE.sub('X', text)))
+
+def record_arrival(conn, data: Dict[str, Any], queue_name: str, priority: str, po_text: str):
+    """Appends one trace entry for an accepted request; tracing never fails the request."""
+    entry = {
+        "t": round(time.time(), 3),
+        "queue": queue_name,
+        "priority": priority,
+        "text_len": data.get('po_text_len', len(po_text)),
+        "keys": list((data.get('prompt_json') or {}).keys()),
+        "fingerprint": anonymize(document_key(data)),
+        "tenant": anonymize(data.get('target_table_id')),
+    }
+    if WORKLOAD_TRACE_TEXT == 'redacted' and po_text:
+        # Stored like any document; export the trace within DOC_TTL to keep the text
+        entry["text_ref"] = store_text(conn, redact_text(po_text))
+    pipe = conn.pipeline(transaction=False)
+    pipe.rpush(TRACE_KEY, json.dumps(entry))
+    pipe.ltrim(TRACE_KEY, -WORKLOAD_TRACE_MAX, -1)
+    pipe.execute()
+
+def read_trace(conn) -> List[Dict[str, Any]]:
+    return [json.loads(raw) for raw in conn.lrange(TRACE_KEY, 0, -1)]